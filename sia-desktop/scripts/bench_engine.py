@@ -0,0 +1,126 @@
+"""对比每次请求新建引擎（旧行为）与进程级引擎缓存的单次请求开销。
+
+用法: python scripts/bench_engine.py [--requests 200] [--files 1000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+
+from sia.core import db, indexer  # noqa: E402
+from sia.core.config import SIAConfig  # noqa: E402
+from sia.core.db import (  # noqa: E402
+    Asset,
+    Author,
+    File,
+    Item,
+    count_files_by_author,
+    get_engine,
+    session_scope,
+)
+from sia.core.migrations import migrate  # noqa: E402
+
+
+def legacy_engine(base_dir: Path):
+    engine = create_engine(f"sqlite:///{base_dir / db.DB_NAME}", future=True)
+    migrate(engine)
+    return engine
+
+
+def populate(base_dir: Path, files: int) -> None:
+    engine = get_engine(base_dir)
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(Author), [{"name": "bench", "folder": "00001_bench"}])
+        conn.execute(
+            insert(Item), [{"author_id": 1, "post_id": "p1", "saved_at": start}]
+        )
+        conn.execute(
+            insert(Asset),
+            [
+                {"sha256": f"{n:064x}", "ext": "jpg", "bytes": 1, "created_at": start}
+                for n in range(files)
+            ],
+        )
+        conn.execute(
+            insert(File),
+            [
+                {
+                    "asset_id": n + 1,
+                    "item_id": 1,
+                    "author_id": 1,
+                    "name": f"00001_bench_{n:07d}.jpg",
+                    "mtime": start + timedelta(seconds=n),
+                }
+                for n in range(files)
+            ],
+        )
+
+
+def measure(fn, requests: int) -> tuple[float, float]:
+    samples = []
+    for _ in range(requests):
+        began = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - began) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--files", type=int, default=1000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = Path(tmp)
+        cfg = SIAConfig(base_dir=base_dir)
+        populate(base_dir, args.files)
+
+        def count_with(factory):
+            def run() -> None:
+                with session_scope(factory(base_dir)) as session:
+                    count_files_by_author(session, "bench")
+
+            return run
+
+        def paginate_with(factory):
+            def run() -> None:
+                original = indexer.get_read_engine
+                indexer.get_read_engine = factory
+                try:
+                    indexer.paginate(page=1, page_size=40, query="bench", config=cfg)
+                finally:
+                    indexer.get_read_engine = original
+
+            return run
+
+        cases = (
+            ("count", count_with(legacy_engine), count_with(get_engine)),
+            (
+                "paginate q=bench",
+                paginate_with(legacy_engine),
+                paginate_with(get_engine),
+            ),
+        )
+        print(f"{'请求':<18}{'旧 中位/p95 (ms)':>22}{'新 中位/p95 (ms)':>22}")
+        for name, before, after in cases:
+            old_median, old_p95 = measure(before, args.requests)
+            new_median, new_p95 = measure(after, args.requests)
+            print(
+                f"{name:<18}{old_median:>11.2f} / {old_p95:<8.2f}{new_median:>11.2f} / {new_p95:<8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
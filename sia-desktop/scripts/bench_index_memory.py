@@ -0,0 +1,168 @@
+"""测量 build_index 在不同规模图库下的峰值内存（RSS）。
+
+用法: python scripts/bench_index_memory.py [--rows 100000 1000000] [--legacy]
+
+每个规模先生成临时数据库，再在独立子进程中执行导出，读取子进程的 ru_maxrss。
+--legacy 额外运行旧实现（ORM 对象列表 + 缩进 json.dumps）作对照。仅支持 Linux/macOS。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC))
+
+from sqlalchemy import desc, insert, select  # noqa: E402
+
+from sia.core import indexer  # noqa: E402
+from sia.core.config import SIAConfig  # noqa: E402
+from sia.core.db import (  # noqa: E402
+    Asset,
+    Author,
+    File,
+    Item,
+    get_engine,
+    session_scope,
+)
+
+CHUNK = 50_000
+
+
+def populate(base_dir: Path, rows: int) -> None:
+    engine = get_engine(base_dir)
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Author),
+            [
+                {"name": f"author{n}", "folder": f"{n:05d}_author{n}"}
+                for n in range(1000)
+            ],
+        )
+        conn.execute(
+            insert(Item),
+            [
+                {
+                    "author_id": n + 1,
+                    "post_id": f"post{n}",
+                    "source": "https://example.com/p",
+                    "saved_at": start,
+                }
+                for n in range(1000)
+            ],
+        )
+        for offset in range(0, rows, CHUNK):
+            numbers = range(offset, min(rows, offset + CHUNK))
+            conn.execute(
+                insert(Asset),
+                [
+                    {
+                        "sha256": f"{n:064x}",
+                        "ext": "jpg",
+                        "bytes": 1,
+                        "created_at": start,
+                    }
+                    for n in numbers
+                ],
+            )
+            conn.execute(
+                insert(File),
+                [
+                    {
+                        "asset_id": n + 1,
+                        "item_id": n % 1000 + 1,
+                        "author_id": n % 1000 + 1,
+                        "name": f"{n % 1000:05d}_author{n % 1000}_{n:07d}.jpg",
+                        "mtime": start + timedelta(seconds=n),
+                    }
+                    for n in numbers
+                ],
+            )
+
+
+def legacy_build(cfg: SIAConfig) -> None:
+    engine = get_engine(cfg.base_dir)
+    with session_scope(engine) as session:
+        stmt = (
+            select(File, Item, Asset.sha256)
+            .outerjoin(Item, File.item_id == Item.id)
+            .join(Asset, File.asset_id == Asset.id)
+            .order_by(desc(File.mtime))
+        )
+        gallery = [
+            indexer._gallery_item(f, i, sha) for f, i, sha in session.execute(stmt)
+        ]
+    output = [item.to_json() for item in gallery]
+    (cfg.base_dir / "images.json").write_text(
+        json.dumps(output, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+
+
+def child(base_dir: Path, mode: str) -> None:
+    cfg = SIAConfig(base_dir=base_dir)
+    get_engine(base_dir)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    began = time.perf_counter()
+    if mode == "legacy":
+        legacy_build(cfg)
+    else:
+        indexer.build_index(cfg)
+    elapsed = time.perf_counter() - began
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1 if sys.platform == "darwin" else 1024
+    print(
+        json.dumps({"before": before * scale, "peak": peak * scale, "seconds": elapsed})
+    )
+
+
+def measure(base_dir: Path, mode: str) -> dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", mode, str(base_dir)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--legacy", action="store_true")
+    parser.add_argument(
+        "--child", nargs=2, metavar=("MODE", "DIR"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+    if args.child:
+        child(Path(args.child[1]), args.child[0])
+        return
+
+    modes = ["stream", "legacy"] if args.legacy else ["stream"]
+    print(
+        f"{'行数':>9} {'实现':>7} {'导出前(MB)':>11} {'峰值(MB)':>9} {'增量(MB)':>9} {'耗时(s)':>8} {'文件(MB)':>9}"
+    )
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            base_dir = Path(tmp)
+            populate(base_dir, rows)
+            for mode in modes:
+                result = measure(base_dir, mode)
+                size = (base_dir / "images.json").stat().st_size / 2**20
+                before, peak = result["before"] / 2**20, result["peak"] / 2**20
+                print(
+                    f"{rows:>9} {mode:>7} {before:>11.1f} {peak:>9.1f} {peak - before:>9.1f} "
+                    f"{result['seconds']:>8.2f} {size:>9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
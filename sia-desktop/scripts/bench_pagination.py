@@ -0,0 +1,138 @@
+"""对比 /api/items 偏移分页与游标分页在不同页深下的耗时，以及全文检索与 LIKE 扫描的耗时。
+
+用法: python scripts/bench_pagination.py [--files 200000] [--page-size 40] [--search 0123456]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from sqlalchemy import desc, func, insert, select  # noqa: E402
+
+from sia.core import indexer  # noqa: E402
+from sia.core.config import SIAConfig  # noqa: E402
+from sia.core.db import (  # noqa: E402
+    FILE_REL_PATH,
+    Asset,
+    Author,
+    File,
+    Item,
+    get_engine,
+    session_scope,
+)
+
+PAGES = (1, 10, 100, 1000, 5000)
+
+
+def populate(base_dir: Path, files: int) -> None:
+    engine = get_engine(base_dir)
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(Author), [{"name": "bench", "folder": "00001_bench"}])
+        conn.execute(
+            insert(Item), [{"author_id": 1, "post_id": "p1", "saved_at": start}]
+        )
+        conn.execute(
+            insert(Asset),
+            [
+                {"sha256": f"{n:064x}", "ext": "jpg", "bytes": 1, "created_at": start}
+                for n in range(files)
+            ],
+        )
+        conn.execute(
+            insert(File),
+            [
+                {
+                    "asset_id": n + 1,
+                    "item_id": 1,
+                    "author_id": 1,
+                    "name": f"00001_bench_{n:07d}.jpg",
+                    "mtime": start + timedelta(seconds=n),
+                }
+                for n in range(files)
+            ],
+        )
+
+
+def timed(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - began)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--page-size", type=int, default=40)
+    parser.add_argument("--search", default="0123456", help="检索词，对比 FTS5 与 LIKE")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg = SIAConfig(base_dir=Path(tmp))
+        populate(cfg.base_dir, args.files)
+        max_page = args.files // args.page_size
+
+        cursors = {1: ""}
+        cursor = ""
+        for page in range(1, min(max(PAGES), max_page) + 1):
+            if page in PAGES:
+                cursors[page] = cursor
+            cursor = indexer.paginate(
+                page_size=args.page_size, config=cfg, cursor=cursor
+            )["next_cursor"]
+
+        print(f"{args.files} 个文件，每页 {args.page_size}")
+        print(f"{'页码':>6} {'OFFSET(ms)':>12} {'游标(ms)':>10}")
+        for page in PAGES:
+            if page > max_page:
+                break
+            offset_ms = timed(
+                lambda page=page: indexer.paginate(
+                    page=page, page_size=args.page_size, config=cfg
+                )
+            )
+            cursor_ms = timed(
+                lambda page=page: indexer.paginate(
+                    page_size=args.page_size, config=cfg, cursor=cursors[page]
+                )
+            )
+            print(f"{page:>6} {offset_ms:>12.2f} {cursor_ms:>10.2f}")
+
+        if args.search:
+            fts_ms = timed(
+                lambda: indexer.paginate(
+                    page_size=args.page_size, query=args.search, config=cfg
+                )
+            )
+            engine = get_engine(cfg.base_dir)
+
+            def like_scan() -> None:
+                with session_scope(engine) as session:
+                    stmt = (
+                        select(File)
+                        .join(Author, File.author_id == Author.id)
+                        .where(FILE_REL_PATH.like(f"%{args.search}%"))
+                    )
+                    session.scalar(select(func.count()).select_from(stmt.subquery()))
+                    session.execute(
+                        stmt.order_by(desc(File.mtime)).limit(args.page_size)
+                    ).all()
+
+            like_ms = timed(like_scan)
+            print(
+                f"检索 {args.search!r}: FTS5 {fts_ms:.2f} ms，LIKE '%...%' {like_ms:.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""对比旧表结构（每行重复作者名与完整路径、十六进制摘要）与 authors 表 + 目录内文件名 + 32 字节摘要的库大小与查询耗时。
+
+两边执行与应用一致的等价查询，只比较存储布局本身；新库由 migrations 从旧库转换而来（含 VACUUM），全文索引两边都不计入。
+用法: python scripts/bench_storage.py [--files 200000] [--authors 500] [--repeat 9]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from sia.core.db import DB_NAME, apply_pragmas, enable_wal  # noqa: E402
+from sia.core.migrations import migrate  # noqa: E402
+
+LEGACY_DDL = """
+CREATE TABLE assets (id INTEGER PRIMARY KEY, sha256 VARCHAR(128) NOT NULL UNIQUE, ext VARCHAR(16) NOT NULL,
+    bytes INTEGER NOT NULL, width INTEGER, height INTEGER, exif_taken_at DATETIME, phash VARCHAR(16),
+    created_at DATETIME NOT NULL);
+CREATE TABLE items (id INTEGER PRIMARY KEY, author VARCHAR(128) NOT NULL, post_id VARCHAR(128) NOT NULL,
+    source VARCHAR(512), caption TEXT, saved_at DATETIME NOT NULL);
+CREATE TABLE files (id INTEGER PRIMARY KEY, asset_id INTEGER NOT NULL REFERENCES assets(id),
+    item_id INTEGER REFERENCES items(id), rel_path VARCHAR(512) NOT NULL UNIQUE, folder VARCHAR(256) NOT NULL,
+    mtime DATETIME NOT NULL);
+CREATE INDEX ix_files_item_id ON files (item_id);
+CREATE INDEX ix_files_mtime ON files (mtime);
+CREATE INDEX ix_files_asset_id ON files (asset_id);
+CREATE INDEX ix_files_author ON files (folder, mtime, id, asset_id);
+CREATE INDEX ix_items_author_saved_at ON items (author, saved_at);
+CREATE INDEX ix_items_saved_at ON items (saved_at);
+"""
+
+REL_PATH = "CASE WHEN authors.folder = '' THEN files.name ELSE authors.folder || '/' || files.name END"
+
+PAGE_OLD = """
+    SELECT files.id, files.rel_path, files.mtime, assets.sha256 FROM files JOIN assets ON assets.id = files.asset_id
+    WHERE files.folder = ? ORDER BY files.mtime DESC, files.id DESC LIMIT 40 OFFSET 200
+"""
+PAGE_NEW = f"""
+    SELECT files.id, {REL_PATH}, files.mtime, assets.sha256 FROM files
+    JOIN authors ON authors.id = files.author_id JOIN assets ON assets.id = files.asset_id
+    WHERE files.author_id = ? ORDER BY files.mtime DESC, files.id DESC LIMIT 40 OFFSET 200
+"""
+COUNTS_OLD = "SELECT folder, count(*) FROM files GROUP BY folder"
+COUNTS_NEW = "SELECT author_id, count(*) FROM files GROUP BY author_id"
+DIGESTS_OLD = "SELECT assets.sha256, files.rel_path FROM assets JOIN files ON files.asset_id = assets.id WHERE assets.sha256 IN ({})"
+DIGESTS_NEW = (
+    f"SELECT assets.sha256, {REL_PATH} FROM assets JOIN files ON files.asset_id = assets.id "
+    "JOIN authors ON authors.id = files.author_id WHERE assets.sha256 IN ({})"
+)
+EXPORT_OLD = """
+    SELECT files.folder, files.rel_path, files.mtime, items.post_id, assets.sha256 FROM files
+    LEFT JOIN items ON items.id = files.item_id JOIN assets ON assets.id = files.asset_id
+    ORDER BY files.mtime DESC, files.id DESC
+"""
+EXPORT_NEW = """
+    SELECT files.author_id, files.name, files.mtime, items.post_id, assets.sha256 FROM files
+    LEFT JOIN items ON items.id = files.item_id JOIN assets ON assets.id = files.asset_id
+    ORDER BY files.mtime DESC, files.id DESC
+"""
+
+
+def legacy_queries(conn: sqlite3.Connection, digests: list[str]) -> dict[str, object]:
+    marks = ",".join("?" * len(digests))
+    return {
+        "作者分页": lambda: conn.execute(PAGE_OLD, ("author0007",)).fetchall(),
+        "各作者计数": lambda: conn.execute(COUNTS_OLD).fetchall(),
+        "200 个摘要查路径": lambda: conn.execute(
+            DIGESTS_OLD.format(marks), digests
+        ).fetchall(),
+        "全量导出": lambda: conn.execute(EXPORT_OLD).fetchall(),
+    }
+
+
+def normalized_queries(
+    conn: sqlite3.Connection, digests: list[str]
+) -> dict[str, object]:
+    # 与应用一致：作者名先换成 id，摘要在绑定前转成字节，批量导出在内存中还原作者名与路径
+    marks = ",".join("?" * len(digests))
+    blobs = [bytes.fromhex(digest) for digest in digests]
+
+    def page() -> list[tuple]:
+        (author_id,) = conn.execute(
+            "SELECT id FROM authors WHERE name = ?", ("author0007",)
+        ).fetchone()
+        return conn.execute(PAGE_NEW, (author_id,)).fetchall()
+
+    def counts() -> dict[str, int]:
+        names = dict(conn.execute("SELECT id, name FROM authors"))
+        result: dict[str, int] = {}
+        for author_id, count in conn.execute(COUNTS_NEW):
+            result[names[author_id]] = result.get(names[author_id], 0) + count
+        return result
+
+    def export() -> list[tuple]:
+        authors = {
+            author_id: (name, folder)
+            for author_id, name, folder in conn.execute(
+                "SELECT id, name, folder FROM authors"
+            )
+        }
+        rows = []
+        for author_id, name, mtime, post_id, sha256 in conn.execute(EXPORT_NEW):
+            author, folder = authors[author_id]
+            rows.append(
+                (
+                    author,
+                    f"{folder}/{name}" if folder else name,
+                    mtime,
+                    post_id,
+                    sha256.hex(),
+                )
+            )
+        return rows
+
+    return {
+        "作者分页": page,
+        "各作者计数": counts,
+        "200 个摘要查路径": lambda: conn.execute(
+            DIGESTS_NEW.format(marks), blobs
+        ).fetchall(),
+        "全量导出": export,
+    }
+
+
+def populate_legacy(db_path: Path, files: int, authors: int) -> list[str]:
+    rnd = random.Random(1)
+    start = datetime(2020, 1, 1)
+    digests = [rnd.randbytes(32).hex() for _ in range(files)]
+    conn = sqlite3.connect(db_path)
+    conn.executescript(LEGACY_DDL)
+    conn.executemany(
+        "INSERT INTO items (author, post_id, source, saved_at) VALUES (?, ?, ?, ?)",
+        (
+            (
+                f"author{i % authors:04d}",
+                f"post{i:07d}",
+                f"https://example.com/status/{i}",
+                start + timedelta(seconds=4 * i),
+            )
+            for i in range(files // 4)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO assets (sha256, ext, bytes, created_at) VALUES (?, 'jpg', 100000, ?)",
+        ((digest, start) for digest in digests),
+    )
+    rows = []
+    for n in range(files):
+        i = n // 4
+        author = i % authors
+        folder = f"{author + 1:05d}_author{author:04d}"
+        mtime = start + timedelta(seconds=4 * i + n % 4)
+        rows.append(
+            (
+                n + 1,
+                i + 1,
+                f"{folder}/{folder}_{n:07d}.jpg",
+                f"author{author:04d}",
+                mtime,
+            )
+        )
+    conn.executemany(
+        "INSERT INTO files (asset_id, item_id, rel_path, folder, mtime) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return digests
+
+
+def sizes(db_path: Path) -> tuple[int, dict[str, int]]:
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        objects = dict(
+            conn.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name")
+        )
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+    objects = {
+        name: size for name, size in objects.items() if not name.startswith("files_fts")
+    }
+    return sum(objects.values()) // page_size, objects
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - began) * 1000)
+    return statistics.median(samples)
+
+
+def open_db(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    apply_pragmas(conn, readonly=True)
+    return conn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--authors", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=9)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = Path(tmp) / "legacy"
+        normalized = Path(tmp) / "normalized"
+        legacy.mkdir()
+        normalized.mkdir()
+        digests = populate_legacy(legacy / DB_NAME, args.files, args.authors)
+        shutil.copy(legacy / DB_NAME, normalized / DB_NAME)
+        engine = enable_wal(create_engine(f"sqlite:///{normalized / DB_NAME}"))
+        began = time.perf_counter()
+        migrate(engine)
+        engine.dispose()
+        print(f"迁移 {args.files} 行: {time.perf_counter() - began:.1f} s")
+
+        old_pages, old_objects = sizes(legacy / DB_NAME)
+        new_pages, new_objects = sizes(normalized / DB_NAME)
+        print(f"{'对象':<28}{'旧 (MB)':>10}{'新 (MB)':>10}")
+        for name in sorted(
+            set(old_objects) | set(new_objects),
+            key=lambda key: -old_objects.get(key, 0),
+        ):
+            old, new = old_objects.get(name), new_objects.get(name)
+            print(
+                f"{name:<28}{old / 1e6 if old else 0:>10.1f}{new / 1e6 if new else 0:>10.1f}"
+            )
+        print(f"{'页数（不含全文索引）':<28}{old_pages:>10}{new_pages:>10}")
+
+        sample = random.Random(2).sample(digests, 200)
+        old_conn, new_conn = open_db(legacy / DB_NAME), open_db(normalized / DB_NAME)
+        try:
+            old_queries, new_queries = legacy_queries(
+                old_conn, sample
+            ), normalized_queries(new_conn, sample)
+            print(f"{'查询':<20}{'旧 中位 (ms)':>14}{'新 中位 (ms)':>14}")
+            for name, before in old_queries.items():
+                old_ms = timed(before, args.repeat)
+                new_ms = timed(new_queries[name], args.repeat)
+                print(f"{name:<20}{old_ms:>14.2f}{new_ms:>14.2f}")
+        finally:
+            old_conn.close()
+            new_conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import multiprocessing
 import threading
 from pathlib import Path
 from typing import Optional
@@ -31,6 +32,8 @@ class ServerThread(threading.Thread):
 
 
 def main() -> None:  # pragma: no cover - GUI bootstrap
+    # 缩略图进程池使用 spawn；PyInstaller 打包后子进程会重新执行入口，必须最先调用
+    multiprocessing.freeze_support()
     config = CONFIG.get()
     configure_logging(config.log_dir)
     server_thread = ServerThread(config.port)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Optional, Sequence
+
+from .core.config import CONFIG
+from .core.logger import configure_logging
+
+
+def _cmd_migrate_blobs(args: argparse.Namespace) -> None:
+    from .core.blobstore import migrate_library
+
+    report = migrate_library(CONFIG.get(), dry_run=args.dry_run)
+    prefix = "[预览] " if args.dry_run else ""
+    print(
+        f"{prefix}资产 {report.assets}，文件 {report.files}，"
+        f"链接 {report.linked}，跳过 {report.skipped}，回收 {report.bytes_reclaimed} 字节"
+    )
+
+
+def _cmd_backfill_meta(args: argparse.Namespace) -> None:
+    from .core.imagemeta import backfill_metadata
+
+    updated = backfill_metadata(CONFIG.get(), workers=args.workers)
+    print(f"已回填 {updated} 个资产的尺寸/EXIF")
+
+
+def _cmd_backfill_phash(args: argparse.Namespace) -> None:
+    from .core.phash import backfill_phash
+
+    updated = backfill_phash(CONFIG.get(), workers=args.workers)
+    print(f"已为 {updated} 个资产计算感知哈希")
+
+
+def _cmd_duplicates(args: argparse.Namespace) -> None:
+    from .core.phash import duplicate_report
+
+    groups = duplicate_report(CONFIG.get(), distance=args.distance)
+    if args.json:
+        print(json.dumps(groups, ensure_ascii=False, indent=2))
+        return
+    for number, members in enumerate(groups, start=1):
+        print(f"#{number} ({len(members)} 个相似资产)")
+        for member in members:
+            print(
+                f"  {member['phash']}  {', '.join(member['files']) or member['sha256']}"
+            )
+    print(f"共 {len(groups)} 组近似重复（汉明距离 ≤ {args.distance}）")
+
+
+def _cmd_rebuild_search(_args: argparse.Namespace) -> None:
+    from .core.db import get_engine, rebuild_search_index
+
+    count = rebuild_search_index(get_engine(CONFIG.get().base_dir))
+    print(f"全文索引已重建: {count} 个文件")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="sia", description="Social Image Archiver 维护工具"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser(
+        "migrate-blobs", help="将重复文件转换为内容寻址存储的硬链接"
+    )
+    migrate.add_argument("--dry-run", action="store_true", help="只统计不修改")
+    migrate.set_defaults(func=_cmd_migrate_blobs)
+
+    backfill = commands.add_parser(
+        "backfill-meta", help="为缺少尺寸/EXIF 的资产读取文件头回填"
+    )
+    backfill.add_argument(
+        "--workers", type=int, default=None, help="进程数，默认为 CPU 核数"
+    )
+    backfill.set_defaults(func=_cmd_backfill_meta)
+
+    phash = commands.add_parser("backfill-phash", help="为缺少感知哈希的资产计算 dHash")
+    phash.add_argument(
+        "--workers", type=int, default=None, help="进程数，默认为 CPU 核数"
+    )
+    phash.set_defaults(func=_cmd_backfill_phash)
+
+    duplicates = commands.add_parser(
+        "duplicates", help="输出整个图库的近似重复分组报告"
+    )
+    duplicates.add_argument("--distance", type=int, default=6, help="最大汉明距离")
+    duplicates.add_argument("--json", action="store_true", help="以 JSON 输出")
+    duplicates.set_defaults(func=_cmd_duplicates)
+
+    search = commands.add_parser(
+        "rebuild-search", help="重建路径/作者/帖子/来源/配文的全文索引"
+    )
+    search.set_defaults(func=_cmd_rebuild_search)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    configure_logging(CONFIG.get().log_dir)
+    args.func(args)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import select
+
+from .config import CONFIG, SIAConfig
+from .db import FILE_REL_PATH, Asset, Author, File, get_read_engine, session_scope
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+BLOB_DIR_NAME = ".blobs"
+FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    try:
+        with src.open("rb") as fin, dst.open("wb") as fout:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        return True
+    except OSError:
+        dst.unlink(missing_ok=True)
+        return False
+
+
+def link_file(src: Path, dst: Path) -> Optional[str]:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    if _reflink(src, dst):
+        return "reflink"
+    return None
+
+
+def file_sha256(path: Path) -> str:
+    sha = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, base_dir: Path) -> None:
+        self.root = base_dir / BLOB_DIR_NAME
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def has(self, sha256: str) -> bool:
+        return self.path_for(sha256).exists()
+
+    def adopt(self, path: Path, sha256: str) -> bool:
+        blob = self.path_for(sha256)
+        if not blob.exists():
+            mode = link_file(path, blob)
+            if mode is None:
+                logger.warning("文件系统不支持硬链接/reflink，跳过入库 %s", path)
+            return False
+        if _same_file(blob, path):
+            return True
+        tmp = path.with_name(path.name + ".link")
+        tmp.unlink(missing_ok=True)
+        mode = link_file(blob, tmp)
+        if mode is None:
+            logger.warning("无法链接到 %s，保留副本 %s", blob.name, path)
+            return False
+        os.replace(tmp, path)
+        logger.debug("去重 %s -> %s (%s)", path, blob.name, mode)
+        return True
+
+
+def _same_file(a: Path, b: Path) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+@dataclass
+class MigrationReport:
+    assets: int = 0
+    files: int = 0
+    linked: int = 0
+    bytes_reclaimed: int = 0
+    skipped: int = 0
+
+
+def migrate_library(
+    config: Optional[SIAConfig] = None, dry_run: bool = False
+) -> MigrationReport:
+    cfg = config or CONFIG.get()
+    store = BlobStore(cfg.base_dir)
+    report = MigrationReport()
+    engine = get_read_engine(cfg.base_dir)
+    with session_scope(engine) as session:
+        rows = session.execute(
+            select(Asset.sha256, FILE_REL_PATH)
+            .join(File, File.asset_id == Asset.id)
+            .join(Author, File.author_id == Author.id)
+            .order_by(Asset.id, File.id)
+        ).all()
+    seen_assets: set[str] = set()
+    stored: set[str] = set()
+    for sha, rel_path in rows:
+        if sha not in seen_assets:
+            seen_assets.add(sha)
+            report.assets += 1
+        path = cfg.base_dir / rel_path
+        report.files += 1
+        if not path.is_file():
+            report.skipped += 1
+            continue
+        blob = store.path_for(sha)
+        if blob.exists():
+            stored.add(sha)
+            if _same_file(blob, path):
+                continue
+        if file_sha256(path) != sha:
+            logger.warning("内容与记录不符，跳过 %s", path)
+            report.skipped += 1
+            continue
+        if sha not in stored:
+            if not dry_run:
+                store.adopt(path, sha)
+            if dry_run or blob.exists():
+                stored.add(sha)
+            continue
+        size = path.stat().st_size
+        if not dry_run and not store.adopt(path, sha):
+            report.skipped += 1
+            continue
+        report.linked += 1
+        report.bytes_reclaimed += size
+    logger.info(
+        "去重迁移完成: %s 个资产, %s 个文件, 链接 %s 个, 回收 %s 字节",
+        report.assets,
+        report.files,
+        report.linked,
+        report.bytes_reclaimed,
+    )
+    return report
@@ -25,6 +25,15 @@ class DownloadPolicy:
     max_body_kb: int = 64
     max_attempts: int = 4
     timeout: int = 30
+    pool_max_origins: int = 16
+    pool_per_host: int = 4
+    pool_idle_seconds: float = 90.0
+    url_cache_fresh_seconds: int = 86400
+    rate_global_bps: int = 0
+    rate_host_bps: int = 0
+    rate_host_rps: float = 0.0
+    breaker_failures: int = 5
+    breaker_reset_seconds: float = 30.0
 
 
 @dataclass
@@ -33,8 +42,10 @@ class SIAConfig:
     port: int = 18080
     hmac_key: str = "change-me"
     concurrency: int = 2
+    job_workers: int = 2
     retry_backoff: float = 0.5
     enable_hardlinks: bool = False
+    thumb_cache_mb: int = 512
     log_dir: Path = CONFIG_DIR / "logs"
     download: DownloadPolicy = field(default_factory=DownloadPolicy)
 
@@ -59,14 +70,29 @@ class SIAConfig:
             max_body_kb=int(download_data.get("max_body_kb", 64)),
             max_attempts=int(download_data.get("max_attempts", 4)),
             timeout=int(download_data.get("timeout", 30)),
+            pool_max_origins=int(download_data.get("pool_max_origins", 16)),
+            pool_per_host=int(download_data.get("pool_per_host", 4)),
+            pool_idle_seconds=float(download_data.get("pool_idle_seconds", 90.0)),
+            url_cache_fresh_seconds=int(
+                download_data.get("url_cache_fresh_seconds", 86400)
+            ),
+            rate_global_bps=int(download_data.get("rate_global_bps", 0)),
+            rate_host_bps=int(download_data.get("rate_host_bps", 0)),
+            rate_host_rps=float(download_data.get("rate_host_rps", 0.0)),
+            breaker_failures=int(download_data.get("breaker_failures", 5)),
+            breaker_reset_seconds=float(
+                download_data.get("breaker_reset_seconds", 30.0)
+            ),
         )
         return cls(
             base_dir=base_dir,
             port=int(data.get("port", 18080)),
             hmac_key=str(data.get("hmac_key", "change-me")),
             concurrency=int(data.get("concurrency", 2)),
+            job_workers=int(data.get("job_workers", 2)),
             retry_backoff=float(data.get("retry_backoff", 0.5)),
             enable_hardlinks=bool(data.get("enable_hardlinks", False)),
+            thumb_cache_mb=int(data.get("thumb_cache_mb", 512)),
             log_dir=log_dir,
             download=policy,
         )
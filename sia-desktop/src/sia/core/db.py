@@ -1,37 +1,107 @@
 from __future__ import annotations
 
 import contextlib
+import sqlite3
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import Generator, Optional
+from typing import Generator, Iterable, Optional
 
 from sqlalchemy import (
     DateTime,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
+    Text,
+    TypeDecorator,
+    UniqueConstraint,
+    and_,
+    case,
     create_engine,
+    event,
+    false,
     func,
+    or_,
     select,
     text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, relationship
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import column, literal_column, table
+
+from .config import CONFIG, SIAConfig
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+DB_NAME = "sia.db"
+POOL_SIZE = 8
+POOL_MAX_OVERFLOW = 8
+POOL_TIMEOUT = 30
+BUSY_TIMEOUT = 30
+READ_POOL_SIZE = 8
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_KIB = 64 * 1024
 
 
 class Base(DeclarativeBase):
     pass
 
 
+def digest_bytes(value: str | bytes) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    try:
+        return bytes.fromhex(value) if len(value) == 64 else value.encode("utf-8")
+    except ValueError:
+        return value.encode("utf-8")
+
+
+class Digest(TypeDecorator):
+    # SHA-256 以 32 字节存储，读写时仍是 64 位十六进制字符串；非十六进制的旧值按 UTF-8 原样保存
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[str], dialect: any) -> Optional[bytes]:
+        return None if value is None else digest_bytes(value)
+
+    def process_result_value(
+        self, value: Optional[bytes], dialect: any
+    ) -> Optional[str]:
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return value
+        return value.hex() if len(value) == 32 else value.decode("utf-8")
+
+
+class Author(Base):
+    __tablename__ = "authors"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(128), nullable=False)
+    # 作者目录名（相对 base_dir），文件路径只保存目录内的部分；只有帖子没有文件的作者为空
+    folder: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("name", "folder", name="uq_authors_name_folder"),
+        Index("ix_authors_folder", "folder"),
+    )
+
+
 class Asset(Base):
     __tablename__ = "assets"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    sha256: Mapped[str] = mapped_column(String(128), unique=True, nullable=False)
+    sha256: Mapped[str] = mapped_column(Digest, unique=True, nullable=False)
     ext: Mapped[str] = mapped_column(String(16), nullable=False)
     bytes: Mapped[int] = mapped_column(Integer, nullable=False)
     width: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     height: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     exif_taken_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    phash: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, default=datetime.utcnow
     )
@@ -44,41 +114,407 @@ class File(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     asset_id: Mapped[int] = mapped_column(ForeignKey("assets.id"), nullable=False)
-    rel_path: Mapped[str] = mapped_column(String(512), unique=True, nullable=False)
-    folder: Mapped[str] = mapped_column(String(256), nullable=False)
+    item_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("items.id"), nullable=True
+    )
+    author_id: Mapped[int] = mapped_column(ForeignKey("authors.id"), nullable=False)
+    name: Mapped[str] = mapped_column(String(256), nullable=False)
     mtime: Mapped[datetime] = mapped_column(DateTime, nullable=False)
 
     asset: Mapped[Asset] = relationship("Asset", back_populates="files")
+    item: Mapped[Optional["Item"]] = relationship("Item", back_populates="files")
+    author: Mapped[Author] = relationship("Author", lazy="joined", innerjoin=True)
+
+    __table_args__ = (
+        UniqueConstraint("author_id", "name", name="uq_files_author_name"),
+        Index("ix_files_item_id", "item_id"),
+        Index("ix_files_asset_id", "asset_id"),
+        Index("ix_files_mtime", "mtime"),
+        # 按作者分页与计数：显式带上 id 保证 (mtime, id) 顺序，末尾的 asset_id 使计数无需回表
+        Index("ix_files_author", "author_id", "mtime", "id", "asset_id"),
+    )
+
+    @property
+    def rel_path(self) -> str:
+        return join_rel_path(self.author.folder, self.name)
 
 
 class Item(Base):
     __tablename__ = "items"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    author: Mapped[str] = mapped_column(String(128), nullable=False)
+    author_id: Mapped[int] = mapped_column(ForeignKey("authors.id"), nullable=False)
     post_id: Mapped[str] = mapped_column(String(128), nullable=False)
     source: Mapped[Optional[str]] = mapped_column(String(512), nullable=True)
+    caption: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     saved_at: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, default=datetime.utcnow
     )
+    # 写入这条帖子的保存任务；任务重放时据此跳过已落库的工作
+    job_id: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+
+    author: Mapped[Author] = relationship("Author")
+    files: Mapped[list[File]] = relationship("File", back_populates="item")
+
+    __table_args__ = (
+        Index("ix_items_author_saved_at", "author_id", "saved_at"),
+        Index("ix_items_saved_at", "saved_at"),
+        Index("ix_items_job_id", "job_id", unique=True),
+    )
 
     def as_dict(self) -> dict[str, str]:
         return {
-            "author": self.author,
+            "author": self.author.name,
             "post_id": self.post_id,
             "source": self.source or "",
+            "caption": self.caption or "",
             "saved_at": self.saved_at.isoformat(),
         }
 
 
-def get_engine(base_dir: Path) -> any:
-    db_path = base_dir / "sia.db"
-    base_dir.mkdir(parents=True, exist_ok=True)
-    engine = create_engine(f"sqlite:///{db_path}", future=True)
-    Base.metadata.create_all(engine)
+FILE_REL_PATH = case(
+    (Author.folder == "", File.name), else_=Author.folder + "/" + File.name
+)
+
+
+def split_rel_path(rel_path: str) -> tuple[str, str]:
+    folder, _, name = rel_path.replace("\\", "/").partition("/")
+    return (folder, name) if name else ("", folder)
+
+
+def join_rel_path(folder: Optional[str], name: str) -> str:
+    return f"{folder}/{name}" if folder else name
+
+
+def at_paths(session: Session, rel_paths: Iterable[str]) -> any:
+    # 先把目录换成 author_id，使 (author_id, name) 命中 uq_files_author_name
+    wanted: dict[str, set[str]] = {}
+    for folder, name in map(split_rel_path, rel_paths):
+        wanted.setdefault(folder, set()).add(name)
+    # SQLite 对行值 IN 列表不走索引，按作者拆成 OR 后每项都是一次索引查找
+    authors = session.execute(
+        select(Author.id, Author.folder).where(Author.folder.in_(wanted))
+    ).all()
+    terms = [
+        and_(File.author_id == author_id, File.name.in_(sorted(wanted[folder])))
+        for author_id, folder in authors
+    ]
+    return or_(*terms) if terms else false()
+
+
+def author_for(session: Session, name: str, folder: Optional[str] = None) -> Author:
+    stmt = select(Author).where(Author.name == name)
+    if folder is None:
+        author = session.scalars(
+            stmt.order_by(Author.folder.is_(None), Author.id)
+        ).first()
+    else:
+        author = session.scalar(stmt.where(Author.folder == folder))
+        if author is None:
+            # 只有帖子的作者第一次落盘文件时补上目录
+            author = session.scalar(stmt.where(Author.folder.is_(None)))
+            if author is not None:
+                author.folder = folder
+    if author is None:
+        author = Author(name=name, folder=folder)
+        session.add(author)
+        session.flush()
+    return author
+
+
+def author_index(
+    session: Session, ids: Optional[Iterable[int]] = None
+) -> dict[int, tuple[str, Optional[str]]]:
+    # 作者表很小：整表读入后在内存中还原作者名与路径，批量导出时省去逐行连接 authors
+    stmt = select(Author.id, Author.name, Author.folder).order_by(
+        Author.name, Author.folder
+    )
+    if ids is not None:
+        stmt = stmt.where(Author.id.in_(set(ids)))
+    return {
+        author_id: (name, folder) for author_id, name, folder in session.execute(stmt)
+    }
+
+
+def author_ids(session: Session, name: str) -> list[int]:
+    return list(
+        session.scalars(
+            select(Author.id).where(Author.name == name).order_by(Author.id)
+        )
+    )
+
+
+def add_file(
+    session: Session,
+    asset_id: int,
+    rel_path: str,
+    author: str,
+    mtime: datetime,
+    item_id: Optional[int] = None,
+) -> File:
+    folder, name = split_rel_path(rel_path)
+    entry = File(
+        asset_id=asset_id,
+        item_id=item_id,
+        author=author_for(session, author, folder),
+        name=name,
+        mtime=mtime,
+    )
+    session.add(entry)
+    return entry
+
+
+class UrlCache(Base):
+    __tablename__ = "url_cache"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    url: Mapped[str] = mapped_column(String(2048), unique=True, nullable=False)
+    sha256: Mapped[str] = mapped_column(Digest, nullable=False)
+    bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    content_type: Mapped[str] = mapped_column(String(64), nullable=False)
+    etag: Mapped[Optional[str]] = mapped_column(String(256), nullable=True)
+    last_modified: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    checked_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow
+    )
+
+
+class UrlCacheDay(Base):
+    __tablename__ = "url_cache_stats"
+
+    day: Mapped[str] = mapped_column(String(10), primary_key=True)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revalidated: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    bytes_saved: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def as_dict(self) -> dict[str, object]:
+        return {
+            "day": self.day,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+_ENGINES: dict[Path, any] = {}
+_READERS: dict[Path, any] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def apply_pragmas(dbapi_connection: sqlite3.Connection, readonly: bool = False) -> None:
+    # WAL 下读写互不阻塞；synchronous=NORMAL 只在检查点时 fsync，断电最多丢失最后几次提交
+    cursor = dbapi_connection.cursor()
+    try:
+        if readonly:
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+        cursor.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size = -{CACHE_KIB}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+    finally:
+        cursor.close()
+
+
+def enable_wal(engine: any) -> any:
+    event.listen(
+        engine,
+        "connect",
+        lambda dbapi_connection, _record: apply_pragmas(dbapi_connection),
+    )
     return engine
 
 
+def _create_engine(db_path: Path) -> any:
+    # SQLite 文件库：跨线程复用连接，锁等待交给 busy timeout，连接数上限避免写锁争用
+    return enable_wal(
+        create_engine(
+            f"sqlite:///{db_path}",
+            future=True,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT},
+        )
+    )
+
+
+def _create_read_engine(db_path: Path) -> any:
+    uri = f"{db_path.as_uri()}?mode=ro"
+
+    def connect() -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, timeout=BUSY_TIMEOUT
+        )
+        apply_pragmas(connection, readonly=True)
+        return connection
+
+    return create_engine(
+        "sqlite://",
+        creator=connect,
+        poolclass=QueuePool,
+        pool_size=READ_POOL_SIZE,
+        max_overflow=READ_POOL_SIZE,
+        pool_timeout=POOL_TIMEOUT,
+    )
+
+
+def get_engine(base_dir: Path) -> any:
+    key = base_dir.resolve()
+    db_path = key / DB_NAME
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is not None and db_path.exists():
+            return engine
+        if engine is not None:
+            # 数据库文件被移走或删除，旧连接已失效
+            engine.dispose()
+            reader = _READERS.pop(key, None)
+            if reader is not None:
+                reader.dispose()
+        key.mkdir(parents=True, exist_ok=True)
+        engine = _create_engine(db_path)
+        from .migrations import migrate
+
+        migrate(engine)
+        _ENGINES[key] = engine
+        logger.info("数据库已打开: %s", db_path)
+        return engine
+
+
+def get_read_engine(base_dir: Path) -> any:
+    # 只读连接池：查询不占写锁，写入统一走 storage.get_writer
+    get_engine(base_dir)
+    key = base_dir.resolve()
+    with _ENGINES_LOCK:
+        reader = _READERS.get(key)
+        if reader is None:
+            reader = _READERS[key] = _create_read_engine(key / DB_NAME)
+        return reader
+
+
+def dispose_engines(keep: Optional[Path] = None) -> int:
+    keep_key = keep.resolve() if keep is not None else None
+    with _ENGINES_LOCK:
+        stale = [key for key in _ENGINES if key != keep_key]
+        engines = [_ENGINES.pop(key) for key in stale]
+        engines += [_READERS.pop(key) for key in list(_READERS) if key != keep_key]
+    for engine in engines:
+        engine.dispose()
+    return len(stale)
+
+
+def _reset_engines(config: SIAConfig) -> None:
+    closed = dispose_engines(keep=config.base_dir)
+    if closed:
+        logger.info("数据目录已切换，关闭 %s 个数据库连接池", closed)
+
+
+CONFIG.add_listener(_reset_engines)
+
+
+FILES_FTS = "files_fts"
+files_fts = table(FILES_FTS, column("rowid"), column("rank"))
+files_fts_match = literal_column(FILES_FTS).op("MATCH")
+
+_FTS_PATH = "CASE WHEN authors.folder = '' THEN {file}.name ELSE authors.folder || '/' || {file}.name END"
+
+_FTS_ROW = (
+    "SELECT {file}.id, "
+    + _FTS_PATH
+    + """, authors.name, items.post_id, items.source, items.caption
+    FROM (SELECT 1) JOIN authors ON authors.id = {file}.author_id LEFT JOIN items ON items.id = {file}.item_id
+"""
+)
+
+SEARCH_TRIGGERS = (
+    "files_fts_ai",
+    "files_fts_ad",
+    "files_fts_au",
+    "items_fts_au",
+    "authors_fts_au",
+)
+
+_SEARCH_DDL = (
+    f"""
+    CREATE VIRTUAL TABLE {FILES_FTS} USING fts5(
+        rel_path, author, post_id, source, caption,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO {FILES_FTS}(rowid, rel_path, author, post_id, source, caption)
+        {_FTS_ROW.format(file="new")};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+        DELETE FROM {FILES_FTS} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF author_id, name, item_id ON files BEGIN
+        DELETE FROM {FILES_FTS} WHERE rowid = old.id;
+        INSERT INTO {FILES_FTS}(rowid, rel_path, author, post_id, source, caption)
+        {_FTS_ROW.format(file="new")};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF post_id, source, caption ON items BEGIN
+        UPDATE {FILES_FTS} SET post_id = new.post_id, source = new.source, caption = new.caption
+        WHERE rowid IN (SELECT id FROM files WHERE item_id = new.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS authors_fts_au AFTER UPDATE OF name, folder ON authors BEGIN
+        DELETE FROM {FILES_FTS} WHERE rowid IN (SELECT id FROM files WHERE author_id = new.id);
+        INSERT INTO {FILES_FTS}(rowid, rel_path, author, post_id, source, caption)
+        SELECT files.id, {_FTS_PATH.format(file="files")}, authors.name, items.post_id, items.source, items.caption
+        FROM files JOIN authors ON authors.id = files.author_id LEFT JOIN items ON items.id = files.item_id
+        WHERE files.author_id = new.id;
+    END
+    """,
+)
+
+
+def _ensure_search_index(conn: any) -> None:
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FILES_FTS},
+    ).first()
+    if exists:
+        return
+    for statement in _SEARCH_DDL:
+        conn.execute(text(statement))
+    _fill_search_index(conn)
+
+
+def _drop_search_index(conn: any) -> None:
+    conn.execute(text(f"DROP TABLE IF EXISTS {FILES_FTS}"))
+    for trigger in SEARCH_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+
+
+def _fill_search_index(conn: any) -> int:
+    result = conn.execute(text(f"""
+            INSERT INTO {FILES_FTS}(rowid, rel_path, author, post_id, source, caption)
+            SELECT files.id, {_FTS_PATH.format(file="files")}, authors.name, items.post_id, items.source, items.caption
+            FROM files JOIN authors ON authors.id = files.author_id LEFT JOIN items ON items.id = files.item_id
+            """))
+    return result.rowcount
+
+
+def rebuild_search_index(engine: any) -> int:
+    with engine.begin() as conn:
+        _drop_search_index(conn)
+        _ensure_search_index(conn)
+        conn.execute(text(f"INSERT INTO {FILES_FTS}({FILES_FTS}) VALUES ('optimize')"))
+        return conn.execute(text(f"SELECT count(*) FROM {FILES_FTS}")).scalar_one()
+
+
 def get_session(engine: any) -> Generator[Session, None, None]:
     with Session(engine) as session:
         yield session
@@ -89,8 +525,8 @@ def ensure_schema(engine: any) -> None:
 
 
 def count_files_by_author(session: Session, author: str) -> int:
-    stmt = select(func.count(File.id)).join(Item, File.folder == Item.author).where(
-        Item.author == author
+    stmt = select(func.count(File.id)).where(
+        File.author_id.in_(author_ids(session, author))
     )
     return session.scalar(stmt) or 0
 
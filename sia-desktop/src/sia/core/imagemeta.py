@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+
+from .config import CONFIG, SIAConfig
+from .db import FILE_REL_PATH, Asset, Author, File, get_read_engine, session_scope
+from .logger import get_logger
+from .storage import get_writer
+
+logger = get_logger(__name__)
+
+MAX_HEADER_BYTES = 256 * 1024
+BACKFILL_BATCH = 500
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+EXIF_HEADER = b"Exif\x00\x00"
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+JPEG_SOF_MARKERS = {
+    0xC0,
+    0xC1,
+    0xC2,
+    0xC3,
+    0xC5,
+    0xC6,
+    0xC7,
+    0xC9,
+    0xCA,
+    0xCB,
+    0xCD,
+    0xCE,
+    0xCF,
+}
+
+
+@dataclass
+class ImageMeta:
+    width: Optional[int] = None
+    height: Optional[int] = None
+    exif_taken_at: Optional[datetime] = None
+
+
+class _NeedMoreError(Exception):
+    pass
+
+
+def _need(data: bytes, end: int) -> None:
+    if len(data) < end:
+        raise _NeedMoreError
+
+
+def _parse_exif_datetime(value: bytes) -> Optional[datetime]:
+    text = value.split(b"\x00", 1)[0].decode("ascii", "ignore").strip()
+    try:
+        return datetime.strptime(text, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def parse_exif(tiff: bytes) -> Optional[datetime]:
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return None
+    order = "<" if tiff[:2] == b"II" else ">"
+
+    def read_ifd(offset: int) -> dict[int, bytes]:
+        values: dict[int, bytes] = {}
+        if offset + 2 > len(tiff):
+            return values
+        (count,) = struct.unpack_from(f"{order}H", tiff, offset)
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            if entry + 12 > len(tiff):
+                break
+            tag, kind, length = struct.unpack_from(f"{order}HHI", tiff, entry)
+            if kind == 2:
+                if length <= 4:
+                    values[tag] = tiff[entry + 8 : entry + 8 + length]
+                else:
+                    (pointer,) = struct.unpack_from(f"{order}I", tiff, entry + 8)
+                    values[tag] = tiff[pointer : pointer + length]
+            elif kind == 4:
+                values[tag] = tiff[entry + 8 : entry + 12]
+        return values
+
+    (ifd0_offset,) = struct.unpack_from(f"{order}I", tiff, 4)
+    ifd0 = read_ifd(ifd0_offset)
+    taken: Optional[datetime] = None
+    if TAG_EXIF_IFD in ifd0:
+        (exif_offset,) = struct.unpack(f"{order}I", ifd0[TAG_EXIF_IFD])
+        original = read_ifd(exif_offset).get(TAG_DATETIME_ORIGINAL)
+        if original:
+            taken = _parse_exif_datetime(original)
+    if taken is None and TAG_DATETIME in ifd0:
+        taken = _parse_exif_datetime(ifd0[TAG_DATETIME])
+    return taken
+
+
+def _parse_jpeg(data: bytes) -> ImageMeta:
+    meta = ImageMeta()
+    pos = 2
+    while True:
+        _need(data, pos + 4)
+        if data[pos] != 0xFF:
+            return meta
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            return meta
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        segment = pos + 4
+        if marker in JPEG_SOF_MARKERS:
+            _need(data, segment + 5)
+            meta.height, meta.width = struct.unpack_from(">HH", data, segment + 1)
+            return meta
+        if marker == 0xE1 and meta.exif_taken_at is None:
+            _need(data, pos + 2 + length)
+            body = data[segment : pos + 2 + length]
+            if body.startswith(EXIF_HEADER):
+                meta.exif_taken_at = parse_exif(body[len(EXIF_HEADER) :])
+        pos += 2 + length
+
+
+def _parse_png(data: bytes) -> ImageMeta:
+    _need(data, 24)
+    width, height = struct.unpack_from(">II", data, 16)
+    meta = ImageMeta(width=width, height=height)
+    pos = 8
+    while True:
+        _need(data, pos + 8)
+        length, kind = struct.unpack_from(">I4s", data, pos)
+        if kind in (b"IDAT", b"IEND"):
+            return meta
+        if kind == b"eXIf":
+            _need(data, pos + 8 + length)
+            meta.exif_taken_at = parse_exif(data[pos + 8 : pos + 8 + length])
+            return meta
+        pos += 12 + length
+
+
+def _parse_gif(data: bytes) -> ImageMeta:
+    _need(data, 10)
+    width, height = struct.unpack_from("<HH", data, 6)
+    return ImageMeta(width=width, height=height)
+
+
+def _parse_webp(data: bytes) -> ImageMeta:
+    _need(data, 30)
+    kind = data[12:16]
+    if kind == b"VP8 ":
+        width, height = struct.unpack_from("<HH", data, 26)
+        return ImageMeta(width=width & 0x3FFF, height=height & 0x3FFF)
+    if kind == b"VP8L":
+        (bits,) = struct.unpack_from("<I", data, 21)
+        return ImageMeta(width=(bits & 0x3FFF) + 1, height=((bits >> 14) & 0x3FFF) + 1)
+    if kind == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return ImageMeta(width=width, height=height)
+    return ImageMeta()
+
+
+def parse_header(data: bytes) -> Optional[ImageMeta]:
+    try:
+        if data[:2] == b"\xff\xd8":
+            return _parse_jpeg(data)
+        if data[:8] == PNG_SIGNATURE:
+            return _parse_png(data)
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return _parse_gif(data)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _parse_webp(data)
+        if len(data) < 12:
+            return None
+        return ImageMeta()
+    except (_NeedMoreError, struct.error):
+        return None
+
+
+class HeaderSniffer:
+    def __init__(self, limit: int = MAX_HEADER_BYTES) -> None:
+        self.limit = limit
+        self.reset()
+
+    def reset(self) -> None:
+        self._buffer = bytearray()
+        self.result: Optional[ImageMeta] = None
+        self.done = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self.done:
+            return
+        self._buffer += chunk
+        self.result = parse_header(bytes(self._buffer))
+        if self.result is not None or len(self._buffer) >= self.limit:
+            self.done = True
+            self._buffer = bytearray()
+
+
+def read_image_meta(path: Path, limit: int = MAX_HEADER_BYTES) -> Optional[ImageMeta]:
+    sniffer = HeaderSniffer(limit)
+    try:
+        with path.open("rb") as fh:
+            while not sniffer.done:
+                chunk = fh.read(16 * 1024)
+                if not chunk:
+                    break
+                sniffer.feed(chunk)
+    except OSError:
+        return None
+    return sniffer.result
+
+
+def _backfill_worker(path: str) -> Optional[ImageMeta]:
+    return read_image_meta(Path(path))
+
+
+def _chunks(rows: list[tuple[int, str]], size: int) -> Iterable[list[tuple[int, str]]]:
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def backfill_metadata(
+    config: Optional[SIAConfig] = None, workers: Optional[int] = None
+) -> int:
+    cfg = config or CONFIG.get()
+    engine = get_read_engine(cfg.base_dir)
+    writer = get_writer(cfg.base_dir)
+    with session_scope(engine) as session:
+        stmt = (
+            select(Asset.id, FILE_REL_PATH)
+            .join(File, File.asset_id == Asset.id)
+            .join(Author, File.author_id == Author.id)
+            .where(Asset.width.is_(None))
+            .order_by(Asset.id, File.id)
+        )
+        rows: dict[int, str] = {}
+        for asset_id, rel_path in session.execute(stmt):
+            rows.setdefault(asset_id, rel_path)
+    pending = list(rows.items())
+    updated = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in _chunks(pending, BACKFILL_BATCH):
+            paths = [str(cfg.base_dir / rel_path) for _, rel_path in batch]
+            results = list(pool.map(_backfill_worker, paths, chunksize=32))
+            found = [
+                (asset_id, meta)
+                for (asset_id, _), meta in zip(batch, results, strict=True)
+                if meta is not None and meta.width is not None
+            ]
+
+            def write(session, found=found) -> None:
+                for asset_id, meta in found:
+                    asset = session.get(Asset, asset_id)
+                    asset.width = meta.width
+                    asset.height = meta.height
+                    asset.exif_taken_at = meta.exif_taken_at
+
+            writer.run(write)
+            updated += len(found)
+    logger.info("元数据回填完成: %s/%s", updated, len(pending))
+    return updated
@@ -1,19 +1,57 @@
 from __future__ import annotations
 
+import base64
+import gzip
+import hashlib
+import heapq
 import json
+import os
+import re
+import threading
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Iterable, Iterator, List, Optional
 
-from sqlalchemy import desc, select
+from sqlalchemy import Select, desc, func, select, tuple_
+
+try:  # pragma: no cover - brotli 为可选依赖
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
 
 from .config import CONFIG, SIAConfig
-from .db import File, Item, get_engine, session_scope
+from .db import (
+    Asset,
+    File,
+    Item,
+    at_paths,
+    author_ids,
+    author_index,
+    files_fts,
+    files_fts_match,
+    get_read_engine,
+    join_rel_path,
+    session_scope,
+)
 from .logger import get_logger
+from .shards import ShardWriter, load_root
 
 logger = get_logger(__name__)
 
+MAX_PAGE_SIZE = 500
+INCREMENTAL_MIN_CHANGES = 200
+INCREMENTAL_MAX_RATIO = 0.2
+STREAM_BATCH = 1000
+WRITE_BUFFER = 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+ETAG_SUFFIX = ".etag"
+SEARCH_TOKEN = re.compile(r"[^\W_]", re.UNICODE)
+
+_INDEX_LOCK = threading.RLock()
+
 
 @dataclass
 class GalleryItem:
@@ -22,6 +60,7 @@ class GalleryItem:
     mtime: datetime
     post_id: str
     source: str
+    sha256: str = ""
 
     def to_json(self) -> dict[str, str]:
         return {
@@ -30,6 +69,7 @@ class GalleryItem:
             "mtime": int(self.mtime.timestamp()),
             "post_id": self.post_id,
             "source": self.source,
+            "sha256": self.sha256,
         }
 
 
@@ -37,42 +77,346 @@ def _images_path(base_dir: Path) -> Path:
     return base_dir / "images.json"
 
 
-def build_index(config: Optional[SIAConfig] = None) -> Path:
-    cfg = config or CONFIG.get()
-    engine = get_engine(cfg.base_dir)
+def _sibling(path: Path, suffix: str) -> Path:
+    return path.with_name(path.name + suffix)
+
+
+def manifest_etag(path: Path) -> Optional[str]:
+    try:
+        return _sibling(path, ETAG_SUFFIX).read_text(encoding="ascii").strip() or None
+    except OSError:
+        return None
+
+
+def manifest_variant(path: Path, encoding: str) -> Path:
+    return (
+        _sibling(path, COMPRESSED_SUFFIXES[encoding])
+        if encoding in COMPRESSED_SUFFIXES
+        else path
+    )
+
+
+class _ManifestWriter:
+    # 一次遍历同时写出原文、gzip 与 brotli 版本，并计算内容哈希作为 ETag
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        token = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        self.temps = {
+            "identity": path.with_name(f".{path.name}.{token}"),
+            "gzip": path.with_name(f".{path.name}.gz.{token}"),
+        }
+        self._plain = self.temps["identity"].open("wb", buffering=WRITE_BUFFER)
+        self._gzip = gzip.GzipFile(
+            self.temps["gzip"], "wb", compresslevel=GZIP_LEVEL, mtime=0
+        )
+        self._brotli = None
+        if brotli is not None:
+            self.temps["br"] = path.with_name(f".{path.name}.br.{token}")
+            self._brotli_file = self.temps["br"].open("wb", buffering=WRITE_BUFFER)
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+
+    def write(self, text: str) -> None:
+        self._buffer += text.encode("utf-8")
+        if len(self._buffer) >= WRITE_BUFFER:
+            self._flush()
+
+    def _flush(self) -> None:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._hash.update(data)
+        self._plain.write(data)
+        self._gzip.write(data)
+        if self._brotli is not None:
+            self._brotli_file.write(self._brotli.process(data))
+
+    def close(self) -> None:
+        self._flush()
+        self._plain.close()
+        self._gzip.close()
+        if self._brotli is not None:
+            self._brotli_file.write(self._brotli.finish())
+            self._brotli_file.close()
+
+    def commit(self) -> str:
+        etag = self._hash.hexdigest()[:32]
+        etag_tmp = self.temps["identity"].with_name(
+            self.temps["identity"].name + ETAG_SUFFIX
+        )
+        etag_tmp.write_text(etag, encoding="ascii")
+        self.temps["etag"] = etag_tmp
+        for encoding, tmp in self.temps.items():
+            if encoding not in ("identity", "etag"):
+                os.replace(tmp, manifest_variant(self.path, encoding))
+        if "br" not in self.temps:
+            _sibling(self.path, COMPRESSED_SUFFIXES["br"]).unlink(missing_ok=True)
+        os.replace(self.temps["identity"], self.path)
+        # ETag 必须在所有正文之后替换：窗口内的请求只会拿到旧 ETag 配新正文，下次请求即可自愈；
+        # 反过来则会把旧正文缓存在新 ETag 下，之后一直 304
+        os.replace(etag_tmp, _sibling(self.path, ETAG_SUFFIX))
+        return etag
+
+    def discard(self) -> None:
+        self._plain.close()
+        self._gzip.close()
+        if self._brotli is not None:
+            self._brotli_file.close()
+        for tmp in self.temps.values():
+            tmp.unlink(missing_ok=True)
+
+
+def _write_manifest(path: Path, entries: Iterable[dict[str, object]]) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = _ManifestWriter(path)
+    count = 0
+    try:
+        writer.write("[")
+        for entry in entries:
+            writer.write(",\n" if count else "\n")
+            writer.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+            count += 1
+        writer.write("\n]\n" if count else "]\n")
+        writer.close()
+        writer.commit()
+    finally:
+        writer.discard()
+    return count
+
+
+def _iter_index_rows(
+    config: SIAConfig, by_author: bool = False
+) -> Iterator[dict[str, object]]:
+    engine = get_read_engine(config.base_dir)
     with session_scope(engine) as session:
+        authors = author_index(session)
         stmt = (
-            select(File, Item)
-            .join(Item, File.folder == Item.author)
-            .order_by(desc(File.mtime))
-        )
-        gallery: List[GalleryItem] = []
-        for file_row, item in session.execute(stmt):
-            gallery.append(
-                GalleryItem(
-                    author=file_row.folder,
-                    path=file_row.rel_path.replace("\\", "/"),
-                    mtime=file_row.mtime,
-                    post_id=item.post_id,
-                    source=item.source or "",
-                )
+            select(
+                File.author_id,
+                File.name,
+                File.mtime,
+                Item.post_id,
+                Item.source,
+                Asset.sha256,
             )
-    output = [item.to_json() for item in gallery]
+            .outerjoin(Item, File.item_id == Item.id)
+            .join(Asset, File.asset_id == Asset.id)
+            .order_by(desc(File.mtime), desc(File.id))
+            .execution_options(yield_per=STREAM_BATCH)
+        )
+        groups = [stmt]
+        if by_author:
+            # 逐个作者沿 ix_files_author 读取，避免对整表按作者排序
+            ids: dict[str, List[int]] = {}
+            for author_id, (name, _folder) in authors.items():
+                ids.setdefault(name, []).append(author_id)
+            groups = [
+                stmt.where(_author_filter(ids[name]))
+                for name in sorted(ids, reverse=True)
+            ]
+        for group in groups:
+            for author_id, name, mtime, post_id, source, sha256 in session.execute(
+                group
+            ):
+                author, folder = authors[author_id]
+                yield GalleryItem(
+                    author=author,
+                    path=join_rel_path(folder, name),
+                    mtime=mtime,
+                    post_id=post_id or "",
+                    source=source or "",
+                    sha256=sha256,
+                ).to_json()
+
+
+def _file_counts(config: SIAConfig) -> tuple[int, dict[str, int]]:
+    engine = get_read_engine(config.base_dir)
+    with session_scope(engine) as session:
+        # 按 author_id 分组沿 ix_files_author 顺序扫描；同名作者可能有多个目录，在这里合并
+        stmt = (
+            select(File.author_id, func.count(File.id))
+            .join(Asset, File.asset_id == Asset.id)
+            .group_by(File.author_id)
+        )
+        authors = author_index(session)
+        counts: dict[str, int] = {}
+        for author_id, count in session.execute(stmt):
+            name = authors[author_id][0]
+            counts[name] = counts.get(name, 0) + count
+    return sum(counts.values()), counts
+
+
+def build_index(config: Optional[SIAConfig] = None) -> Path:
+    cfg = config or CONFIG.get()
     path = _images_path(cfg.base_dir)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(output, ensure_ascii=False, indent=2), encoding="utf-8")
-    logger.info("重建索引: %s 项", len(output))
+    with _INDEX_LOCK:
+        total, counts = _file_counts(cfg)
+        shards = ShardWriter(cfg.base_dir)
+        count = _write_manifest(path, shards.timeline(_iter_index_rows(cfg), total))
+        authors = shards.authors(_iter_index_rows(cfg, by_author=True), counts)
+        shards.commit(count, authors)
+    logger.info("重建索引: %s 项", count)
     return path
 
 
+def _normalize_rel_path(value: str, base_dir: Path) -> str:
+    path = Path(value)
+    if path.is_absolute():
+        try:
+            path = path.relative_to(base_dir)
+        except ValueError:
+            return value.replace("\\", "/")
+    return path.as_posix()
+
+
+class _StaleManifestError(Exception):
+    pass
+
+
+def _read_manifest(path: Path) -> Iterator[dict[str, object]]:
+    # images.json 每行一个条目，逐行解析，内存占用与图库大小无关
+    previous = None
+    with path.open(encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line in ("[", "]", "[]", ""):
+                continue
+            try:
+                entry = json.loads(line.removesuffix(","))
+            except json.JSONDecodeError as exc:
+                raise _StaleManifestError("images.json 不是逐行格式") from exc
+            if (
+                not isinstance(entry, dict)
+                or "path" not in entry
+                or not isinstance(entry.get("mtime"), int)
+            ):
+                raise _StaleManifestError("images.json 条目格式无效")
+            if previous is not None and entry["mtime"] > previous:
+                raise _StaleManifestError("images.json 未按时间排序")
+            previous = entry["mtime"]
+            yield entry
+
+
 def incremental_update(rel_paths: Iterable[str], config: Optional[SIAConfig] = None) -> None:
     cfg = config or CONFIG.get()
     path = _images_path(cfg.base_dir)
-    if not path.exists():
-        build_index(cfg)
+    changed = {_normalize_rel_path(value, cfg.base_dir) for value in rel_paths}
+    if not changed and path.exists():
         return
-    # for simplicity, rebuild entire index if updates significant
-    build_index(cfg)
+    with _INDEX_LOCK:
+        root = load_root(cfg.base_dir)
+        if not path.exists() or root is None:
+            logger.info("images.json 或分片清单缺失，执行全量重建")
+            build_index(cfg)
+            return
+        engine = get_read_engine(cfg.base_dir)
+        with session_scope(engine) as session:
+            stmt = (
+                select(File, Item, Asset.sha256)
+                .outerjoin(Item, File.item_id == Item.id)
+                .join(Asset, File.asset_id == Asset.id)
+                .where(at_paths(session, changed))
+                .order_by(desc(File.mtime), desc(File.id))
+            )
+            fresh = [_gallery_item(*row).to_json() for row in session.execute(stmt)]
+            db_total = session.scalar(select(func.count(File.id))) or 0
+        if len(changed) > max(
+            INCREMENTAL_MIN_CHANGES, db_total * INCREMENTAL_MAX_RATIO
+        ):
+            build_index(cfg)
+            return
+        # 只有涉及变更条目的作者需要重写作者分片，其余沿用旧根清单
+        touched: dict[str, list[dict[str, object]]] = {
+            str(entry["author"]): [] for entry in fresh
+        }
+        dropped: set[str] = set()
+
+        def kept() -> Iterator[dict[str, object]]:
+            for entry in _read_manifest(path):
+                if entry["path"] in changed:
+                    dropped.add(str(entry["author"]))
+                    continue
+                yield entry
+
+        def merged() -> Iterator[dict[str, object]]:
+            count = 0
+            for entry in heapq.merge(fresh, kept(), key=lambda entry: -entry["mtime"]):
+                count += 1
+                group = touched.get(str(entry["author"]))
+                if group is not None:
+                    group.append(entry)
+                yield entry
+            if count != db_total:
+                raise _StaleManifestError(
+                    f"images.json 与数据库不一致 ({count} != {db_total})"
+                )
+
+        shards = ShardWriter(cfg.base_dir, root.get("shard_size"))
+        try:
+            # 时间线分片按内容寻址，未受影响的分片名不变，不会重写
+            count = _write_manifest(path, shards.timeline(merged(), db_total))
+        except _StaleManifestError as exc:
+            logger.warning("%s，执行全量重建", exc)
+            build_index(cfg)
+            return
+        missing = dropped - touched.keys()
+        if missing:
+            # 只被删除条目的作者不在本次流里收集，从新写出的 images.json 补读
+            touched.update((author, []) for author in missing)
+            for entry in _read_manifest(path):
+                if entry["author"] in missing:
+                    touched[str(entry["author"])].append(entry)
+        refreshed = shards.authors(
+            (entry for author in sorted(touched) for entry in touched[author]),
+            {author: len(group) for author, group in touched.items()},
+        )
+        authors = [
+            row for row in root.get("authors", []) if row["author"] not in touched
+        ] + refreshed
+        authors.sort(key=lambda row: str(row["author"]))
+        shards.commit(count, authors)
+    logger.info("增量更新索引: %s 项变更，共 %s 项", len(changed), count)
+
+
+def search_expression(query: str) -> Optional[str]:
+    # 每个空格分隔的词作为带前缀匹配的短语，多个词之间为 AND
+    terms = []
+    for word in query.split():
+        if not SEARCH_TOKEN.search(word):
+            continue
+        terms.append('"' + word.replace('"', '""') + '"*')
+    return " ".join(terms) or None
+
+
+def encode_cursor(mtime: datetime, file_id: int) -> str:
+    raw = f"{mtime.isoformat()}|{file_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode(
+            "utf-8"
+        )
+        mtime, file_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(mtime), int(file_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("cursor 无效") from exc
+
+
+def _author_filter(ids: List[int]) -> any:
+    # 单个作者时用等值条件，ix_files_author 可直接给出 (mtime, id) 顺序
+    return File.author_id == ids[0] if len(ids) == 1 else File.author_id.in_(ids)
+
+
+def _filtered(stmt: Select, ids: Optional[List[int]], match: Optional[str]) -> Select:
+    if ids is not None:
+        stmt = stmt.where(_author_filter(ids))
+    if match:
+        stmt = stmt.join(files_fts, files_fts.c.rowid == File.id).where(
+            files_fts_match(match)
+        )
+    return stmt
 
 
 def paginate(
@@ -81,37 +425,67 @@ def paginate(
     author: Optional[str] = None,
     query: Optional[str] = None,
     config: Optional[SIAConfig] = None,
+    cursor: Optional[str] = None,
 ) -> dict[str, object]:
     cfg = config or CONFIG.get()
-    engine = get_engine(cfg.base_dir)
+    page = max(1, page)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    engine = get_read_engine(cfg.base_dir)
     with session_scope(engine) as session:
-        stmt = (
-            select(File, Item)
-            .join(Item, File.folder == Item.author)
-            .order_by(desc(File.mtime))
+        match = search_expression(query) if query else None
+        ids = author_ids(session, author) if author else None
+        stmt = _filtered(
+            select(File, Item, Asset.sha256)
+            .outerjoin(Item, File.item_id == Item.id)
+            .join(Asset, File.asset_id == Asset.id),
+            ids,
+            match,
         )
-        if author:
-            stmt = stmt.where(File.folder == author)
-        if query:
-            like_term = f"%{query}%"
-            stmt = stmt.where(File.rel_path.like(like_term))
-        total = session.execute(stmt).all()
-        start = (page - 1) * page_size
-        end = start + page_size
-        slice_rows = total[start:end]
-        items = [
-            GalleryItem(
-                author=file.folder,
-                path=file.rel_path,
-                mtime=file.mtime,
-                post_id=item.post_id,
-                source=item.source or "",
-            ).to_json()
-            for file, item in slice_rows
-        ]
+        ordered = stmt.order_by(desc(File.mtime), desc(File.id))
+        if cursor is not None:
+            if cursor:
+                mtime, file_id = decode_cursor(cursor)
+                ordered = ordered.where(
+                    tuple_(File.mtime, File.id) < tuple_(mtime, file_id)
+                )
+            rows = session.execute(ordered.limit(page_size + 1)).all()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            last = rows[-1][0] if rows else None
+            return {
+                "page_size": page_size,
+                "items": [_gallery_item(*row).to_json() for row in rows],
+                "next_cursor": (
+                    encode_cursor(last.mtime, last.id) if has_more and last else None
+                ),
+            }
+        # 计数不需要帖子信息：省去 items 连接后可只扫 files 上的覆盖索引
+        counted = _filtered(
+            select(func.count(File.id)).join(Asset, File.asset_id == Asset.id),
+            ids,
+            match,
+        )
+        total = session.scalar(counted) or 0
+        if match:
+            ordered = stmt.order_by(files_fts.c.rank, desc(File.mtime), desc(File.id))
+        rows = session.execute(
+            ordered.limit(page_size).offset((page - 1) * page_size)
+        ).all()
+        items = [_gallery_item(*row).to_json() for row in rows]
     return {
         "page": page,
         "page_size": page_size,
-        "total": len(total),
+        "total": total,
         "items": items,
     }
+
+
+def _gallery_item(file: File, item: Optional[Item], sha256: str) -> GalleryItem:
+    return GalleryItem(
+        author=file.author.name,
+        path=file.rel_path,
+        mtime=file.mtime,
+        post_id=item.post_id if item else "",
+        source=(item.source or "") if item else "",
+        sha256=sha256,
+    )
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import inspect, text
+
+from .db import Base, _drop_search_index, _ensure_search_index, digest_bytes, vacuum
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+VERSION_TABLE = "schema_version"
+LEGACY_TABLES = ("assets", "items", "files", "url_cache")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[any], None]
+    vacuum: bool = False
+
+
+def _columns(conn: any, table_name: str) -> set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table_name)}
+
+
+def _legacy_layout(conn: any) -> bool:
+    # 第 4 步之前 files 直接保存作者名 folder 与完整 rel_path
+    return "folder" in _columns(conn, "files")
+
+
+def _add_column(conn: any, table_name: str, column_name: str) -> bool:
+    # 只能追加可空列：SQLite 的 ALTER TABLE 不支持为已有行补默认值以外的约束
+    if column_name in _columns(conn, table_name):
+        return False
+    column = Base.metadata.tables[table_name].c[column_name]
+    kind = column.type.compile(dialect=conn.dialect)
+    references = "".join(
+        f" REFERENCES {fk.column.table.name}({fk.column.name})"
+        for fk in column.foreign_keys
+    )
+    conn.execute(
+        text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {kind}{references}")
+    )
+    return True
+
+
+def _backfill_file_items(conn: any) -> int:
+    # 只有旧表结构缺少 item_id；旧库没有记录文件来自哪条帖子：取同作者在文件写入前最近保存的帖子，找不到时退回该作者最早的帖子
+    result = conn.execute(text("""
+            UPDATE files SET item_id = COALESCE(
+                (SELECT items.id FROM items
+                 WHERE items.author = files.folder AND items.saved_at <= files.mtime
+                 ORDER BY items.saved_at DESC, items.id DESC LIMIT 1),
+                (SELECT items.id FROM items
+                 WHERE items.author = files.folder
+                 ORDER BY items.saved_at, items.id LIMIT 1)
+            )
+            WHERE item_id IS NULL
+            """))
+    return result.rowcount
+
+
+def _legacy_columns(conn: any) -> None:
+    _add_column(conn, "assets", "phash")
+    _add_column(conn, "items", "caption")
+    if _add_column(conn, "files", "item_id"):
+        _backfill_file_items(conn)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_item_id ON files (item_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_mtime ON files (mtime)"))
+
+
+def _search_index(conn: any) -> None:
+    # 旧表结构的全文索引由第 4 步按新结构重建
+    if not _legacy_layout(conn):
+        _ensure_search_index(conn)
+
+
+def _query_indexes(conn: any) -> None:
+    if not _legacy_layout(conn):
+        return
+    conn.execute(text("DROP INDEX IF EXISTS ix_files_folder_mtime"))
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_files_author ON files (folder, mtime, id, asset_id)"
+        )
+    )
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_files_asset_id ON files (asset_id)")
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_items_author_saved_at ON items (author, saved_at)"
+        )
+    )
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_items_saved_at ON items (saved_at)")
+    )
+
+
+_LEGACY_PATH = "replace(rel_path, '\\', '/')"
+_LEGACY_DIR = "CASE WHEN instr(path, '/') > 0 THEN substr(path, 1, instr(path, '/') - 1) ELSE '' END"
+
+_NORMALIZE_SQL = (
+    f"""
+    INSERT INTO authors (name, folder)
+    SELECT DISTINCT folder, {_LEGACY_DIR}
+    FROM (SELECT folder, {_LEGACY_PATH} AS path FROM files_legacy)
+    """,
+    """
+    INSERT INTO authors (name, folder)
+    SELECT DISTINCT author, NULL FROM items_legacy
+    WHERE author NOT IN (SELECT name FROM authors)
+    """,
+    """
+    INSERT INTO assets (id, sha256, ext, bytes, width, height, exif_taken_at, phash, created_at)
+    SELECT id, sia_digest(sha256), ext, bytes, width, height, exif_taken_at, phash, created_at
+    FROM assets_legacy
+    """,
+    """
+    INSERT INTO items (id, author_id, post_id, source, caption, saved_at)
+    SELECT id, (SELECT min(authors.id) FROM authors WHERE authors.name = items_legacy.author),
+           post_id, source, caption, saved_at
+    FROM items_legacy
+    """,
+    f"""
+    INSERT INTO files (id, asset_id, item_id, author_id, name, mtime)
+    SELECT id, asset_id, item_id,
+           (SELECT authors.id FROM authors WHERE authors.name = legacy.folder AND authors.folder = legacy.dir),
+           CASE WHEN legacy.dir = '' THEN legacy.path ELSE substr(legacy.path, length(legacy.dir) + 2) END,
+           mtime
+    FROM (
+        SELECT id, asset_id, item_id, folder, mtime, path, {_LEGACY_DIR} AS dir
+        FROM (SELECT *, {_LEGACY_PATH} AS path FROM files_legacy)
+    ) AS legacy
+    """,
+    """
+    INSERT INTO url_cache (id, url, sha256, bytes, content_type, etag, last_modified, checked_at)
+    SELECT id, url, sia_digest(sha256), bytes, content_type, etag, last_modified, checked_at
+    FROM url_cache_legacy
+    """,
+)
+
+
+def _convert_legacy_layout(conn: any) -> None:
+    # SQLite 无法修改列类型或删除带约束的列：改名旧表、按新结构建表、整表拷贝后删除旧表
+    conn.connection.driver_connection.create_function(
+        "sia_digest", 1, digest_bytes, deterministic=True
+    )
+    _drop_search_index(conn)
+    for name in LEGACY_TABLES:
+        indexes = (
+            conn.execute(
+                text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"
+                ),
+                {"name": name},
+            )
+            .scalars()
+            .all()
+        )
+        for index in indexes:
+            conn.execute(text(f"DROP INDEX {index}"))
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_legacy"))
+    Base.metadata.create_all(
+        conn, tables=[Base.metadata.tables[name] for name in LEGACY_TABLES]
+    )
+    for statement in _NORMALIZE_SQL:
+        conn.execute(text(statement))
+    for name in reversed(LEGACY_TABLES):
+        conn.execute(text(f"DROP TABLE {name}_legacy"))
+
+
+def _normalize_authors(conn: any) -> None:
+    if _legacy_layout(conn):
+        _convert_legacy_layout(conn)
+    for table in Base.metadata.sorted_tables:
+        columns = _columns(conn, table.name)
+        for index in table.indexes:
+            # 后续迁移才追加的列，其索引由对应迁移创建
+            if {column.name for column in index.columns} <= columns:
+                index.create(conn, checkfirst=True)
+    _ensure_search_index(conn)
+
+
+def _item_job_ids(conn: any) -> None:
+    _add_column(conn, "items", "job_id")
+    conn.execute(
+        text("CREATE UNIQUE INDEX IF NOT EXISTS ix_items_job_id ON items (job_id)")
+    )
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "legacy_columns", _legacy_columns),
+    Migration(2, "search_index", _search_index),
+    Migration(3, "query_indexes", _query_indexes),
+    Migration(4, "normalize_authors", _normalize_authors, vacuum=True),
+    Migration(5, "item_job_ids", _item_job_ids),
+)
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn: any) -> int:
+    conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL, applied_at DATETIME NOT NULL)"
+        )
+    )
+    return conn.execute(text(f"SELECT max(version) FROM {VERSION_TABLE}")).scalar() or 0
+
+
+def _stamp(conn: any, migration: Migration) -> None:
+    conn.execute(
+        text(
+            f"INSERT INTO {VERSION_TABLE} (version, name, applied_at) VALUES (:version, :name, :applied_at)"
+        ),
+        {
+            "version": migration.version,
+            "name": migration.name,
+            "applied_at": datetime.utcnow(),
+        },
+    )
+
+
+def _begin(conn: any) -> None:
+    # pysqlite 不会为 DDL 自动开启事务；显式开启，迁移失败时连同建表一起回滚
+    if not conn.connection.driver_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def migrate(engine: any, target: int = SCHEMA_VERSION) -> list[int]:
+    # 新库直接按当前模型建表并记为最新版本；旧库依次执行未应用的迁移，每步单独提交
+    with engine.begin() as conn:
+        fresh = not set(inspect(conn).get_table_names()) & set(Base.metadata.tables)
+        version = current_version(conn)
+    Base.metadata.create_all(engine)
+    if fresh:
+        with engine.begin() as conn:
+            _begin(conn)
+            _ensure_search_index(conn)
+            for migration in MIGRATIONS:
+                _stamp(conn, migration)
+        return []
+    applied: list[int] = []
+    for migration in MIGRATIONS:
+        if migration.version <= version or migration.version > target:
+            continue
+        with engine.begin() as conn:
+            _begin(conn)
+            migration.apply(conn)
+            _stamp(conn, migration)
+        applied.append(migration.version)
+        logger.info("数据库迁移 %s: %s", migration.version, migration.name)
+    if any(
+        migration.vacuum for migration in MIGRATIONS if migration.version in applied
+    ):
+        vacuum(engine)
+    return applied
@@ -0,0 +1,345 @@
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from itertools import combinations
+from pathlib import Path
+from typing import Iterable, Optional
+
+try:  # pragma: no cover - Pillow optional at import time
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None  # type: ignore
+
+from sqlalchemy import select
+
+from .config import CONFIG, SIAConfig
+from .db import FILE_REL_PATH, Asset, Author, File, get_read_engine, session_scope
+from .logger import get_logger
+from .storage import get_writer
+
+logger = get_logger(__name__)
+
+HASH_SIZE = 8
+DEFAULT_DISTANCE = 6
+MAX_DISTANCE = 16
+BACKFILL_BATCH = 500
+
+
+def dhash(path: str | Path) -> Optional[int]:
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+            pixels = (
+                img.convert("L")
+                .resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+                .tobytes()
+            )
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def format_hash(value: int) -> str:
+    return f"{value:016x}"
+
+
+def parse_hash(value: str) -> int:
+    return int(value, 16)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+BLOCKS = 4
+BLOCK_BITS = HASH_SIZE * HASH_SIZE // BLOCKS
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+
+
+@cache
+def _flip_masks(radius: int) -> tuple[int, ...]:
+    masks = [0]
+    for bits in range(1, radius + 1):
+        masks += [
+            sum(1 << bit for bit in chosen)
+            for chosen in combinations(range(BLOCK_BITS), bits)
+        ]
+    return tuple(masks)
+
+
+class MultiIndexHash:
+    # 多索引哈希：64 位哈希切成 4 段，每段一张字典。距离 ≤ d 的两个哈希至少有一段相差不超过 d // 4 位，
+    # 只需在每段上做精确查找（d < 4 时）或枚举这么多位翻转后查找，再对候选核对完整距离
+    def __init__(self) -> None:
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(BLOCKS)]
+        self._keys: dict[int, list[str]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def values(self) -> list[int]:
+        return list(self._keys)
+
+    def keys(self, value: int) -> list[str]:
+        return self._keys.get(value, [])
+
+    def add(self, value: int, key: str) -> None:
+        self._size += 1
+        keys = self._keys.get(value)
+        if keys is not None:
+            keys.append(key)
+            return
+        self._keys[value] = [key]
+        for block, table in enumerate(self._tables):
+            table.setdefault((value >> (block * BLOCK_BITS)) & BLOCK_MASK, []).append(
+                value
+            )
+
+    def neighbours(self, value: int, max_distance: int) -> list[tuple[int, int]]:
+        masks = _flip_masks(max_distance // BLOCKS)
+        seen: set[int] = set()
+        found: list[tuple[int, int]] = []
+        for block, table in enumerate(self._tables):
+            part = (value >> (block * BLOCK_BITS)) & BLOCK_MASK
+            for mask in masks:
+                for candidate in table.get(part ^ mask, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = (candidate ^ value).bit_count()
+                    if distance <= max_distance:
+                        found.append((distance, candidate))
+        return found
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, str]]:
+        found = [
+            (distance, key)
+            for distance, candidate in self.neighbours(value, max_distance)
+            for key in self._keys[candidate]
+        ]
+        found.sort()
+        return found
+
+
+class DuplicateIndex:
+    def __init__(self, config: SIAConfig) -> None:
+        self.base_dir = config.base_dir
+        self._lock = threading.Lock()
+        self._tree = MultiIndexHash()
+        self._hashes: dict[str, int] = {}
+        # 每次新增哈希递增；分组结果按 (代数, 距离) 缓存
+        self.generation = 0
+        self._groups: dict[int, tuple[int, list[list[str]]]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        engine = get_read_engine(self.base_dir)
+        with session_scope(engine) as session:
+            rows = session.execute(
+                select(Asset.sha256, Asset.phash).where(Asset.phash.is_not(None))
+            ).all()
+        for sha256, phash in rows:
+            self._insert(sha256, parse_hash(phash))
+        logger.info("感知哈希索引已加载: %s", len(self._hashes))
+
+    def _insert(self, sha256: str, value: int) -> None:
+        if sha256 in self._hashes:
+            return
+        self._hashes[sha256] = value
+        self._tree.add(value, sha256)
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, sha256: str, value: int) -> None:
+        with self._lock:
+            self._insert(sha256, value)
+
+    def hash_of(self, sha256: str) -> Optional[int]:
+        return self._hashes.get(sha256)
+
+    def near(
+        self,
+        value: int,
+        distance: int = DEFAULT_DISTANCE,
+        exclude: Optional[str] = None,
+    ) -> list[tuple[int, str]]:
+        with self._lock:
+            matches = self._tree.search(value, min(distance, MAX_DISTANCE))
+        return [(dist, sha) for dist, sha in matches if sha != exclude]
+
+    def near_asset(
+        self, sha256: str, distance: int = DEFAULT_DISTANCE
+    ) -> Optional[list[tuple[int, str]]]:
+        value = self.hash_of(sha256)
+        if value is None:
+            return None
+        return self.near(value, distance, exclude=sha256)
+
+    def groups(self, distance: int = DEFAULT_DISTANCE) -> list[list[str]]:
+        distance = min(distance, MAX_DISTANCE)
+        with self._lock:
+            cached = self._groups.get(distance)
+            if cached is not None and cached[0] == self.generation:
+                return cached[1]
+            found = self._cluster(distance)
+            self._groups[distance] = (self.generation, found)
+            return found
+
+    def _cluster(self, distance: int) -> list[list[str]]:
+        # 按不同的哈希值做并查集，相同哈希的资产天然同组
+        values = self._tree.values()
+        parent = {value: value for value in values}
+
+        def find(value: int) -> int:
+            while parent[value] != value:
+                parent[value] = parent[parent[value]]
+                value = parent[value]
+            return value
+
+        for value in values:
+            for _, other in self._tree.neighbours(value, distance):
+                if other <= value:
+                    continue
+                a, b = find(value), find(other)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        clusters: dict[int, list[str]] = defaultdict(list)
+        for value in values:
+            clusters[find(value)].extend(self._tree.keys(value))
+        found = [sorted(members) for members in clusters.values() if len(members) > 1]
+        found.sort(key=lambda members: (-len(members), members[0]))
+        return found
+
+
+def files_for(config: SIAConfig, hashes: Iterable[str]) -> dict[str, list[str]]:
+    wanted = list(set(hashes))
+    result: dict[str, list[str]] = {sha: [] for sha in wanted}
+    if not wanted:
+        return result
+    engine = get_read_engine(config.base_dir)
+    with session_scope(engine) as session:
+        stmt = (
+            select(Asset.sha256, FILE_REL_PATH)
+            .join(File, File.asset_id == Asset.id)
+            .join(Author, File.author_id == Author.id)
+            .where(Asset.sha256.in_(wanted))
+            .order_by(FILE_REL_PATH)
+        )
+        for sha256, rel_path in session.execute(stmt):
+            result[sha256].append(rel_path)
+    return result
+
+
+def describe_groups(
+    config: SIAConfig, groups: list[list[str]]
+) -> list[list[dict[str, object]]]:
+    index = get_duplicate_index(config)
+    paths = files_for(config, (sha for members in groups for sha in members))
+    return [
+        [
+            {
+                "sha256": sha,
+                "phash": format_hash(index.hash_of(sha)),
+                "files": paths[sha],
+            }
+            for sha in members
+        ]
+        for members in groups
+    ]
+
+
+def duplicate_report(
+    config: SIAConfig, distance: int = DEFAULT_DISTANCE
+) -> list[list[dict[str, object]]]:
+    return describe_groups(config, get_duplicate_index(config).groups(distance))
+
+
+def _backfill_worker(path: str) -> Optional[int]:
+    return dhash(path)
+
+
+def backfill_phash(
+    config: Optional[SIAConfig] = None, workers: Optional[int] = None
+) -> int:
+    cfg = config or CONFIG.get()
+    engine = get_read_engine(cfg.base_dir)
+    with session_scope(engine) as session:
+        stmt = (
+            select(Asset.id, Asset.sha256, FILE_REL_PATH)
+            .join(File, File.asset_id == Asset.id)
+            .join(Author, File.author_id == Author.id)
+            .where(Asset.phash.is_(None))
+            .order_by(Asset.id, File.id)
+        )
+        rows: dict[int, tuple[str, str]] = {}
+        for asset_id, sha256, rel_path in session.execute(stmt):
+            rows.setdefault(asset_id, (sha256, rel_path))
+    pending = list(rows.items())
+    index = get_duplicate_index(cfg)
+    writer = get_writer(cfg.base_dir)
+    updated = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), BACKFILL_BATCH):
+            batch = pending[start : start + BACKFILL_BATCH]
+            paths = [str(cfg.base_dir / rel_path) for _, (_, rel_path) in batch]
+            results = list(pool.map(_backfill_worker, paths, chunksize=32))
+            hashes = [
+                (asset_id, sha256, value)
+                for (asset_id, (sha256, _)), value in zip(batch, results, strict=True)
+                if value is not None
+            ]
+
+            def write(session, hashes=hashes) -> None:
+                for asset_id, _, value in hashes:
+                    session.get(Asset, asset_id).phash = format_hash(value)
+
+            writer.run(write)
+            for _, sha256, value in hashes:
+                index.add(sha256, value)
+            updated += len(hashes)
+    logger.info("感知哈希回填完成: %s/%s", updated, len(pending))
+    return updated
+
+
+_INDEXES: dict[Path, DuplicateIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_duplicate_index(config: SIAConfig) -> DuplicateIndex:
+    key = config.base_dir.resolve()
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is None:
+            index = _INDEXES[key] = DuplicateIndex(config)
+        return index
+
+
+def reset_duplicate_indexes(keep: Optional[Path] = None) -> int:
+    keep_key = keep.resolve() if keep is not None else None
+    with _INDEXES_LOCK:
+        stale = [key for key in _INDEXES if key != keep_key]
+        for key in stale:
+            del _INDEXES[key]
+    return len(stale)
+
+
+def _reset_duplicate_indexes(config: SIAConfig) -> None:
+    dropped = reset_duplicate_indexes(keep=config.base_dir)
+    if dropped:
+        logger.info("数据目录已切换，释放 %s 个近似重复索引", dropped)
+
+
+CONFIG.add_listener(_reset_duplicate_indexes)
@@ -5,8 +5,9 @@ import re
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Iterable, List, Optional, Tuple
 
+from .config import SIAConfig
 from .logger import get_logger
 
 logger = get_logger(__name__)
@@ -33,7 +34,11 @@ def _group_by_parent(paths: Iterable[Path]) -> dict[Path, List[Path]]:
 
 
 def scan_directory(base_dir: Path) -> List[RenamePlan]:
-    paths = sorted(p for p in base_dir.glob("**/*") if p.is_file())
+    paths = sorted(
+        p
+        for p in base_dir.glob("**/*")
+        if p.is_file() and not _is_internal(p.relative_to(base_dir))
+    )
     grouped = _group_by_parent(paths)
     plans: List[RenamePlan] = []
     for folder, files in grouped.items():
@@ -48,7 +53,15 @@ def scan_directory(base_dir: Path) -> List[RenamePlan]:
     return plans
 
 
-def apply(plans: Iterable[RenamePlan], preview: bool = True) -> List[Tuple[Path, Path]]:
+def _is_internal(rel_path: Path) -> bool:
+    return any(part.startswith(".") for part in rel_path.parts[:-1])
+
+
+def apply(
+    plans: Iterable[RenamePlan],
+    preview: bool = True,
+    config: Optional[SIAConfig] = None,
+) -> List[Tuple[Path, Path]]:
     executed: List[Tuple[Path, Path]] = []
     for plan in plans:
         if preview:
@@ -61,6 +74,10 @@ def apply(plans: Iterable[RenamePlan], preview: bool = True) -> List[Tuple[Path,
         plan.source.rename(plan.destination)
         executed.append((plan.source, plan.destination))
         logger.info("改名 %s -> %s", plan.source.name, plan.destination.name)
+    if config is not None and executed:
+        from .snapshot import record_renames
+
+        record_renames(config, executed)
     return executed
 
 
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Mapping, Optional
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_DIR = ".manifest"
+SHARD_DIR = "shards"
+ROOT_NAME = "index.json"
+SHARD_SIZE = 256
+MANIFEST_VERSION = 1
+
+Entry = dict[str, object]
+
+
+def manifest_root(base_dir: Path) -> Path:
+    return base_dir / MANIFEST_DIR / ROOT_NAME
+
+
+def _chunks(entries: Iterable[Entry], total: int, size: int) -> Iterator[list[Entry]]:
+    # 分片从最旧一端按固定大小切分，最新的一片不满；新增图片只会改写这一片
+    iterator = iter(entries)
+    first = total % size or size
+    while True:
+        chunk = list(itertools.islice(iterator, first))
+        if not chunk:
+            return
+        yield chunk
+        first = size
+
+
+def _dump(value: object) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _atomic_write(path: Path, payload: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_bytes(payload)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class ShardWriter:
+    def __init__(self, base_dir: Path, shard_size: Optional[int] = None) -> None:
+        self.root_dir = base_dir / MANIFEST_DIR
+        self.shard_dir = self.root_dir / SHARD_DIR
+        self.shard_size = shard_size or SHARD_SIZE
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.written = 0
+        self.reused = 0
+        self.shards: list[dict[str, object]] = []
+
+    def _store(self, entries: list[Entry]) -> str:
+        payload = _dump(entries)
+        name = f"{hashlib.sha1(payload).hexdigest()[:20]}.json"
+        path = self.shard_dir / name
+        if path.exists():
+            self.reused += 1
+        else:
+            _atomic_write(path, payload)
+            self.written += 1
+        return f"{SHARD_DIR}/{name}"
+
+    def timeline(self, entries: Iterable[Entry], total: int) -> Iterator[Entry]:
+        # 透传条目，便于与 images.json 共用一次流式查询
+        self.shards = []
+        for chunk in _chunks(entries, total, self.shard_size):
+            self.shards.append(
+                {
+                    "file": self._store(chunk),
+                    "count": len(chunk),
+                    "newest": chunk[0]["mtime"],
+                    "oldest": chunk[-1]["mtime"],
+                }
+            )
+            yield from chunk
+
+    def authors(
+        self, entries: Iterable[Entry], counts: Mapping[str, int]
+    ) -> list[dict[str, object]]:
+        listing: list[dict[str, object]] = []
+        for author, group in itertools.groupby(
+            entries, key=lambda entry: entry["author"]
+        ):
+            files: list[str] = []
+            cover: Optional[Entry] = None
+            count = 0
+            for chunk in _chunks(group, counts.get(author, 0), self.shard_size):
+                cover = cover or chunk[0]
+                count += len(chunk)
+                files.append(self._store(chunk))
+            listing.append(
+                {"author": author, "count": count, "cover": cover, "shards": files}
+            )
+        listing.sort(key=lambda row: str(row["author"]))
+        return listing
+
+    def commit(self, total: int, authors: list[dict[str, object]]) -> Path:
+        root = manifest_root(self.root_dir.parent)
+        previous = _referenced(root)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "generated_at": int(time.time()),
+            "total": total,
+            "shard_size": self.shard_size,
+            "shards": self.shards,
+            "authors": authors,
+        }
+        _atomic_write(root, _dump(manifest))
+        # 保留上一版引用的分片，正在按旧根清单加载的页面不会 404
+        keep = previous | _referenced(root)
+        removed = 0
+        for path in self.shard_dir.glob("*.json"):
+            if f"{SHARD_DIR}/{path.name}" not in keep:
+                path.unlink(missing_ok=True)
+                removed += 1
+        logger.info(
+            "分片清单: %s 项，新写 %s 片，复用 %s 片，清理 %s 片",
+            total,
+            self.written,
+            self.reused,
+            removed,
+        )
+        return root
+
+
+def load_root(base_dir: Path) -> Optional[dict[str, object]]:
+    try:
+        manifest = json.loads(manifest_root(base_dir).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _referenced(root: Path) -> set[str]:
+    try:
+        manifest = json.loads(root.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return set()
+    files = {shard["file"] for shard in manifest.get("shards", [])}
+    for author in manifest.get("authors", []):
+        files.update(author.get("shards", []))
+    return files
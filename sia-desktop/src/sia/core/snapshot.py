@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import LargeBinary, select, type_coerce
+
+from .config import SIAConfig
+from .db import (
+    Asset,
+    File,
+    Item,
+    at_paths,
+    author_for,
+    author_index,
+    get_read_engine,
+    join_rel_path,
+    session_scope,
+    split_rel_path,
+)
+from .indexer import (
+    MAX_PAGE_SIZE,
+    STREAM_BATCH,
+    GalleryItem,
+    decode_cursor,
+    encode_cursor,
+    incremental_update,
+)
+from .logger import get_logger
+from .storage import get_writer
+
+logger = get_logger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+NO_ITEM = 0
+
+
+def _to_micros(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _rows() -> any:
+    # 摘要按 32 字节原样读出，省去十六进制往返；作者与目录由 author_index 在内存中还原
+    return select(
+        File.id,
+        File.mtime,
+        File.item_id,
+        File.author_id,
+        File.name,
+        type_coerce(Asset.sha256, LargeBinary),
+    ).join(Asset, File.asset_id == Asset.id)
+
+
+class _Key:
+    # 让 bisect 直接在列数组上按 (mtime, id) 二分
+    def __init__(
+        self, snapshot: "GallerySnapshot", positions: Optional[Sequence[int]] = None
+    ) -> None:
+        self.snapshot = snapshot
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return (
+            len(self.positions)
+            if self.positions is not None
+            else len(self.snapshot._ids)
+        )
+
+    def __getitem__(self, index: int) -> tuple[int, int]:
+        pos = self.positions[index] if self.positions is not None else index
+        return self.snapshot._mtimes[pos], self.snapshot._ids[pos]
+
+
+class GallerySnapshot:
+    # 列式存储，按 (mtime, id) 升序排列：新保存的文件追加在末尾，分页从末尾倒序读取
+    def __init__(self, config: SIAConfig) -> None:
+        self.base_dir = config.base_dir
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._stale = True
+        self._reset()
+
+    def _reset(self) -> None:
+        self._ids = array("q")
+        self._mtimes = array("q")
+        self._items = array("q")
+        self._author_codes = array("l")
+        self._sha256 = bytearray()
+        self._paths: list[str] = []
+        self._positions: dict[str, int] = {}
+        self._authors: list[str] = []
+        self._author_index: dict[str, int] = {}
+        self._by_author: dict[int, array] = {}
+        self._posts: dict[int, tuple[str, str]] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ids)
+
+    def _ensure_loaded(self) -> None:
+        if self._stale:
+            self._load()
+
+    def _load(self) -> None:
+        self._reset()
+        engine = get_read_engine(self.base_dir)
+        with session_scope(engine) as session:
+            for item_id, post_id, source in session.execute(
+                select(Item.id, Item.post_id, Item.source)
+            ):
+                self._posts[item_id] = (post_id, source or "")
+            stmt = (
+                _rows()
+                .order_by(File.mtime, File.id)
+                .execution_options(yield_per=STREAM_BATCH)
+            )
+            authors = author_index(session)
+            for row in session.execute(stmt):
+                self._append(*row, authors)
+        self._stale = False
+        self.generation += 1
+        logger.info("图库快照已加载: %s 项 (第 %s 代)", len(self._ids), self.generation)
+
+    def _append(
+        self,
+        file_id: int,
+        mtime: datetime,
+        item_id: Optional[int],
+        author_id: int,
+        name: str,
+        sha256: bytes,
+        authors: dict[int, tuple[str, Optional[str]]],
+    ) -> None:
+        author, folder = authors[author_id]
+        code = self._author_index.get(author)
+        if code is None:
+            code = self._author_index[author] = len(self._authors)
+            self._authors.append(author)
+            self._by_author[code] = array("l")
+        self._by_author[code].append(len(self._ids))
+        self._ids.append(file_id)
+        self._mtimes.append(_to_micros(mtime))
+        self._items.append(item_id or NO_ITEM)
+        self._author_codes.append(code)
+        self._sha256 += sha256 if len(sha256) == 32 else bytes(32)
+        path = join_rel_path(folder, name)
+        self._positions[path] = len(self._paths)
+        self._paths.append(path)
+
+    def _entry(self, pos: int) -> dict[str, object]:
+        post_id, source = self._posts.get(self._items[pos], ("", ""))
+        return GalleryItem(
+            author=self._authors[self._author_codes[pos]],
+            path=self._paths[pos],
+            mtime=_from_micros(self._mtimes[pos]),
+            post_id=post_id,
+            source=source,
+            sha256=self._sha256[pos * 32 : pos * 32 + 32].hex(),
+        ).to_json()
+
+    def add_saved(self, rel_paths: Iterable[str]) -> None:
+        wanted = list(rel_paths)
+        if not wanted:
+            return
+        with self._lock:
+            if self._stale:
+                return
+            engine = get_read_engine(self.base_dir)
+            with session_scope(engine) as session:
+                paths = at_paths(session, wanted)
+                posts = select(Item.id, Item.post_id, Item.source).join(
+                    File, File.item_id == Item.id
+                )
+                for item_id, post_id, source in session.execute(posts.where(paths)):
+                    self._posts[item_id] = (post_id, source or "")
+                stmt = _rows().where(paths).order_by(File.mtime, File.id)
+                rows = session.execute(stmt).all()
+                authors = author_index(session, (row[3] for row in rows))
+            known = set(self._ids[-len(rows) :]) if rows else set()
+            for row in rows:
+                if row[0] in known:
+                    continue
+                if self._ids and (_to_micros(row[1]), row[0]) < (
+                    self._mtimes[-1],
+                    self._ids[-1],
+                ):
+                    # 不是追加到末尾（时间回拨等），交给下次读取时整体重载
+                    self._stale = True
+                    return
+                self._append(*row, authors)
+            self.generation += 1
+
+    def rename(self, renames: Iterable[tuple[str, str]]) -> int:
+        mapping = dict(renames)
+        if not mapping:
+            return 0
+        with self._lock:
+            if self._stale:
+                return 0
+            # 先摘下全部旧路径再登记新路径，互换名字的一批改名也不会相互覆盖
+            moved = [
+                (self._positions.pop(old), new)
+                for old, new in mapping.items()
+                if old in self._positions
+            ]
+            for pos, new in moved:
+                self._paths[pos] = new
+                self._positions[new] = pos
+            changed = len(moved)
+            if changed:
+                self.generation += 1
+            return changed
+
+    def _page(
+        self, positions: Optional[array], end: int, count: int
+    ) -> list[dict[str, object]]:
+        indexes = range(end - 1, max(0, end - count) - 1, -1)
+        if positions is None:
+            return [self._entry(index) for index in indexes]
+        return [self._entry(positions[index]) for index in indexes]
+
+    def paginate(
+        self,
+        page: int = 1,
+        page_size: int = 40,
+        author: Optional[str] = None,
+        cursor: Optional[str] = None,
+    ) -> dict[str, object]:
+        page = max(1, page)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        with self._lock:
+            self._ensure_loaded()
+            positions: Optional[array] = None
+            if author:
+                code = self._author_index.get(author)
+                positions = self._by_author[code] if code is not None else array("l")
+            total = len(positions) if positions is not None else len(self._ids)
+            if cursor is not None:
+                end = total
+                if cursor:
+                    mtime, file_id = decode_cursor(cursor)
+                    end = bisect_left(
+                        _Key(self, positions), (_to_micros(mtime), file_id)
+                    )
+                items = self._page(positions, end, page_size)
+                has_more = end > page_size
+                last = end - len(items)
+                next_cursor = None
+                if has_more and items:
+                    pos = positions[last] if positions is not None else last
+                    next_cursor = encode_cursor(
+                        _from_micros(self._mtimes[pos]), self._ids[pos]
+                    )
+                return {
+                    "page_size": page_size,
+                    "items": items,
+                    "next_cursor": next_cursor,
+                    "generation": self.generation,
+                }
+            end = total - (page - 1) * page_size
+            items = self._page(positions, end, page_size) if end > 0 else []
+            return {
+                "page": page,
+                "page_size": page_size,
+                "total": total,
+                "items": items,
+                "generation": self.generation,
+            }
+
+    def author_counts(self) -> dict[str, int]:
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                self._authors[code]: len(positions)
+                for code, positions in self._by_author.items()
+            }
+
+
+_SNAPSHOTS: dict[Path, GallerySnapshot] = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def get_gallery_snapshot(config: SIAConfig) -> GallerySnapshot:
+    key = config.base_dir.resolve()
+    with _SNAPSHOTS_LOCK:
+        snapshot = _SNAPSHOTS.get(key)
+        if snapshot is None:
+            snapshot = _SNAPSHOTS[key] = GallerySnapshot(config)
+        return snapshot
+
+
+def loaded_snapshots() -> list[GallerySnapshot]:
+    with _SNAPSHOTS_LOCK:
+        return list(_SNAPSHOTS.values())
+
+
+def record_renames(config: SIAConfig, renames: Iterable[tuple[Path, Path]]) -> int:
+    # 同步磁盘改名到数据库、已加载的快照与静态清单
+    root = config.base_dir.resolve()
+    pairs: list[tuple[str, str]] = []
+    for source, destination in renames:
+        try:
+            pairs.append(
+                (
+                    source.resolve().relative_to(root).as_posix(),
+                    destination.resolve().relative_to(root).as_posix(),
+                )
+            )
+        except ValueError:
+            continue
+    if not pairs:
+        return 0
+
+    def write(session) -> int:
+        updated = 0
+        for old, new in pairs:
+            row = session.scalar(select(File).where(at_paths(session, [old])))
+            if row is not None:
+                folder, name = split_rel_path(new)
+                if folder != row.author.folder:
+                    row.author = author_for(session, row.author.name, folder)
+                row.name = name
+                updated += 1
+        return updated
+
+    updated = get_writer(config.base_dir).run(write)
+    for snapshot in loaded_snapshots():
+        if snapshot.base_dir.resolve() == root:
+            snapshot.rename(pairs)
+    if updated:
+        # 行数不变，增量合并的计数校验发现不了旧路径，需显式传入新旧两侧
+        incremental_update([path for pair in pairs for path in pair], config=config)
+    return updated
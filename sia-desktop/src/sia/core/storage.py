@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from .config import CONFIG, SIAConfig
+from .db import BUSY_TIMEOUT, DB_NAME, apply_pragmas, get_engine
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+COMMIT_WINDOW = 0.005
+MAX_BATCH = 128
+
+
+@dataclass
+class _WriteJob:
+    fn: Callable[[Session], object]
+    future: Future = field(default_factory=Future)
+
+
+def _writer_engine(db_path: Path) -> any:
+    # 写线程独占一个连接；自行发出 BEGIN IMMEDIATE，保存点才能按 SQLite 语义工作
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        future=True,
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, _record) -> None:
+        dbapi_connection.isolation_level = None
+        apply_pragmas(dbapi_connection)
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn) -> None:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return engine
+
+
+class SQLiteWriter:
+    # 所有写入排队交给单个线程，每隔几毫秒合并为一次提交；单个任务失败只回滚到自己的保存点
+    def __init__(
+        self, base_dir: Path, window: float = COMMIT_WINDOW, max_batch: int = MAX_BATCH
+    ) -> None:
+        self.base_dir = base_dir
+        self.db_path = base_dir.resolve() / DB_NAME
+        self.window = window
+        self.max_batch = max_batch
+        self.commits = 0
+        self.jobs = 0
+        self._queue: "queue.SimpleQueue[Optional[_WriteJob]]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._engine = self._open()
+        self._thread = threading.Thread(
+            target=self._loop, name="sia-db-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _open(self) -> any:
+        get_engine(self.base_dir)
+        return _writer_engine(self.db_path)
+
+    def submit(self, fn: Callable[[Session], T]) -> "Future[T]":
+        # 与 stop 共用锁：停止标记一旦设置，结束标记之后不会再有任务入队
+        with self._lock:
+            if self._stopped or not self._thread.is_alive():
+                raise RuntimeError("数据库写线程已停止")
+            job = _WriteJob(fn)
+            self._queue.put(job)
+        return job.future
+
+    def run(self, fn: Callable[[Session], T], timeout: Optional[float] = None) -> T:
+        return self.submit(fn).result(timeout)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            if not self._stopped:
+                self._stopped = True
+                self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        self._engine.dispose()
+
+    def _loop(self) -> None:
+        try:
+            self._serve()
+        finally:
+            self._drain()
+
+    def _drain(self) -> None:
+        # 写线程退出后仍留在队列里的任务不会再执行，让等待方立即收到异常
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and job.future.set_running_or_notify_cancel():
+                job.future.set_exception(RuntimeError("数据库写线程已停止"))
+
+    def _serve(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stopping = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch: list[_WriteJob]) -> None:
+        if not self.db_path.exists():
+            self._engine.dispose()
+            self._engine = self._open()
+        done: list[tuple[_WriteJob, object]] = []
+        try:
+            with Session(self._engine, expire_on_commit=False) as session:
+                for job in batch:
+                    if not job.future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with session.begin_nested():
+                            done.append((job, job.fn(session)))
+                    except Exception as exc:  # noqa: BLE001
+                        job.future.set_exception(exc)
+                session.commit()
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("批量提交失败: %s 个写入", len(done))
+            for job, _ in done:
+                job.future.set_exception(exc)
+            return
+        self.commits += 1
+        self.jobs += len(done)
+        for job, value in done:
+            job.future.set_result(value)
+
+
+_WRITERS: dict[Path, SQLiteWriter] = {}
+_WRITERS_LOCK = threading.Lock()
+
+
+def get_writer(base_dir: Path) -> SQLiteWriter:
+    key = base_dir.resolve()
+    with _WRITERS_LOCK:
+        writer = _WRITERS.get(key)
+        if writer is None:
+            writer = _WRITERS[key] = SQLiteWriter(key)
+        return writer
+
+
+def stop_writers(keep: Optional[Path] = None) -> int:
+    keep_key = keep.resolve() if keep is not None else None
+    with _WRITERS_LOCK:
+        stale = [_WRITERS.pop(key) for key in list(_WRITERS) if key != keep_key]
+    for writer in stale:
+        writer.stop()
+    return len(stale)
+
+
+def _reset_writers(config: SIAConfig) -> None:
+    stopped = stop_writers(keep=config.base_dir)
+    if stopped:
+        logger.info("数据目录已切换，停止 %s 个写线程", stopped)
+
+
+CONFIG.add_listener(_reset_writers)
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+try:  # pragma: no cover - Pillow optional at import time
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = ImageOps = None  # type: ignore
+
+from sqlalchemy import desc, select
+
+from .blobstore import BlobStore
+from .config import SIAConfig
+from .db import FILE_REL_PATH, Asset, Author, File, get_read_engine, session_scope
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+THUMB_SIZES = (160, 320, 640)
+THUMB_DIR = Path(".cache") / "thumbs"
+THUMB_FORMAT = "webp"
+THUMB_QUALITY = 80
+
+
+def thumbnails_available() -> bool:
+    return Image is not None
+
+
+def render_thumbnail(source: str, target: str, size: int) -> int:
+    dst = Path(target)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    try:
+        with Image.open(source) as img:
+            img.draft("RGB", (size, size))
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                alpha = img.mode in ("LA", "PA") or "transparency" in img.info
+                img = img.convert("RGBA" if alpha else "RGB")
+            img.thumbnail((size, size))
+            img.save(tmp, THUMB_FORMAT, quality=THUMB_QUALITY, method=4)
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return dst.stat().st_size
+
+
+class ThumbnailService:
+    def __init__(self, config: SIAConfig, workers: Optional[int] = None) -> None:
+        self.base_dir = config.base_dir
+        self.root = config.base_dir / THUMB_DIR
+        self.budget = config.thumb_cache_mb * 1024 * 1024
+        self._workers = workers or max(1, min(4, os.cpu_count() or 1))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.RLock()
+        self._inflight: dict[Path, Future[int]] = {}
+        self._entries: OrderedDict[Path, int] = OrderedDict()
+        self._total = 0
+        self._scan()
+
+    def _scan(self) -> None:
+        if not self.root.exists():
+            return
+        found = []
+        for path in self.root.glob(f"*/*.{THUMB_FORMAT}"):
+            stat = path.stat()
+            found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total += size
+
+    def path_for(self, sha256: str, size: int) -> Path:
+        return self.root / sha256[:2] / f"{sha256}_{size}.{THUMB_FORMAT}"
+
+    def source_for(self, sha256: str) -> Optional[Path]:
+        blob = BlobStore(self.base_dir).path_for(sha256)
+        if blob.is_file():
+            return blob
+        engine = get_read_engine(self.base_dir)
+        with session_scope(engine) as session:
+            stmt = (
+                select(FILE_REL_PATH)
+                .join(Asset, File.asset_id == Asset.id)
+                .join(Author, File.author_id == Author.id)
+                .where(Asset.sha256 == sha256)
+                .order_by(desc(File.mtime))
+            )
+            for rel_path in session.scalars(stmt):
+                path = self.base_dir / rel_path
+                if path.is_file():
+                    return path
+        return None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _submit(self, sha256: str, size: int, source: Path) -> Future[int]:
+        target = self.path_for(sha256, size)
+        with self._lock:
+            future = self._inflight.get(target)
+            if future is None:
+                future = self._pool().submit(
+                    render_thumbnail, str(source), str(target), size
+                )
+                self._inflight[target] = future
+                future.add_done_callback(
+                    lambda done, path=target: self._finished(path, done)
+                )
+            return future
+
+    def _finished(self, path: Path, future: Future[int]) -> None:
+        with self._lock:
+            self._inflight.pop(path, None)
+            if future.cancelled():
+                logger.info("缩略图任务已取消 %s", path.name)
+                return
+            if future.exception() is not None:
+                logger.warning("缩略图生成失败 %s: %s", path.name, future.exception())
+                return
+            self._total += future.result() - self._entries.pop(path, 0)
+            self._entries[path] = future.result()
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._total > self.budget and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total -= size
+            path.unlink(missing_ok=True)
+
+    def _touch(self, path: Path) -> None:
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def get(
+        self, sha256: str, size: int, source: Optional[Path] = None
+    ) -> Optional[Path]:
+        target = self.path_for(sha256, size)
+        if target.exists():
+            self._touch(target)
+            return target
+        source = source or self.source_for(sha256)
+        if source is None:
+            return None
+        try:
+            self._submit(sha256, size, source).result()
+        except Exception:  # noqa: BLE001
+            return None
+        return target
+
+    def schedule(self, sha256: str, source: Path) -> None:
+        for size in THUMB_SIZES:
+            if not self.path_for(sha256, size).exists():
+                self._submit(sha256, size, source)
+
+    def usage(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._total,
+                "budget": self.budget,
+            }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+_SERVICES: dict[Path, ThumbnailService] = {}
+_SERVICES_LOCK = threading.Lock()
+
+
+def get_thumbnail_service(config: SIAConfig) -> ThumbnailService:
+    key = config.base_dir.resolve()
+    with _SERVICES_LOCK:
+        service = _SERVICES.get(key)
+        if service is None:
+            service = _SERVICES[key] = ThumbnailService(config)
+        return service
+
+
+def shutdown_thumbnail_services() -> None:
+    with _SERVICES_LOCK:
+        services = list(_SERVICES.values())
+        _SERVICES.clear()
+    for service in services:
+        service.shutdown()
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import desc, select
+
+from .blobstore import BlobStore, link_file
+from .config import SIAConfig
+from .db import (
+    FILE_REL_PATH,
+    Asset,
+    Author,
+    File,
+    UrlCache,
+    UrlCacheDay,
+    get_read_engine,
+    session_scope,
+)
+from .logger import get_logger
+from .storage import get_writer
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedUrl:
+    url: str
+    sha256: str
+    bytes: int
+    content_type: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    checked_at: datetime
+    source: Path
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class UrlAssetCache:
+    def __init__(self, config: SIAConfig) -> None:
+        self.base_dir = config.base_dir
+        self.fresh_for = timedelta(seconds=config.download.url_cache_fresh_seconds)
+        self.use_links = config.enable_hardlinks
+        self._engine = get_read_engine(config.base_dir)
+        self._writer = get_writer(config.base_dir)
+        self._blobs = BlobStore(config.base_dir)
+
+    def lookup(self, url: str) -> Optional[CachedUrl]:
+        with session_scope(self._engine) as session:
+            entry = session.scalar(select(UrlCache).where(UrlCache.url == url))
+            if entry is None:
+                return None
+            source = self._local_copy(session, entry.sha256)
+            if source is None:
+                return None
+            return CachedUrl(
+                url=entry.url,
+                sha256=entry.sha256,
+                bytes=entry.bytes,
+                content_type=entry.content_type,
+                etag=entry.etag,
+                last_modified=entry.last_modified,
+                checked_at=entry.checked_at,
+                source=source,
+            )
+
+    def _local_copy(self, session, sha256: str) -> Optional[Path]:
+        blob = self._blobs.path_for(sha256)
+        if blob.is_file():
+            return blob
+        stmt = (
+            select(FILE_REL_PATH)
+            .join(Asset, File.asset_id == Asset.id)
+            .join(Author, File.author_id == Author.id)
+            .where(Asset.sha256 == sha256)
+            .order_by(desc(File.mtime))
+        )
+        for rel_path in session.scalars(stmt):
+            path = self.base_dir / rel_path
+            if path.is_file():
+                return path
+        return None
+
+    def is_fresh(self, cached: CachedUrl) -> bool:
+        return datetime.utcnow() - cached.checked_at < self.fresh_for
+
+    def materialize(self, cached: CachedUrl, dst: Path) -> None:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(dst.name + ".cache")
+        tmp.unlink(missing_ok=True)
+        if not (self.use_links and link_file(cached.source, tmp)):
+            shutil.copyfile(cached.source, tmp)
+        os.replace(tmp, dst)
+
+    def store(
+        self,
+        url: str,
+        sha256: str,
+        size: int,
+        content_type: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        def write(session) -> None:
+            entry = session.scalar(select(UrlCache).where(UrlCache.url == url))
+            if entry is None:
+                entry = UrlCache(url=url)
+                session.add(entry)
+            entry.sha256 = sha256
+            entry.bytes = size
+            entry.content_type = content_type
+            entry.etag = etag
+            entry.last_modified = last_modified
+            entry.checked_at = datetime.utcnow()
+
+        self._writer.run(write)
+
+    def record_hit(self, cached: CachedUrl, revalidated: bool) -> None:
+        day = datetime.utcnow().date().isoformat()
+
+        def write(session) -> None:
+            if revalidated:
+                entry = session.scalar(
+                    select(UrlCache).where(UrlCache.url == cached.url)
+                )
+                if entry is not None:
+                    entry.checked_at = datetime.utcnow()
+            stats = session.get(UrlCacheDay, day)
+            if stats is None:
+                stats = UrlCacheDay(day=day, hits=0, revalidated=0, bytes_saved=0)
+                session.add(stats)
+            stats.hits += 1
+            stats.revalidated += int(revalidated)
+            stats.bytes_saved += cached.bytes
+
+        self._writer.run(write)
+        logger.info(
+            "URL 缓存命中%s %s (%s 字节)",
+            "(304)" if revalidated else "",
+            cached.url,
+            cached.bytes,
+        )
+
+
+def daily_stats(config: SIAConfig, days: int = 30) -> list[dict[str, object]]:
+    engine = get_read_engine(config.base_dir)
+    with session_scope(engine) as session:
+        stmt = select(UrlCacheDay).order_by(desc(UrlCacheDay.day)).limit(days)
+        return [row.as_dict() for row in session.scalars(stmt)]
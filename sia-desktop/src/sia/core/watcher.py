@@ -12,14 +12,19 @@ from watchdog.observers import Observer
 
 from .config import CONFIG, SIAConfig
 from .logger import get_logger
+from .snapshot import record_renames
 
 logger = get_logger(__name__)
 
+# 下载与索引流程自身 os.replace 用到的临时后缀，这些移动不是图库改名
+TEMP_SUFFIXES = {".part", ".link", ".cache", ".tmp"}
+
 
 @dataclass
 class WatchEvent:
     path: Path
     is_directory: bool
+    src_path: Optional[Path] = None
 
 
 class StableEventHandler(FileSystemEventHandler):
@@ -31,7 +36,9 @@ class StableEventHandler(FileSystemEventHandler):
         self.queue.put(WatchEvent(Path(event.src_path), event.is_directory))
 
     def on_moved(self, event) -> None:  # type: ignore[override]
-        self.queue.put(WatchEvent(Path(event.dest_path), event.is_directory))
+        self.queue.put(
+            WatchEvent(Path(event.dest_path), event.is_directory, Path(event.src_path))
+        )
 
 
 class Watcher:
@@ -68,10 +75,30 @@ class Watcher:
             path = event.path
             if not path.exists():
                 continue
+            if (
+                event.src_path is not None
+                and not event.is_directory
+                and self._is_gallery_move(event.src_path, path)
+            ):
+                record_renames(self._config, [(event.src_path, path)])
             if self._wait_stable(path):
                 logger.info("稳定文件: %s", path)
                 self._callback([path])
 
+    def _is_gallery_move(self, source: Path, destination: Path) -> bool:
+        # 只有作者目录下可见图片之间的移动才需要同步数据库
+        if source.suffix in TEMP_SUFFIXES:
+            return False
+        root = self._config.base_dir
+        try:
+            rel_paths = (source.relative_to(root), destination.relative_to(root))
+        except ValueError:
+            return False
+        return all(
+            len(rel.parts) >= 2 and not any(part.startswith(".") for part in rel.parts)
+            for rel in rel_paths
+        )
+
     def _wait_stable(self, path: Path, wait: float = 1.0, checks: int = 3) -> bool:
         prev_size = -1
         for _ in range(checks):
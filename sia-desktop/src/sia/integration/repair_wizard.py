@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Iterable, List
+from typing import Iterable, List, Optional
 
 from ..core import renamer
+from ..core.config import CONFIG, SIAConfig
 from ..core.logger import get_logger
 
 logger = get_logger(__name__)
@@ -14,5 +15,7 @@ def preview(base_dir: Path) -> List[renamer.RenamePlan]:
     return renamer.scan_directory(base_dir)
 
 
-def execute(plans: Iterable[renamer.RenamePlan]) -> None:
-    renamer.apply(plans, preview=False)
+def execute(
+    plans: Iterable[renamer.RenamePlan], config: Optional[SIAConfig] = None
+) -> None:
+    renamer.apply(plans, preview=False, config=config or CONFIG.get())
@@ -1,29 +1,89 @@
 from __future__ import annotations
 
-import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
 
+import anyio.to_thread
 from fastapi import Depends, FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, RedirectResponse, Response
 from pydantic import BaseModel, HttpUrl, field_validator
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..core import indexer
+from ..core.blobstore import BlobStore
 from ..core.config import CONFIG, SIAConfig
-from ..core.db import Asset, File, Item, get_engine, session_scope
+from ..core.db import Asset, File, Item, author_for, get_read_engine, session_scope
+from ..core.imagemeta import HeaderSniffer, ImageMeta, read_image_meta
 from ..core.logger import get_logger
-from .downloader import compute_signature, download_strict
+from ..core.phash import (
+    DEFAULT_DISTANCE,
+    MAX_DISTANCE,
+    describe_groups,
+    dhash,
+    files_for,
+    format_hash,
+    get_duplicate_index,
+)
+from ..core.shards import MANIFEST_DIR, SHARD_DIR
+from ..core.snapshot import get_gallery_snapshot
+from ..core.storage import get_writer
+from ..core.thumbnails import (
+    THUMB_SIZES,
+    get_thumbnail_service,
+    shutdown_thumbnail_services,
+    thumbnails_available,
+)
+from ..core.urlcache import UrlAssetCache, daily_stats
+from .breaker import get_breakers
+from .downloader import (
+    compute_signature,
+    download_strict,
+    get_session_pool,
+    pending_downloads,
+)
+from .jobs import JobQueue
+from .metrics import METRICS
+from .ratelimit import get_limiter
 
 logger = get_logger(__name__)
 
-app = FastAPI(title="Social Image Archiver")
+_QUEUES: dict[Path, JobQueue] = {}
+_QUEUES_LOCK = threading.Lock()
+_FOLDER_LOCK = threading.Lock()
+_AUTHOR_LOCKS: dict[str, threading.Lock] = {}
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
+    # 同步路由与 run_in_threadpool 共用这一线程池；数据库、文件系统等阻塞操作都不在事件循环上执行
+    anyio.to_thread.current_default_thread_limiter().total_tokens = BLOCKING_THREADS
+    await run_in_threadpool(get_job_queue, CONFIG.get())
+    yield
+    shutdown_job_queues()
+    shutdown_thumbnail_services()
+
+
+app = FastAPI(title="Social Image Archiver", lifespan=lifespan)
 
 GALLERY_PATH = Path(__file__).resolve().parents[3] / "gallery.html"
 
 FILE_PATTERN = re.compile(r"^(?P<prefix>\d{5})_[^_]+_(?P<index>\d{3})")
 
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+SHARD_PATTERN = re.compile(r"^[0-9a-f]{20}\.json$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+BLOCKING_THREADS = 32
+
+DownloadResult = Tuple[str, int, str, Optional[ImageMeta], Optional[int]]
+
 
 class SavePayload(BaseModel):
     author: str
@@ -50,38 +110,219 @@ async def healthz() -> dict[str, str]:
 
 
 @app.get("/", response_class=FileResponse)
-async def gallery_page() -> FileResponse:
+def gallery_page() -> FileResponse:
     if not GALLERY_PATH.exists():
         raise HTTPException(status_code=500, detail="gallery.html 未找到")
     return FileResponse(GALLERY_PATH, media_type="text/html")
 
 
 @app.get("/images.json")
-async def images_json(config: SIAConfig = Depends(get_config)) -> JSONResponse:
+def images_json(request: Request, config: SIAConfig = Depends(get_config)) -> Response:
     path = config.base_dir / "images.json"
-    path.parent.mkdir(parents=True, exist_ok=True)
-    if not path.exists():
-        path.write_text("[]", encoding="utf-8")
-        return JSONResponse([])
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-    except json.JSONDecodeError as exc:  # pragma: no cover - defensive
-        raise HTTPException(status_code=500, detail="images.json 格式错误") from exc
-    return JSONResponse(data)
+    etag = indexer.manifest_etag(path)
+    if not path.exists() or etag is None:
+        indexer.build_index(config)
+        etag = indexer.manifest_etag(path)
+    encoding = _negotiate_encoding(request.headers.get("accept-encoding", ""), path)
+    tag = f'"{etag}"' if encoding == "identity" else f'"{etag}-{encoding}"'
+    headers = {"ETag": tag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return FileResponse(
+        indexer.manifest_variant(path, encoding),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _negotiate_encoding(header: str, path: Path) -> str:
+    accepted: dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if (
+            accepted.get(encoding, accepted.get("*", 0.0)) > 0
+            and indexer.manifest_variant(path, encoding).exists()
+        ):
+            return encoding
+    return "identity"
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        value = candidate.strip().removeprefix("W/").strip('"')
+        if value.split("-", 1)[0] == etag:
+            return True
+    return False
+
+
+@app.get(f"/{MANIFEST_DIR}/{SHARD_DIR}/{{name}}")
+def manifest_shard(name: str, config: SIAConfig = Depends(get_config)) -> FileResponse:
+    path = config.base_dir / MANIFEST_DIR / SHARD_DIR / name
+    if not SHARD_PATTERN.match(name) or not path.is_file():
+        raise HTTPException(status_code=404, detail="分片不存在")
+    return FileResponse(
+        path,
+        media_type="application/json",
+        headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL},
+    )
+
+
+@app.get("/api/jobs/{job_id}")
+def api_job(job_id: str, config: SIAConfig = Depends(get_config)) -> dict[str, Any]:
+    job = get_job_queue(config).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.get("/api/downloads/stats")
+def api_download_stats(config: SIAConfig = Depends(get_config)) -> dict[str, object]:
+    return {
+        "pool": get_session_pool().stats(),
+        "limiter": get_limiter().snapshot(),
+        "breakers": get_breakers().snapshot(),
+        "url_cache": daily_stats(config),
+    }
+
+
+@app.get("/api/metrics")
+async def api_metrics() -> dict[str, object]:
+    return {"downloads": METRICS.snapshot()}
+
+
+@app.get("/thumb/{sha256}/{size}")
+def thumbnail(
+    sha256: str, size: int, config: SIAConfig = Depends(get_config)
+) -> Response:
+    if size not in THUMB_SIZES or not SHA256_PATTERN.match(sha256):
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+    service = get_thumbnail_service(config)
+    if not thumbnails_available():
+        source = service.source_for(sha256)
+        if source is None:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        rel_path = source.relative_to(config.base_dir).as_posix()
+        return RedirectResponse(f"/{rel_path}", status_code=307)
+    path = service.get(sha256, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="缩略图不存在")
+    return FileResponse(
+        path,
+        media_type="image/webp",
+        headers={
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+            "ETag": f'"{sha256}-{size}"',
+        },
+    )
+
+
+@app.get("/api/duplicates")
+def api_duplicates(
+    sha256: Optional[str] = None,
+    distance: int = DEFAULT_DISTANCE,
+    limit: int = 100,
+    config: SIAConfig = Depends(get_config),
+) -> dict[str, object]:
+    if not 0 <= distance <= MAX_DISTANCE:
+        raise HTTPException(
+            status_code=400, detail=f"distance 需在 0-{MAX_DISTANCE} 之间"
+        )
+    if sha256 is None:
+        # 分组按索引代数缓存，只为返回的这一页查询文件路径
+        groups = get_duplicate_index(config).groups(distance)
+        return {
+            "distance": distance,
+            "total": len(groups),
+            "groups": describe_groups(config, groups[: max(0, limit)]),
+        }
+    matches = get_duplicate_index(config).near_asset(sha256.lower(), distance)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="资产不存在或尚未计算感知哈希")
+    matches = matches[: max(0, limit)]
+    paths = files_for(config, [sha for _, sha in matches])
+    return {
+        "sha256": sha256.lower(),
+        "distance": distance,
+        "matches": [
+            {"sha256": sha, "distance": dist, "files": paths[sha]}
+            for dist, sha in matches
+        ],
+    }
 
 
 @app.get("/api/items")
-async def api_items(
+def api_items(
     page: int = 1,
     page_size: int = 40,
     author: Optional[str] = None,
     q: Optional[str] = None,
+    cursor: Optional[str] = None,
     config: SIAConfig = Depends(get_config),
 ) -> dict[str, object]:
-    return indexer.paginate(page=page, page_size=page_size, author=author, query=q, config=config)
+    try:
+        if q and q.strip():
+            return indexer.paginate(
+                page=page,
+                page_size=page_size,
+                author=author,
+                query=q,
+                config=config,
+                cursor=cursor,
+            )
+        return get_gallery_snapshot(config).paginate(
+            page=page, page_size=page_size, author=author, cursor=cursor
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+def get_job_queue(config: SIAConfig) -> JobQueue:
+    key = config.base_dir.resolve()
+    with _QUEUES_LOCK:
+        queue = _QUEUES.get(key)
+        if queue is None:
+            queue = JobQueue(config, process_save, workers=config.job_workers)
+            _QUEUES[key] = queue
+            queue.start()
+        queue.config = config
+        return queue
+
+
+def shutdown_job_queues() -> None:
+    with _QUEUES_LOCK:
+        queues = list(_QUEUES.values())
+        _QUEUES.clear()
+    for queue in queues:
+        queue.stop()
+
+
+def _author_lock(author: str) -> threading.Lock:
+    with _FOLDER_LOCK:
+        return _AUTHOR_LOCKS.setdefault(author, threading.Lock())
 
 
 def resolve_author_folder(author: str, base_dir: Path) -> Path:
+    with _FOLDER_LOCK:
+        return _resolve_author_folder(author, base_dir)
+
+
+def _resolve_author_folder(author: str, base_dir: Path) -> Path:
     safe = re.sub(r"[^a-zA-Z0-9_-]", "_", author)
     base_dir.mkdir(parents=True, exist_ok=True)
     candidates = [
@@ -127,7 +368,202 @@ def _resolve_gallery_file(path: str, base_dir: Path) -> Path:
     return target
 
 
-@app.post("/save")
+def _asset_exists(base_dir: Path, sha: str) -> bool:
+    with session_scope(get_read_engine(base_dir)) as session:
+        return session.scalar(select(Asset.id).where(Asset.sha256 == sha)) is not None
+
+
+def _download_one(
+    url: str, dst: Path, config: SIAConfig, cache: Optional[UrlAssetCache] = None
+) -> DownloadResult | Exception:
+    sniffer = HeaderSniffer()
+    try:
+        sha, size, content_type = download_strict(
+            url,
+            dst,
+            config.download.allowed_types,
+            config.download.timeout,
+            config.download.max_attempts,
+            cache=cache,
+            backoff=config.retry_backoff,
+            sniffer=sniffer,
+        )
+        meta = sniffer.result if sniffer.done else read_image_meta(dst)
+        # 感知哈希要完整解码图片，只为库里还没有的内容计算；精确重复随后在写库时丢弃
+        fresh = (
+            meta is not None
+            and meta.width is not None
+            and not _asset_exists(config.base_dir, sha)
+        )
+        return sha, size, content_type, meta, dhash(dst) if fresh else None
+    except Exception as exc:  # noqa: BLE001
+        logger.error("图片保存失败 %s: %s", url, exc)
+        return exc
+
+
+def _download_all(
+    targets: List[Tuple[str, Path]],
+    config: SIAConfig,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> List[DownloadResult | Exception]:
+    if not targets:
+        return []
+    workers = max(1, min(config.concurrency, len(targets)))
+    cache = UrlAssetCache(config)
+    results: List[DownloadResult | Exception] = [RuntimeError("下载未执行")] * len(
+        targets
+    )
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="sia-download"
+    ) as pool:
+        futures = {
+            pool.submit(_download_one, url, dst, config, cache): index
+            for index, (url, dst) in enumerate(targets)
+        }
+        for finished, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if on_progress:
+                on_progress(finished, len(targets))
+    return results
+
+
+@dataclass
+class _SaveOutcome:
+    saved: List[str] = field(default_factory=list)
+    saved_rel: List[str] = field(default_factory=list)
+    duplicates: List[str] = field(default_factory=list)
+    failed: List[dict[str, str]] = field(default_factory=list)
+    fresh_assets: List[Tuple[str, Path]] = field(default_factory=list)
+    hashed: List[Tuple[str, Path, int]] = field(default_factory=list)
+
+
+def _recorded_files(base_dir: Path, job_id: str) -> Optional[List[str]]:
+    with session_scope(get_read_engine(base_dir)) as session:
+        item = session.scalar(select(Item).where(Item.job_id == job_id))
+        if item is None:
+            return None
+        return [file.rel_path for file in sorted(item.files, key=lambda file: file.id)]
+
+
+def process_save(
+    data: dict[str, Any],
+    config: SIAConfig,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    job_id: Optional[str] = None,
+) -> dict[str, object]:
+    payload = SavePayload.model_validate(data)
+    base_dir = config.base_dir
+    recorded = _recorded_files(base_dir, job_id) if job_id else None
+    if recorded is not None:
+        # 任务在落库之后、标记完成之前中断：不再下载和写库，只补做之后的索引更新
+        logger.info("任务 %s 已落库，跳过重复保存", job_id)
+        get_gallery_snapshot(config).add_saved(recorded)
+        indexer.incremental_update(recorded, config=config)
+        return {
+            "ok": True,
+            "saved": [str(base_dir / rel) for rel in recorded],
+            "duplicates": [],
+            "similar": [],
+            "failed": [],
+        }
+    folder = resolve_author_folder(payload.author, base_dir)
+    with _author_lock(folder.name):
+        max_idx = _current_max_index(folder)
+        resumable = pending_downloads(folder)
+        targets: List[Tuple[str, Path]] = []
+        for image_url in payload.images:
+            url = str(image_url)
+            dst = resumable.pop(url, None)
+            if dst is None:
+                max_idx += 1
+                suffix = Path(image_url.path).suffix or ".jpg"
+                dst = folder / f"{folder.name}_{max_idx:03d}{suffix}"
+            targets.append((url, dst))
+        results = _download_all(targets, config, on_progress)
+        if config.enable_hardlinks:
+            # 硬链接入库是文件系统操作，放在写线程事务之外完成
+            store = BlobStore(base_dir)
+            for (_url, dst), result in zip(targets, results, strict=True):
+                if not isinstance(result, Exception):
+                    store.adopt(dst, result[0])
+
+        def record(session: Session) -> _SaveOutcome:
+            # 结果只写进本次返回值；批量提交失败时 run() 抛错，外层不会拿到已回滚的条目
+            outcome = _SaveOutcome()
+            author = author_for(session, payload.author, folder.name)
+            item = Item(
+                author=author,
+                post_id=payload.postId,
+                source=payload.source,
+                caption=payload.caption,
+                job_id=job_id,
+            )
+            session.add(item)
+            session.flush()
+            for (image_url, dst), result in zip(targets, results, strict=True):
+                if isinstance(result, Exception):
+                    outcome.failed.append({"url": image_url, "error": str(result)})
+                    continue
+                sha, size, _content_type, meta, phash = result
+                asset = session.query(Asset).filter(Asset.sha256 == sha).first()
+                if asset:
+                    outcome.duplicates.append(str(dst))
+                else:
+                    meta = meta or ImageMeta()
+                    asset = Asset(
+                        sha256=sha,
+                        ext=dst.suffix.lstrip("."),
+                        bytes=size,
+                        width=meta.width,
+                        height=meta.height,
+                        exif_taken_at=meta.exif_taken_at,
+                        phash=format_hash(phash) if phash is not None else None,
+                    )
+                    session.add(asset)
+                    session.flush()
+                    if meta.width is not None:
+                        outcome.fresh_assets.append((sha, dst))
+                    if phash is not None:
+                        outcome.hashed.append((sha, dst, phash))
+                file_entry = File(
+                    asset_id=asset.id,
+                    item_id=item.id,
+                    author=author,
+                    name=dst.relative_to(folder).as_posix(),
+                    mtime=datetime.utcnow(),
+                )
+                session.add(file_entry)
+                outcome.saved.append(str(dst))
+                outcome.saved_rel.append(file_entry.rel_path)
+            return outcome
+
+        outcome = get_writer(base_dir).run(record)
+    if thumbnails_available():
+        thumbs = get_thumbnail_service(config)
+        for sha, dst in outcome.fresh_assets:
+            thumbs.schedule(sha, dst)
+    similar: List[dict[str, object]] = []
+    if outcome.hashed:
+        near_index = get_duplicate_index(config)
+        for sha, dst, phash in outcome.hashed:
+            near_index.add(sha, phash)
+            matches = near_index.near(phash, DEFAULT_DISTANCE, exclude=sha)
+            if matches:
+                similar.append(
+                    {"path": str(dst), "matches": [match for _, match in matches]}
+                )
+    get_gallery_snapshot(config).add_saved(outcome.saved_rel)
+    indexer.incremental_update(outcome.saved_rel, config=config)
+    return {
+        "ok": not outcome.failed,
+        "saved": outcome.saved,
+        "duplicates": outcome.duplicates,
+        "similar": similar,
+        "failed": outcome.failed,
+    }
+
+
+@app.post("/save", status_code=202)
 async def save_endpoint(request: Request, payload: SavePayload, config: SIAConfig = Depends(get_config)) -> dict[str, object]:
     body = await request.body()
     if len(body) > config.download.max_body_kb * 1024:
@@ -136,51 +572,19 @@ async def save_endpoint(request: Request, payload: SavePayload, config: SIAConfi
     expected = compute_signature(config.hmac_key, body)
     if signature != expected:
         raise HTTPException(status_code=401, detail="签名不正确")
-    base_dir = config.base_dir
-    engine = get_engine(base_dir)
-    folder = resolve_author_folder(payload.author, base_dir)
-    saved: List[str] = []
-    duplicates: List[str] = []
-    with session_scope(engine) as session:
-        item = Item(author=payload.author, post_id=payload.postId, source=payload.source)
-        session.add(item)
-        session.flush()
-        max_idx = _current_max_index(folder)
-        for image_url in payload.images:
-            max_idx += 1
-            suffix = Path(image_url.path).suffix or ".jpg"
-            filename = f"{folder.name}_{max_idx:03d}{suffix}"
-            dst = folder / filename
-            sha, size, content_type = download_strict(
-                str(image_url),
-                dst,
-                config.download.allowed_types,
-                config.download.timeout,
-                config.download.max_attempts,
-            )
-            asset = session.query(Asset).filter(Asset.sha256 == sha).first()
-            if asset:
-                duplicates.append(str(dst))
-            else:
-                asset = Asset(sha256=sha, ext=suffix.lstrip("."), bytes=size, width=None, height=None)
-                session.add(asset)
-                session.flush()
-            file_entry = File(
-                asset_id=asset.id,
-                rel_path=str(dst.relative_to(base_dir)).replace("\\", "/"),
-                folder=payload.author,
-                mtime=datetime.utcnow(),
-            )
-            session.add(file_entry)
-            saved.append(str(dst))
-        session.commit()
-    indexer.incremental_update(saved, config=config)
-    return {"ok": True, "saved": saved, "duplicates": duplicates}
+    job_id = await run_in_threadpool(
+        lambda: get_job_queue(config).submit(
+            "save", payload.model_dump(mode="json"), total=len(payload.images)
+        )
+    )
+    return {"ok": True, "job_id": job_id, "status": "queued"}
 
 
 @app.get("/{requested_path:path}")
-async def gallery_assets(requested_path: str, config: SIAConfig = Depends(get_config)) -> FileResponse:
+def gallery_assets(
+    requested_path: str, config: SIAConfig = Depends(get_config)
+) -> FileResponse:
     if requested_path in {"", "index.html"}:
-        return await gallery_page()
+        return gallery_page()
     file_path = _resolve_gallery_file(requested_path, config.base_dir)
     return FileResponse(file_path)
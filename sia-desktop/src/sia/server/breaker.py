@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import requests
+
+from ..core.config import CONFIG, DownloadPolicy, SIAConfig
+from ..core.logger import get_logger
+
+logger = get_logger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+MAX_BACKOFF = 30.0
+MAX_OPEN_SECONDS = 600.0
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, host: str, retry_in: float) -> None:
+        super().__init__(f"{host} 熔断中，{retry_in:.1f} 秒后重试")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def parse_retry_after(
+    value: Optional[str], now: Optional[datetime] = None
+) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    current = now or datetime.now(timezone.utc)
+    return max(0.0, (when - current).total_seconds())
+
+
+def retry_after_of(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+
+def is_host_failure(exc: BaseException) -> bool:
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 0
+        return status >= 500 or status == 429
+    return isinstance(
+        exc,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+def jittered_backoff(base: float, attempt: int, cap: float = MAX_BACKOFF) -> float:
+    delay = min(cap, base * (2 ** max(0, attempt - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+@dataclass
+class _HostState:
+    state: str = STATE_CLOSED
+    failures: int = 0
+    open_until: float = 0.0
+    open_seconds: float = 0.0
+    probing: int = 0
+    trips: int = 0
+
+
+class CircuitBreakers:
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        half_open_probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self._clock = clock
+        self._hosts: dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_policy(cls, policy: DownloadPolicy) -> "CircuitBreakers":
+        return cls(
+            failure_threshold=policy.breaker_failures,
+            reset_seconds=policy.breaker_reset_seconds,
+        )
+
+    def before_request(self, host: str) -> None:
+        with self._lock:
+            entry = self._hosts.setdefault(host, _HostState())
+            if entry.state == STATE_CLOSED:
+                return
+            now = self._clock()
+            if entry.state == STATE_OPEN:
+                if now < entry.open_until:
+                    raise CircuitOpenError(host, entry.open_until - now)
+                entry.state = STATE_HALF_OPEN
+                entry.probing = 0
+                logger.info("熔断半开，探测 %s", host)
+            if entry.probing >= self.half_open_probes:
+                raise CircuitOpenError(host, 0.0)
+            entry.probing += 1
+
+    def record_success(self, host: str) -> None:
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                return
+            if entry.state != STATE_CLOSED:
+                logger.info("熔断恢复 %s", host)
+            self._hosts[host] = _HostState(trips=entry.trips)
+
+    def record_failure(self, host: str, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            entry = self._hosts.setdefault(host, _HostState())
+            entry.failures += 1
+            if entry.state == STATE_HALF_OPEN:
+                entry.open_seconds = min(
+                    MAX_OPEN_SECONDS, max(entry.open_seconds, self.reset_seconds) * 2
+                )
+                wait = max(entry.open_seconds, retry_after or 0.0)
+            elif retry_after is not None:
+                wait = retry_after
+            elif entry.failures >= self.failure_threshold:
+                entry.open_seconds = self.reset_seconds
+                wait = entry.open_seconds
+            else:
+                return
+            entry.state = STATE_OPEN
+            entry.open_until = self._clock() + wait
+            entry.probing = 0
+            entry.trips += 1
+            logger.warning("熔断打开 %s，%.1f 秒", host, wait)
+
+    def release_probe(self, host: str) -> None:
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is not None and entry.state == STATE_HALF_OPEN and entry.probing:
+                entry.probing -= 1
+
+    def state(self, host: str) -> str:
+        with self._lock:
+            entry = self._hosts.get(host)
+            return entry.state if entry else STATE_CLOSED
+
+    def snapshot(self) -> dict[str, dict[str, object]]:
+        now = self._clock()
+        with self._lock:
+            return {
+                host: {
+                    "state": entry.state,
+                    "failures": entry.failures,
+                    "trips": entry.trips,
+                    "retry_in": (
+                        round(max(0.0, entry.open_until - now), 3)
+                        if entry.state == STATE_OPEN
+                        else 0.0
+                    ),
+                }
+                for host, entry in self._hosts.items()
+                if entry.state != STATE_CLOSED or entry.failures or entry.trips
+            }
+
+
+_BREAKERS: Optional[CircuitBreakers] = None
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breakers() -> CircuitBreakers:
+    global _BREAKERS
+    with _BREAKERS_LOCK:
+        if _BREAKERS is None:
+            _BREAKERS = CircuitBreakers.from_policy(CONFIG.get().download)
+        return _BREAKERS
+
+
+def _reset_breakers(_config: SIAConfig) -> None:
+    global _BREAKERS
+    with _BREAKERS_LOCK:
+        _BREAKERS = None
+
+
+CONFIG.add_listener(_reset_breakers)
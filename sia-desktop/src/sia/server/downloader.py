@@ -2,65 +2,462 @@ from __future__ import annotations
 
 import hashlib
 import hmac
+import json
+import re
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, Tuple
+from typing import Iterable, Optional, Tuple
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-from ..core.config import CONFIG, SIAConfig
+from ..core.config import CONFIG, DownloadPolicy, SIAConfig
+from ..core.imagemeta import MAX_HEADER_BYTES, HeaderSniffer
 from ..core.logger import get_logger
+from ..core.urlcache import UrlAssetCache
+from .breaker import (
+    MAX_BACKOFF,
+    CircuitBreakers,
+    CircuitOpenError,
+    get_breakers,
+    is_host_failure,
+    jittered_backoff,
+    retry_after_of,
+)
+from .metrics import METRICS
+from .ratelimit import DownloadLimiter, get_limiter
 
 logger = get_logger(__name__)
 
 CHUNK_SIZE = 8192
 
 
+def origin_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+class _TimedConnectionMixin:
+    def _new_conn(self):  # type: ignore[no-untyped-def]
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()  # type: ignore[misc]
+        finally:
+            METRICS.observe_phase("connect", time.perf_counter() - start)
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self) -> None:
+        start = time.perf_counter()
+        before = METRICS.setup_seconds()
+        super().connect()
+        tcp = METRICS.setup_seconds() - before
+        METRICS.observe_phase("tls", max(0.0, time.perf_counter() - start - tcp))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:  # type: ignore[no-untyped-def]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+@dataclass
+class _OriginSession:
+    session: requests.Session
+    adapter: TimedHTTPAdapter
+    last_used: float = field(default_factory=time.monotonic)
+
+    def counters(self) -> Tuple[int, int]:
+        connections = requests_made = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_made += pool.num_requests
+        return connections, requests_made
+
+
+class SessionPool:
+    def __init__(
+        self, max_origins: int = 16, per_host: int = 4, idle_seconds: float = 90.0
+    ) -> None:
+        self.max_origins = max(1, max_origins)
+        self.per_host = max(1, per_host)
+        self.idle_seconds = idle_seconds
+        self._sessions: OrderedDict[str, _OriginSession] = OrderedDict()
+        self._lock = threading.Lock()
+        self._sessions_created = 0
+        self._evicted = 0
+        self._retired_connections = 0
+        self._retired_requests = 0
+
+    @classmethod
+    def from_policy(cls, policy: DownloadPolicy) -> "SessionPool":
+        return cls(
+            max_origins=policy.pool_max_origins,
+            per_host=policy.pool_per_host,
+            idle_seconds=policy.pool_idle_seconds,
+        )
+
+    def session_for(self, url: str) -> requests.Session:
+        origin = origin_of(url)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sessions.get(origin)
+            if entry is None:
+                entry = self._open(origin)
+                self._sessions[origin] = entry
+                while len(self._sessions) > self.max_origins:
+                    _, oldest = self._sessions.popitem(last=False)
+                    self._retire(oldest)
+            self._sessions.move_to_end(origin)
+            entry.last_used = now
+            return entry.session
+
+    def _open(self, origin: str) -> _OriginSession:
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(
+            pool_connections=1, pool_maxsize=self.per_host, pool_block=True
+        )
+        session.mount(f"{origin}/", adapter)
+        self._sessions_created += 1
+        logger.debug("新建连接池 %s", origin)
+        return _OriginSession(session=session, adapter=adapter)
+
+    def _evict_idle(self, now: float) -> None:
+        if self.idle_seconds <= 0:
+            return
+        expired = [
+            origin
+            for origin, entry in self._sessions.items()
+            if now - entry.last_used > self.idle_seconds
+        ]
+        for origin in expired:
+            self._retire(self._sessions.pop(origin))
+
+    def _retire(self, entry: _OriginSession) -> None:
+        connections, requests_made = entry.counters()
+        self._retired_connections += connections
+        self._retired_requests += requests_made
+        self._evicted += 1
+        entry.session.close()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            connections = self._retired_connections
+            requests_made = self._retired_requests
+            for entry in self._sessions.values():
+                opened, made = entry.counters()
+                connections += opened
+                requests_made += made
+            return {
+                "origins": len(self._sessions),
+                "sessions_created": self._sessions_created,
+                "sessions_evicted": self._evicted,
+                "connections_opened": connections,
+                "requests": requests_made,
+                "connections_reused": max(0, requests_made - connections),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            while self._sessions:
+                _, entry = self._sessions.popitem()
+                self._retire(entry)
+
+
+_POOL: Optional[SessionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_session_pool() -> SessionPool:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = SessionPool.from_policy(CONFIG.get().download)
+        return _POOL
+
+
+def _reset_session_pool(_config: SIAConfig) -> None:
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.close()
+
+
+CONFIG.add_listener(_reset_session_pool)
+
+
 def compute_signature(secret: str, payload: bytes) -> str:
     digest = hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
     return digest
 
 
+CONTENT_RANGE_PATTERN = re.compile(
+    r"^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+|\*)$"
+)
+
+
+def part_path(dst: Path) -> Path:
+    return dst.with_suffix(dst.suffix + ".part")
+
+
+def _meta_path(dst: Path) -> Path:
+    return dst.with_suffix(dst.suffix + ".part.json")
+
+
+def pending_downloads(folder: Path) -> dict[str, Path]:
+    pending: dict[str, Path] = {}
+    for meta in folder.glob("*.part.json"):
+        dst = meta.with_name(meta.name[: -len(".part.json")])
+        try:
+            url = json.loads(meta.read_text(encoding="utf-8"))["url"]
+        except (OSError, ValueError, KeyError):
+            continue
+        if part_path(dst).exists():
+            pending[url] = dst
+    return pending
+
+
+def _load_resume_state(
+    dst: Path, url: str
+) -> Tuple["hashlib._Hash", int, dict[str, str]]:
+    sha = hashlib.sha256()
+    tmp_path = part_path(dst)
+    meta_path = _meta_path(dst)
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        meta = {}
+    if meta.get("url") != url or not tmp_path.exists():
+        tmp_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+        return sha, 0, {}
+    offset = 0
+    with tmp_path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(chunk)
+            offset += len(chunk)
+    return sha, offset, meta
+
+
+def _save_resume_meta(dst: Path, url: str, resp: requests.Response) -> dict[str, str]:
+    meta = {"url": url}
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        meta["etag"] = etag
+    last_modified = resp.headers.get("Last-Modified")
+    if last_modified:
+        meta["last_modified"] = last_modified
+    _meta_path(dst).write_text(json.dumps(meta), encoding="utf-8")
+    return meta
+
+
+def _resume_headers(offset: int, meta: dict[str, str]) -> dict[str, str]:
+    if not offset:
+        return {}
+    headers = {"Range": f"bytes={offset}-"}
+    validator = meta.get("etag") or meta.get("last_modified")
+    if validator:
+        headers["If-Range"] = validator
+    return headers
+
+
+def _resumed_total(resp: requests.Response, offset: int) -> Optional[int]:
+    if resp.status_code != 206:
+        return None
+    match = CONTENT_RANGE_PATTERN.match(resp.headers.get("Content-Range", ""))
+    if not match or int(match.group("start")) != offset:
+        return None
+    total = match.group("total")
+    return int(total) if total != "*" else 0
+
+
 def download_strict(
     url: str,
     dst: Path,
     allowed_types: Iterable[str],
     timeout: int,
     max_attempts: int,
+    pool: Optional[SessionPool] = None,
+    cache: Optional[UrlAssetCache] = None,
+    limiter: Optional[DownloadLimiter] = None,
+    backoff: Optional[float] = None,
+    breakers: Optional[CircuitBreakers] = None,
+    sniffer: Optional[HeaderSniffer] = None,
 ) -> Tuple[str, int, str]:
     dst.parent.mkdir(parents=True, exist_ok=True)
+    sessions = pool or get_session_pool()
+    limiter = limiter or get_limiter()
+    breakers = breakers or get_breakers()
+    base_backoff = CONFIG.get().retry_backoff if backoff is None else backoff
+    host = urlsplit(url).netloc.lower()
+    throttle = limiter.throttles_bytes
+    tmp_path = part_path(dst)
+    sha, offset, meta = _load_resume_state(dst, url)
+    if offset:
+        logger.info("发现未完成下载，从 %s 字节续传 %s", offset, url)
+    cached = cache.lookup(url) if cache is not None and not offset else None
+    if cache is not None and cached is not None and cache.is_fresh(cached):
+        cache.materialize(cached, dst)
+        cache.record_hit(cached, revalidated=False)
+        METRICS.incr("cache_hits")
+        return cached.sha256, cached.bytes, cached.content_type
+    started = time.perf_counter()
     attempts = 0
-    backoff = 0.5
     allowed = set(allowed_types)
     while attempts < max_attempts:
         attempts += 1
+        METRICS.incr("attempts")
         try:
-            with requests.get(url, stream=True, timeout=timeout) as resp:
+            breakers.before_request(host)
+            session = sessions.session_for(url)
+            limiter.acquire_request(host)
+            METRICS.begin_request()
+            request_start = time.perf_counter()
+            if offset:
+                headers = _resume_headers(offset, meta)
+            else:
+                headers = cached.conditional_headers() if cached is not None else {}
+            with session.get(
+                url, stream=True, timeout=timeout, headers=headers
+            ) as resp:
+                headers_at = time.perf_counter()
+                ttfb = headers_at - request_start - METRICS.setup_seconds()
+                if resp.status_code < 500 and resp.status_code != 429:
+                    breakers.record_success(host)
+                if (
+                    cache is not None
+                    and cached is not None
+                    and resp.status_code == 304
+                ):
+                    cache.materialize(cached, dst)
+                    cache.record_hit(cached, revalidated=True)
+                    METRICS.incr("cache_revalidated")
+                    METRICS.observe_phases(
+                        [("ttfb", ttfb), ("total", headers_at - started)]
+                    )
+                    return cached.sha256, cached.bytes, cached.content_type
+                if offset and resp.status_code == 416:
+                    sha, offset = hashlib.sha256(), 0
+                    tmp_path.unlink(missing_ok=True)
+                    raise ValueError("续传范围无效，重新下载")
+                if (
+                    offset
+                    and resp.status_code == 206
+                    and _resumed_total(resp, offset) is None
+                ):
+                    # 206 的正文只是片段，不能当作完整文件写入；丢弃续传状态后整文件重下
+                    sha, offset, meta = hashlib.sha256(), 0, {}
+                    tmp_path.unlink(missing_ok=True)
+                    _meta_path(dst).unlink(missing_ok=True)
+                    raise ValueError("续传响应范围不符，重新下载")
                 resp.raise_for_status()
                 content_type = resp.headers.get("Content-Type", "").split(";")[0]
                 if content_type not in allowed:
+                    METRICS.incr("content_type_rejections")
                     raise ValueError(f"不允许的类型: {content_type}")
                 content_length = int(resp.headers.get("Content-Length", "0"))
-                tmp_path = dst.with_suffix(dst.suffix + ".part")
-                sha = hashlib.sha256()
-                total = 0
-                with tmp_path.open("wb") as fh:
+                resumed_total = _resumed_total(resp, offset) if offset else None
+                if resumed_total is None:
+                    if offset:
+                        logger.info("服务器未接受续传，重新下载 %s", url)
+                    sha, offset = hashlib.sha256(), 0
+                    expected = content_length
+                    mode = "wb"
+                    meta = _save_resume_meta(dst, url, resp)
+                else:
+                    expected = resumed_total
+                    mode = "ab"
+                    METRICS.incr("resumed")
+                if sniffer is not None:
+                    sniffer.reset()
+                    if mode == "ab":
+                        with tmp_path.open("rb") as head:
+                            sniffer.feed(head.read(MAX_HEADER_BYTES))
+                received_from = offset
+                with tmp_path.open(mode) as fh:
                     for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
                         if not chunk:
                             continue
                         fh.write(chunk)
-                        total += len(chunk)
+                        offset += len(chunk)
                         sha.update(chunk)
-                if content_length and total != content_length:
+                        if sniffer is not None and not sniffer.done:
+                            sniffer.feed(chunk)
+                        if throttle:
+                            limiter.consume(host, len(chunk))
+                finished = time.perf_counter()
+                METRICS.observe_phases(
+                    [
+                        ("ttfb", ttfb),
+                        ("body", finished - headers_at),
+                        ("total", finished - started),
+                    ]
+                )
+                METRICS.observe_download(offset - received_from, finished - headers_at)
+                if expected and offset != expected:
+                    sha, offset = hashlib.sha256(), 0
+                    tmp_path.unlink(missing_ok=True)
                     raise ValueError("大小不匹配")
                 tmp_path.replace(dst)
+                _meta_path(dst).unlink(missing_ok=True)
                 digest = sha.hexdigest()
+                if cache is not None:
+                    cache.store(
+                        url,
+                        digest,
+                        offset,
+                        content_type,
+                        meta.get("etag"),
+                        meta.get("last_modified"),
+                    )
+                METRICS.incr("downloads_ok")
                 logger.info("下载完成 %s -> %s", url, dst)
-                return digest, total, content_type
+                return digest, offset, content_type
+        except CircuitOpenError:
+            METRICS.incr("circuit_open")
+            METRICS.incr("downloads_failed")
+            raise
         except Exception as exc:  # noqa: BLE001
             logger.warning("下载失败(%s/%s): %s", attempts, max_attempts, exc)
-            if attempts >= max_attempts:
+            retry_after = retry_after_of(exc)
+            if is_host_failure(exc):
+                breakers.record_failure(host, retry_after)
+            else:
+                breakers.release_probe(host)
+            if tmp_path.exists() and tmp_path.stat().st_size != offset:
+                sha, offset, meta = _load_resume_state(dst, url)
+            if attempts >= max_attempts or (retry_after or 0.0) > MAX_BACKOFF:
+                METRICS.incr("downloads_failed")
                 raise
-            time.sleep(backoff)
-            backoff *= 2
+            METRICS.incr("retries")
+            time.sleep(
+                max(jittered_backoff(base_backoff, attempts), retry_after or 0.0)
+            )
     raise RuntimeError("下载失败")
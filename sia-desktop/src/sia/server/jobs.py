@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import json
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from sqlalchemy import (
+    DateTime,
+    Integer,
+    String,
+    Text,
+    create_engine,
+    func,
+    select,
+    update,
+)
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from ..core.config import SIAConfig
+from ..core.db import enable_wal
+from ..core.logger import get_logger
+
+logger = get_logger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+ProgressCallback = Callable[[int, int], None]
+# 处理函数收到任务 id，重放 RUNNING 任务时据此识别已完成的工作
+JobHandler = Callable[
+    [dict[str, Any], SIAConfig, ProgressCallback, str], dict[str, Any]
+]
+
+
+class JobBase(DeclarativeBase):
+    pass
+
+
+class Job(JobBase):
+    __tablename__ = "jobs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default=JOB_QUEUED)
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    done: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    result: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow
+    )
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+def jobs_db_path(base_dir: Path) -> Path:
+    return base_dir / "jobs.db"
+
+
+class JobQueue:
+    def __init__(
+        self, config: SIAConfig, handler: JobHandler, workers: int = 1
+    ) -> None:
+        self.config = config
+        self._handler = handler
+        self._workers = max(1, workers)
+        config.base_dir.mkdir(parents=True, exist_ok=True)
+        self._engine = enable_wal(
+            create_engine(f"sqlite:///{jobs_db_path(config.base_dir)}", future=True)
+        )
+        JobBase.metadata.create_all(self._engine)
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._requeue_interrupted()
+
+    def _requeue_interrupted(self) -> None:
+        with Session(self._engine) as session:
+            result = session.execute(
+                update(Job).where(Job.status == JOB_RUNNING).values(status=JOB_QUEUED)
+            )
+            session.commit()
+        if result.rowcount:
+            logger.info("恢复未完成任务: %s 个", result.rowcount)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop_event.clear()
+        for index in range(self._workers):
+            thread = threading.Thread(
+                target=self._loop, name=f"sia-job-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info("任务队列启动: %s (%s 线程)", self.config.base_dir, self._workers)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop_event.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        self._engine.dispose()
+
+    def submit(self, kind: str, payload: dict[str, Any], total: int = 0) -> str:
+        job_id = uuid.uuid4().hex
+        with Session(self._engine) as session:
+            session.add(
+                Job(
+                    id=job_id,
+                    kind=kind,
+                    payload=json.dumps(payload, ensure_ascii=False),
+                    total=total,
+                )
+            )
+            session.commit()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict[str, Any]]:
+        with Session(self._engine) as session:
+            job = session.get(Job, job_id)
+            return job.as_dict() if job else None
+
+    def pending(self) -> int:
+        with Session(self._engine) as session:
+            stmt = (
+                select(func.count())
+                .select_from(Job)
+                .where(Job.status.in_([JOB_QUEUED, JOB_RUNNING]))
+            )
+            return session.scalar(stmt) or 0
+
+    def _claim(self) -> Optional[tuple[str, dict[str, Any]]]:
+        with self._claim_lock, Session(self._engine) as session:
+            stmt = (
+                select(Job)
+                .where(Job.status == JOB_QUEUED)
+                .order_by(Job.created_at)
+                .limit(1)
+            )
+            job = session.scalar(stmt)
+            if job is None:
+                return None
+            job.status = JOB_RUNNING
+            job.updated_at = datetime.utcnow()
+            session.commit()
+            return job.id, json.loads(job.payload)
+
+    def _update(self, job_id: str, **values: Any) -> None:
+        values["updated_at"] = datetime.utcnow()
+        with Session(self._engine) as session:
+            session.execute(update(Job).where(Job.id == job_id).values(**values))
+            session.commit()
+
+    def _loop(self) -> None:
+        while not self._stop_event.is_set():
+            claimed = self._claim()
+            if claimed is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            job_id, payload = claimed
+            self._run(job_id, payload)
+
+    def _run(self, job_id: str, payload: dict[str, Any]) -> None:
+        def report(done: int, total: int) -> None:
+            self._update(job_id, done=done, total=total)
+
+        try:
+            result = self._handler(payload, self.config, report, job_id)
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("任务失败 %s", job_id)
+            self._update(job_id, status=JOB_FAILED, error=str(exc))
+            return
+        self._update(
+            job_id,
+            status=JOB_DONE,
+            result=json.dumps(result, ensure_ascii=False),
+        )
+        logger.info("任务完成 %s", job_id)
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from typing import Iterable, Sequence
+
+LATENCY_BUCKETS: tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+SIZE_BUCKETS: tuple[float, ...] = tuple(float(2**n * 1024) for n in range(0, 16, 2))
+THROUGHPUT_BUCKETS: tuple[float, ...] = tuple(
+    float(2**n * 1024) for n in range(4, 18, 2)
+)
+
+PHASES = ("connect", "tls", "ttfb", "body", "total")
+COUNTERS = (
+    "downloads_ok",
+    "downloads_failed",
+    "attempts",
+    "retries",
+    "bytes",
+    "content_type_rejections",
+    "resumed",
+    "cache_hits",
+    "cache_revalidated",
+    "circuit_open",
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict[str, object]:
+        cumulative = 0
+        buckets: dict[str, int] = {}
+        for bound, count in zip(
+            list(self.buckets) + ["+Inf"], self.counts, strict=True
+        ):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class DownloadMetrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.phases = {name: Histogram(LATENCY_BUCKETS) for name in PHASES}
+            self.sizes = Histogram(SIZE_BUCKETS)
+            self.throughput = Histogram(THROUGHPUT_BUCKETS)
+            self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def begin_request(self) -> None:
+        self._local.setup = 0.0
+
+    def setup_seconds(self) -> float:
+        return getattr(self._local, "setup", 0.0)
+
+    def observe_phase(self, phase: str, seconds: float) -> None:
+        if phase in ("connect", "tls"):
+            self._local.setup = self.setup_seconds() + seconds
+        with self._lock:
+            self.phases[phase].observe(seconds)
+
+    def observe_phases(self, timings: Iterable[tuple[str, float]]) -> None:
+        with self._lock:
+            for phase, seconds in timings:
+                self.phases[phase].observe(seconds)
+
+    def observe_download(self, nbytes: int, body_seconds: float) -> None:
+        with self._lock:
+            self.sizes.observe(nbytes)
+            if body_seconds > 0:
+                self.throughput.observe(nbytes / body_seconds)
+            self.counters["bytes"] += nbytes
+
+    def incr(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += amount
+
+    def snapshot(self) -> dict[str, object]:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "phases": {name: hist.snapshot() for name, hist in self.phases.items()},
+                "bytes": self.sizes.snapshot(),
+                "throughput_bps": self.throughput.snapshot(),
+            }
+
+
+METRICS = DownloadMetrics()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Optional
+
+from ..core.config import CONFIG, DownloadPolicy, SIAConfig
+from ..core.logger import get_logger
+
+logger = get_logger(__name__)
+
+MAX_TRACKED_HOSTS = 256
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(rate, 1.0))
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self.waited = 0.0
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        if self.unlimited:
+            return 0.0
+        self._refill(self._clock())
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        self.waited += delay
+        return delay
+
+    def snapshot(self) -> dict[str, float]:
+        if not self.unlimited:
+            self._refill(self._clock())
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "tokens": round(self.tokens, 3),
+            "waited_seconds": round(self.waited, 3),
+        }
+
+
+class DownloadLimiter:
+    def __init__(
+        self,
+        global_bps: float = 0,
+        host_bps: float = 0,
+        host_rps: float = 0,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.host_bps = host_bps
+        self.host_rps = host_rps
+        self._sleep = sleep
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._global_bytes = TokenBucket(global_bps, clock=clock)
+        self._host_bytes: dict[str, TokenBucket] = {}
+        self._host_requests: dict[str, TokenBucket] = {}
+        self._last_seen: dict[str, float] = {}
+
+    @classmethod
+    def from_policy(cls, policy: DownloadPolicy) -> "DownloadLimiter":
+        return cls(
+            global_bps=policy.rate_global_bps,
+            host_bps=policy.rate_host_bps,
+            host_rps=policy.rate_host_rps,
+        )
+
+    @property
+    def throttles_bytes(self) -> bool:
+        return not self._global_bytes.unlimited or self.host_bps > 0
+
+    def _bucket(
+        self, table: dict[str, TokenBucket], host: str, rate: float
+    ) -> TokenBucket:
+        bucket = table.get(host)
+        if bucket is None:
+            if len(self._last_seen) >= MAX_TRACKED_HOSTS:
+                self._forget_oldest_host()
+            bucket = table[host] = TokenBucket(rate, clock=self._clock)
+        self._last_seen[host] = self._clock()
+        return bucket
+
+    def _forget_oldest_host(self) -> None:
+        oldest = min(self._last_seen, key=self._last_seen.__getitem__)
+        self._last_seen.pop(oldest, None)
+        self._host_bytes.pop(oldest, None)
+        self._host_requests.pop(oldest, None)
+
+    def acquire_request(self, host: str) -> None:
+        if self.host_rps <= 0:
+            return
+        with self._lock:
+            delay = self._bucket(self._host_requests, host, self.host_rps).reserve(1)
+        if delay > 0:
+            self._sleep(delay)
+
+    def consume(self, host: str, nbytes: int) -> None:
+        with self._lock:
+            delay = self._global_bytes.reserve(nbytes)
+            if self.host_bps > 0:
+                delay = max(
+                    delay,
+                    self._bucket(self._host_bytes, host, self.host_bps).reserve(nbytes),
+                )
+        if delay > 0:
+            self._sleep(delay)
+
+    def snapshot(self) -> dict[str, object]:
+        with self._lock:
+            hosts: dict[str, dict[str, object]] = {}
+            for host in self._last_seen:
+                entry: dict[str, object] = {}
+                if host in self._host_bytes:
+                    entry["bytes"] = self._host_bytes[host].snapshot()
+                if host in self._host_requests:
+                    entry["requests"] = self._host_requests[host].snapshot()
+                hosts[host] = entry
+            return {
+                "global_bytes": self._global_bytes.snapshot(),
+                "host_bps": self.host_bps,
+                "host_rps": self.host_rps,
+                "hosts": hosts,
+            }
+
+
+_LIMITER: Optional[DownloadLimiter] = None
+_LIMITER_LOCK = threading.Lock()
+
+
+def get_limiter() -> DownloadLimiter:
+    global _LIMITER
+    with _LIMITER_LOCK:
+        if _LIMITER is None:
+            _LIMITER = DownloadLimiter.from_policy(CONFIG.get().download)
+        return _LIMITER
+
+
+def _reset_limiter(_config: SIAConfig) -> None:
+    global _LIMITER
+    with _LIMITER_LOCK:
+        _LIMITER = None
+
+
+CONFIG.add_listener(_reset_limiter)
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sia.core.db import Asset, Item, add_file, author_for, get_engine, session_scope
+
+START = datetime(2024, 1, 1)
+
+
+def add_image(
+    base_dir: Path,
+    rel_path: str,
+    author: str,
+    mtime: datetime = START,
+    *,
+    post_id: Optional[str] = None,
+    sha256: Optional[str] = None,
+    **item_fields: object,
+) -> str:
+    # 各测试共用的写库方式：一张图对应一条帖子与一个资源
+    with session_scope(get_engine(base_dir)) as session:
+        item = Item(
+            author=author_for(session, author),
+            post_id=post_id or Path(rel_path).stem,
+            **item_fields,
+        )
+        asset = Asset(
+            sha256=sha256 or f"sha-{rel_path}",
+            ext=Path(rel_path).suffix.lstrip("."),
+            bytes=1,
+        )
+        session.add_all([item, asset])
+        session.flush()
+        add_file(session, asset.id, rel_path, author, mtime, item_id=item.id)
+    return rel_path
+
+
+def populate(
+    base_dir: Path, count: int, start: int = 0, when: datetime = START
+) -> list[str]:
+    # 三个作者轮流，每两张共用同一秒，覆盖同一时间戳的排序
+    return [
+        add_image(
+            base_dir,
+            f"0000{number % 3}_author{number % 3}/{number:04d}.jpg",
+            f"author{number % 3}",
+            when + timedelta(seconds=number // 2),
+            post_id=f"p{number}",
+            sha256=f"{number:064x}",
+            source=f"s{number}",
+        )
+        for number in range(start, start + count)
+    ]
@@ -1,16 +1,41 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import threading
+import time
 from pathlib import Path
+from typing import Iterator
 
+import httpx
+import pytest
 from fastapi.testclient import TestClient
 
 from sia.server import api
 from sia.server.downloader import compute_signature
+from sia.server.jobs import JobQueue
 from sia.core.config import SIAConfig
+from sia.core.db import File, Item, get_engine, session_scope
 
 
-def test_save_endpoint(monkeypatch, tmp_path: Path) -> None:
+@pytest.fixture
+def job_queues() -> Iterator[None]:
+    # 断言失败时也要停掉测试里启动的任务队列
+    yield
+    api.shutdown_job_queues()
+
+
+def _wait_job(client: TestClient, job_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in {"done", "failed"}:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_save_endpoint(monkeypatch, tmp_path: Path, job_queues) -> None:
     base_dir = tmp_path / "gallery"
     cfg = SIAConfig(base_dir=base_dir, hmac_key="secret")
 
@@ -30,6 +55,7 @@ def test_save_endpoint(monkeypatch, tmp_path: Path) -> None:
         "postId": "p1",
         "images": ["http://example.com/image.jpg"],
         "source": "src",
+        "caption": "海边 sunset",
     }
     body = json.dumps(payload, ensure_ascii=False).encode()
     signature = compute_signature(cfg.hmac_key, body)
@@ -38,8 +64,200 @@ def test_save_endpoint(monkeypatch, tmp_path: Path) -> None:
         content=body,
         headers={"X-Signature": signature, "Content-Type": "application/json"},
     )
-    assert response.status_code == 200
-    data = response.json()
+    assert response.status_code == 202
+    job = _wait_job(client, response.json()["job_id"])
+    assert job["status"] == "done"
+    assert job["done"] == job["total"] == 1
+    data = job["result"]
     assert data["ok"] is True
     saved_path = Path(data["saved"][0])
     assert saved_path.exists()
+    found = client.get("/api/items", params={"q": "suns"}).json()
+    assert [item["post_id"] for item in found["items"]] == ["p1"]
+
+
+def test_save_endpoint_parallel_partial_failure(
+    monkeypatch, tmp_path: Path, job_queues
+) -> None:
+    base_dir = tmp_path / "gallery"
+    cfg = SIAConfig(base_dir=base_dir, hmac_key="secret", concurrency=4)
+
+    monkeypatch.setattr(api.CONFIG, "get", lambda: cfg)
+
+    def fake_download(url: str, dst: Path, *_args, **_kwargs):
+        if url.endswith("bad.jpg"):
+            raise ValueError("boom")
+        data = url.encode()
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(data)
+        return (url[-8:].rjust(64, "0"), len(data), "image/jpeg")
+
+    monkeypatch.setattr(api, "download_strict", fake_download)
+
+    client = TestClient(api.app)
+    payload = {
+        "author": "tester",
+        "postId": "p2",
+        "images": [
+            "http://example.com/a.jpg",
+            "http://example.com/bad.jpg",
+            "http://example.com/c.jpg",
+        ],
+    }
+    body = json.dumps(payload).encode()
+    response = client.post(
+        "/save",
+        content=body,
+        headers={
+            "X-Signature": compute_signature(cfg.hmac_key, body),
+            "Content-Type": "application/json",
+        },
+    )
+    assert response.status_code == 202
+    data = _wait_job(client, response.json()["job_id"])["result"]
+    assert data["ok"] is False
+    assert [Path(p).name for p in data["saved"]] == [
+        "00001_tester_001.jpg",
+        "00001_tester_003.jpg",
+    ]
+    assert data["failed"] == [{"url": "http://example.com/bad.jpg", "error": "boom"}]
+
+
+def test_replayed_save_job_skips_recorded_work(monkeypatch, tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path / "gallery")
+    calls: list[str] = []
+
+    def fake_download(url: str, dst: Path, *_args, **_kwargs):
+        calls.append(url)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(b"data")
+        return ("c" * 64, 4, "image/jpeg")
+
+    monkeypatch.setattr(api, "download_strict", fake_download)
+    payload = {
+        "author": "tester",
+        "postId": "p3",
+        "images": ["http://example.com/x.jpg"],
+    }
+    first = api.process_save(payload, cfg, job_id="job1")
+    # 模拟写库后、标记完成前崩溃：重启后同一任务再次执行
+    replayed = api.process_save(payload, cfg, job_id="job1")
+    assert calls == ["http://example.com/x.jpg"]
+    assert replayed["saved"] == first["saved"]
+    with session_scope(get_engine(cfg.base_dir)) as session:
+        assert session.query(Item).count() == 1
+        assert session.query(File).count() == 1
+    assert sorted(path.name for path in (cfg.base_dir / "00001_tester").iterdir()) == [
+        "00001_tester_001.jpg"
+    ]
+
+
+def test_blob_adoption_runs_outside_writer_thread(monkeypatch, tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path / "gallery", enable_hardlinks=True)
+    threads: list[str] = []
+
+    def fake_download(url: str, dst: Path, *_args, **_kwargs):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(b"data")
+        return ("d" * 64, 4, "image/jpeg")
+
+    monkeypatch.setattr(api, "download_strict", fake_download)
+    monkeypatch.setattr(
+        api.BlobStore,
+        "adopt",
+        lambda _self, _path, _sha: threads.append(threading.current_thread().name),
+    )
+    result = api.process_save(
+        {"author": "tester", "postId": "p4", "images": ["http://example.com/y.jpg"]},
+        cfg,
+    )
+    assert result["ok"] is True
+    assert threads and "sia-db-writer" not in threads
+
+
+def test_exact_duplicates_are_not_perceptually_hashed(
+    monkeypatch, tmp_path: Path
+) -> None:
+    from PIL import Image
+
+    cfg = SIAConfig(base_dir=tmp_path / "gallery")
+    hashed: list[str] = []
+    dhash = api.dhash
+
+    def fake_download(url: str, dst: Path, *_args, **_kwargs):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (16, 16), "red").save(dst, format="PNG")
+        return ("f" * 64, dst.stat().st_size, "image/png")
+
+    def counting_dhash(path: Path) -> int:
+        hashed.append(path.name)
+        return dhash(path)
+
+    monkeypatch.setattr(api, "download_strict", fake_download)
+    monkeypatch.setattr(api, "dhash", counting_dhash)
+    api.process_save(
+        {"author": "tester", "postId": "p5", "images": ["http://example.com/a.png"]},
+        cfg,
+    )
+    second = api.process_save(
+        {"author": "tester", "postId": "p6", "images": ["http://example.com/b.png"]},
+        cfg,
+    )
+    assert hashed == ["00001_tester_001.png"]
+    assert len(second["duplicates"]) == 1
+
+
+def test_unknown_job_returns_404(monkeypatch, tmp_path: Path, job_queues) -> None:
+    cfg = SIAConfig(base_dir=tmp_path / "gallery")
+    monkeypatch.setattr(api.CONFIG, "get", lambda: cfg)
+    client = TestClient(api.app)
+    assert client.get("/api/jobs/missing").status_code == 404
+
+
+def test_slow_save_does_not_block_other_requests(
+    monkeypatch, tmp_path: Path, job_queues
+) -> None:
+    cfg = SIAConfig(base_dir=tmp_path / "gallery", hmac_key="secret")
+    monkeypatch.setattr(api.CONFIG, "get", lambda: cfg)
+    submit = JobQueue.submit
+
+    def slow_submit(self, *args, **kwargs):
+        time.sleep(1.0)
+        return submit(self, *args, **kwargs)
+
+    monkeypatch.setattr(JobQueue, "submit", slow_submit)
+    monkeypatch.setattr(
+        api, "download_strict", lambda *_args, **_kwargs: ("b" * 64, 4, "image/jpeg")
+    )
+    body = json.dumps(
+        {"author": "tester", "postId": "p1", "images": ["http://example.com/a.jpg"]}
+    ).encode()
+    headers = {
+        "X-Signature": compute_signature(cfg.hmac_key, body),
+        "Content-Type": "application/json",
+    }
+
+    async def scenario() -> tuple[float, float, int]:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://sia"
+        ) as client:
+            assert (await client.get("/api/items")).status_code == 200
+            save = asyncio.create_task(
+                client.post("/save", content=body, headers=headers)
+            )
+            await asyncio.sleep(0.1)
+            began = time.perf_counter()
+            items = await client.get("/api/items")
+            items_latency = time.perf_counter() - began
+            began = time.perf_counter()
+            await client.get("/healthz")
+            health_latency = time.perf_counter() - began
+            assert items.status_code == 200
+            assert not save.done()
+            return items_latency, health_latency, (await save).status_code
+
+    items_latency, health_latency, status = asyncio.run(scenario())
+    assert status == 202
+    assert items_latency < 0.3
+    assert health_latency < 0.3
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from datetime import datetime
+from pathlib import Path
+
+from sia.core.blobstore import BlobStore, migrate_library
+from sia.core.config import SIAConfig
+from sia.core.db import Asset, add_file, get_engine, session_scope
+
+
+def test_adopt_links_duplicates(tmp_path: Path) -> None:
+    data = b"same-bytes"
+    sha = hashlib.sha256(data).hexdigest()
+    first = tmp_path / "a" / "one.jpg"
+    second = tmp_path / "b" / "two.jpg"
+    for path in (first, second):
+        path.parent.mkdir(parents=True)
+        path.write_bytes(data)
+    store = BlobStore(tmp_path)
+    assert store.adopt(first, sha) is False
+    assert store.adopt(second, sha) is True
+    assert os.path.samefile(first, second)
+    assert os.path.samefile(first, store.path_for(sha))
+
+
+def test_migrate_library_converts_duplicates(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    data = b"repost"
+    sha = hashlib.sha256(data).hexdigest()
+    rel_paths = ["00001_a/00001_a_001.jpg", "00002_b/00002_b_001.jpg"]
+    for rel in rel_paths:
+        (tmp_path / rel).parent.mkdir(parents=True)
+        (tmp_path / rel).write_bytes(data)
+    with session_scope(get_engine(tmp_path)) as session:
+        asset = Asset(sha256=sha, ext="jpg", bytes=len(data))
+        session.add(asset)
+        session.flush()
+        for rel in rel_paths:
+            add_file(session, asset.id, rel, rel[6:7], datetime.utcnow())
+
+    preview = migrate_library(cfg, dry_run=True)
+    assert preview.linked == 1
+    assert not os.path.samefile(tmp_path / rel_paths[0], tmp_path / rel_paths[1])
+
+    report = migrate_library(cfg)
+    assert report.linked == 1
+    assert report.bytes_reclaimed == len(data)
+    assert os.path.samefile(tmp_path / rel_paths[0], tmp_path / rel_paths[1])
+    assert migrate_library(cfg).linked == 0
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import http.server
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from sia.server.breaker import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreakers,
+    CircuitOpenError,
+    parse_retry_after,
+)
+from sia.server.downloader import SessionPool, download_strict
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_probes_and_recovers() -> None:
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=2, reset_seconds=10, clock=clock)
+    breakers.before_request("cdn")
+    breakers.record_failure("cdn")
+    assert breakers.state("cdn") == STATE_CLOSED
+    breakers.record_failure("cdn")
+    assert breakers.state("cdn") == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        breakers.before_request("cdn")
+
+    clock.now += 10
+    breakers.before_request("cdn")
+    assert breakers.state("cdn") == STATE_HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breakers.before_request("cdn")
+    breakers.record_failure("cdn")
+    assert breakers.snapshot()["cdn"]["retry_in"] == 20
+
+    clock.now += 20
+    breakers.before_request("cdn")
+    breakers.record_success("cdn")
+    assert breakers.state("cdn") == STATE_CLOSED
+
+
+def test_retry_after_opens_for_server_hint() -> None:
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=5, reset_seconds=30, clock=clock)
+    breakers.record_failure("cdn", retry_after=3)
+    assert breakers.snapshot()["cdn"]["retry_in"] == 3
+
+
+def test_parse_retry_after() -> None:
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert parse_retry_after("5") == 5
+    assert parse_retry_after("Mon, 01 Jan 2024 00:00:07 GMT", now=now) == 7
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+class UnavailableHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hits = 0
+
+    def log_message(self, *_args) -> None:  # type: ignore[override]
+        pass
+
+    def do_GET(self) -> None:  # type: ignore[override]
+        type(self).hits += 1
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_open_circuit_fails_fast(tmp_path: Path) -> None:
+    UnavailableHandler.hits = 0
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), UnavailableHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    breakers = CircuitBreakers(failure_threshold=2, reset_seconds=60)
+    url = f"http://127.0.0.1:{server.server_port}/x.jpg"
+    try:
+        with pytest.raises(CircuitOpenError):
+            download_strict(
+                url,
+                tmp_path / "x.jpg",
+                {"image/jpeg"},
+                timeout=5,
+                max_attempts=5,
+                pool=SessionPool(),
+                backoff=0.01,
+                breakers=breakers,
+            )
+        with pytest.raises(CircuitOpenError):
+            download_strict(
+                url,
+                tmp_path / "y.jpg",
+                {"image/jpeg"},
+                timeout=5,
+                max_attempts=5,
+                pool=SessionPool(),
+                backoff=0.01,
+                breakers=breakers,
+            )
+    finally:
+        server.shutdown()
+    assert UnavailableHandler.hits == 2
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from sia.core import db, migrations
+from sia.core.config import SIAConfig
+from sia.core.db import Item, dispose_engines, get_engine, session_scope
+
+
+def test_engine_is_cached_per_resolved_base_dir(tmp_path: Path, monkeypatch) -> None:
+    engine = get_engine(tmp_path)
+    monkeypatch.chdir(tmp_path.parent)
+    assert get_engine(Path(tmp_path.name)) is engine
+    assert get_engine(tmp_path / "sub" / "..") is engine
+    assert get_engine(tmp_path / "other") is not engine
+
+
+def test_schema_setup_runs_once(tmp_path: Path, monkeypatch) -> None:
+    calls: list[object] = []
+    migrate = migrations.migrate
+    monkeypatch.setattr(
+        migrations, "migrate", lambda engine: calls.append(engine) or migrate(engine)
+    )
+    for _ in range(5):
+        get_engine(tmp_path)
+    assert len(calls) == 1
+
+
+def test_missing_database_file_is_recreated(tmp_path: Path) -> None:
+    engine = get_engine(tmp_path)
+    engine.dispose()
+    os.remove(tmp_path / db.DB_NAME)
+    fresh = get_engine(tmp_path)
+    assert fresh is not engine
+    with session_scope(fresh) as session:
+        assert session.query(Item).count() == 0
+
+
+def test_base_dir_change_disposes_other_engines(tmp_path: Path) -> None:
+    old = get_engine(tmp_path / "old")
+    new = get_engine(tmp_path / "new")
+    db._reset_engines(SIAConfig(base_dir=tmp_path / "new"))
+    assert get_engine(tmp_path / "new") is new
+    assert get_engine(tmp_path / "old") is not old
+    assert dispose_engines() >= 2
@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+import hashlib
 import http.server
+import json
 import threading
+from datetime import datetime
 from pathlib import Path
 
 import pytest
 
-from sia.server.downloader import download_strict
+from sia.core.config import SIAConfig
+from sia.core.db import Asset, add_file, get_engine, session_scope
+from sia.core.urlcache import UrlAssetCache, daily_stats
+from sia.server.downloader import SessionPool, download_strict
+from sia.server.metrics import METRICS
 
 
 class ImageHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_args) -> None:  # type: ignore[override]
+        pass
+
     def do_GET(self) -> None:  # type: ignore[override]
         if self.path != "/image.jpg":
             self.send_response(404)
@@ -46,3 +58,242 @@ def test_download_strict(tmp_path: Path, image_server: str) -> None:
     assert size == dst.stat().st_size
     assert content_type == "image/jpeg"
     assert len(sha) == 64
+
+
+def test_download_reuses_pooled_connection(tmp_path: Path, image_server: str) -> None:
+    pool = SessionPool(max_origins=2, per_host=2)
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        download_strict(
+            image_server,
+            tmp_path / name,
+            {"image/jpeg"},
+            timeout=5,
+            max_attempts=1,
+            pool=pool,
+        )
+    stats = pool.stats()
+    assert stats["origins"] == 1
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 2
+    pool.close()
+    assert pool.stats()["connections_reused"] == 2
+
+
+def test_session_pool_evicts_least_recent_origin() -> None:
+    pool = SessionPool(max_origins=1)
+    pool.session_for("http://a.example/x.jpg")
+    pool.session_for("http://b.example/y.jpg")
+    stats = pool.stats()
+    assert stats["origins"] == 1
+    assert stats["sessions_evicted"] == 1
+
+
+class FlakyRangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = bytes(range(256)) * 64
+    ranges: list[str] = []
+
+    def log_message(self, *_args) -> None:  # type: ignore[override]
+        pass
+
+    def do_GET(self) -> None:  # type: ignore[override]
+        header = self.headers.get("Range")
+        type(self).ranges.append(header or "")
+        if header is None:
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(self.data)))
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(self.data[: len(self.data) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        start = int(header.split("=")[1].rstrip("-"))
+        body = self.data[start:]
+        self.send_response(206)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(
+            "Content-Range", f"bytes {start}-{len(self.data) - 1}/{len(self.data)}"
+        )
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_download_resumes_partial_file(tmp_path: Path) -> None:
+    FlakyRangeHandler.ranges = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyRangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        dst = tmp_path / "big.png"
+        sha, size, _ = download_strict(
+            f"http://127.0.0.1:{server.server_port}/big.png",
+            dst,
+            {"image/png"},
+            timeout=5,
+            max_attempts=2,
+            pool=SessionPool(),
+        )
+    finally:
+        server.shutdown()
+    half = len(FlakyRangeHandler.data) // 2
+    assert FlakyRangeHandler.ranges == ["", f"bytes={half}-"]
+    assert size == len(FlakyRangeHandler.data)
+    assert dst.read_bytes() == FlakyRangeHandler.data
+    assert sha == hashlib.sha256(FlakyRangeHandler.data).hexdigest()
+    assert not (tmp_path / "big.png.part").exists()
+    assert not (tmp_path / "big.png.part.json").exists()
+
+
+class MisalignedRangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = bytes(range(256)) * 4
+    ranges: list[str] = []
+
+    def log_message(self, *_args) -> None:  # type: ignore[override]
+        pass
+
+    def do_GET(self) -> None:  # type: ignore[override]
+        header = self.headers.get("Range")
+        type(self).ranges.append(header or "")
+        if header is None:
+            status, body = 200, self.data
+        else:
+            status, body = 206, self.data[500:600]
+        self.send_response(status)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes 500-599/{len(self.data)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_download_restarts_when_range_misaligned(tmp_path: Path) -> None:
+    MisalignedRangeHandler.ranges = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MisalignedRangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/asset.png"
+    dst = tmp_path / "asset.png"
+    (tmp_path / "asset.png.part").write_bytes(MisalignedRangeHandler.data[:300])
+    (tmp_path / "asset.png.part.json").write_text(json.dumps({"url": url}))
+    try:
+        sha, size, _ = download_strict(
+            url,
+            dst,
+            {"image/png"},
+            timeout=5,
+            max_attempts=2,
+            pool=SessionPool(),
+            backoff=0,
+        )
+    finally:
+        server.shutdown()
+    assert MisalignedRangeHandler.ranges == ["bytes=300-", ""]
+    assert size == len(MisalignedRangeHandler.data)
+    assert dst.read_bytes() == MisalignedRangeHandler.data
+    assert sha == hashlib.sha256(MisalignedRangeHandler.data).hexdigest()
+
+
+def test_download_restarts_when_range_ignored(
+    tmp_path: Path, image_server: str
+) -> None:
+    dst = tmp_path / "image.jpg"
+    (tmp_path / "image.jpg.part").write_bytes(b"stale")
+    (tmp_path / "image.jpg.part.json").write_text(json.dumps({"url": image_server}))
+    sha, size, _ = download_strict(
+        image_server,
+        dst,
+        {"image/jpeg"},
+        timeout=5,
+        max_attempts=1,
+        pool=SessionPool(),
+    )
+    assert dst.read_bytes() == b"\xff\xd8JPEGDATA"
+    assert sha == hashlib.sha256(b"\xff\xd8JPEGDATA").hexdigest()
+    assert size == len(b"\xff\xd8JPEGDATA")
+
+
+class EtagHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = b"\x89PNGcached"
+    requests_seen: list[str] = []
+
+    def log_message(self, *_args) -> None:  # type: ignore[override]
+        pass
+
+    def do_GET(self) -> None:  # type: ignore[override]
+        conditional = self.headers.get("If-None-Match")
+        type(self).requests_seen.append(conditional or "")
+        if conditional == '"abc"':
+            self.send_response(304)
+            self.send_header("ETag", '"abc"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(self.data)))
+        self.send_header("ETag", '"abc"')
+        self.end_headers()
+        self.wfile.write(self.data)
+
+
+def test_known_url_skips_or_revalidates_download(tmp_path: Path) -> None:
+    EtagHandler.requests_seen = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), EtagHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/cached.png"
+    cfg = SIAConfig(base_dir=tmp_path)
+    pool = SessionPool()
+
+    def fetch(name: str, cache: UrlAssetCache) -> tuple:
+        return download_strict(
+            url, tmp_path / "a" / name, {"image/png"}, 5, 1, pool=pool, cache=cache
+        )
+
+    try:
+        sha, size, _ = fetch("first.png", UrlAssetCache(cfg))
+        with session_scope(get_engine(tmp_path)) as session:
+            asset = Asset(sha256=sha, ext="png", bytes=size)
+            session.add(asset)
+            session.flush()
+            add_file(session, asset.id, "a/first.png", "a", datetime.utcnow())
+        assert fetch("second.png", UrlAssetCache(cfg))[0] == sha
+        cfg.download.url_cache_fresh_seconds = 0
+        assert fetch("third.png", UrlAssetCache(cfg))[0] == sha
+    finally:
+        server.shutdown()
+    assert EtagHandler.requests_seen == ["", '"abc"']
+    assert (tmp_path / "a" / "second.png").read_bytes() == EtagHandler.data
+    assert (tmp_path / "a" / "third.png").read_bytes() == EtagHandler.data
+    stats = daily_stats(cfg)
+    assert stats[0]["hits"] == 2
+    assert stats[0]["revalidated"] == 1
+    assert stats[0]["bytes_saved"] == 2 * len(EtagHandler.data)
+
+
+def test_download_records_metrics(tmp_path: Path, image_server: str) -> None:
+    METRICS.reset()
+    download_strict(
+        image_server, tmp_path / "m.jpg", {"image/jpeg"}, 5, 1, pool=SessionPool()
+    )
+    with pytest.raises(ValueError):
+        download_strict(
+            image_server, tmp_path / "n.jpg", {"image/png"}, 5, 1, pool=SessionPool()
+        )
+    snapshot = METRICS.snapshot()
+    counters = snapshot["counters"]
+    assert counters["downloads_ok"] == 1
+    assert counters["downloads_failed"] == 1
+    assert counters["attempts"] == 2
+    assert counters["content_type_rejections"] == 1
+    assert counters["bytes"] == len(b"\xff\xd8JPEGDATA")
+    assert snapshot["phases"]["connect"]["count"] == 2
+    assert snapshot["phases"]["body"]["count"] == 1
+    assert snapshot["phases"]["ttfb"]["count"] == 1
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import struct
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from sia.core.config import SIAConfig
+from sia.core.db import Asset, add_file, get_engine, session_scope
+from sia.core.imagemeta import HeaderSniffer, backfill_metadata, parse_header
+
+
+def _exif_tiff(taken: str) -> bytes:
+    value = taken.encode() + b"\x00"
+    ifd0 = (
+        struct.pack("<H", 1)
+        + struct.pack("<HHII", 0x8769, 4, 1, 26)
+        + struct.pack("<I", 0)
+    )
+    exif_ifd = (
+        struct.pack("<H", 1)
+        + struct.pack("<HHII", 0x9003, 2, len(value), 44)
+        + struct.pack("<I", 0)
+    )
+    return b"II*\x00" + struct.pack("<I", 8) + ifd0 + exif_ifd + value
+
+
+def make_jpeg(width: int, height: int, taken: str) -> bytes:
+    app1 = b"Exif\x00\x00" + _exif_tiff(taken)
+    sof = b"\x08" + struct.pack(">HH", height, width) + b"\x03" + b"\x00" * 9
+    return (
+        b"\xff\xd8"
+        + b"\xff\xe1"
+        + struct.pack(">H", len(app1) + 2)
+        + app1
+        + b"\xff\xc0"
+        + struct.pack(">H", len(sof) + 2)
+        + sof
+        + b"\xff\xda"
+        + b"\x00" * 64
+    )
+
+
+def make_png(width: int, height: int) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = (
+        struct.pack(">I", len(ihdr))
+        + b"IHDR"
+        + ihdr
+        + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    )
+    return b"\x89PNG\r\n\x1a\n" + chunk + struct.pack(">I", 0) + b"IDAT" + b"\x00" * 4
+
+
+def test_parse_headers() -> None:
+    jpeg = parse_header(make_jpeg(640, 480, "2023:05:06 07:08:09"))
+    assert (jpeg.width, jpeg.height) == (640, 480)
+    assert jpeg.exif_taken_at == datetime(2023, 5, 6, 7, 8, 9)
+    png = parse_header(make_png(32, 16))
+    assert (png.width, png.height) == (32, 16)
+    gif = parse_header(b"GIF89a" + struct.pack("<HH", 7, 9) + b"\x00" * 8)
+    assert (gif.width, gif.height) == (7, 9)
+    webp = (
+        b"RIFF"
+        + b"\x00" * 4
+        + b"WEBPVP8X"
+        + b"\x00" * 8
+        + (99).to_bytes(3, "little")
+        + (49).to_bytes(3, "little")
+    )
+    meta = parse_header(webp)
+    assert (meta.width, meta.height) == (100, 50)
+    assert parse_header(b"\xff\xd8\xff") is None
+
+
+def test_sniffer_handles_streamed_chunks() -> None:
+    data = make_jpeg(1920, 1080, "2020:01:02 03:04:05")
+    sniffer = HeaderSniffer()
+    for start in range(0, len(data), 7):
+        sniffer.feed(data[start : start + 7])
+        if sniffer.done:
+            break
+    assert sniffer.done
+    assert (sniffer.result.width, sniffer.result.height) == (1920, 1080)
+
+
+def test_backfill_metadata(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "one.png").write_bytes(make_png(12, 34))
+    with session_scope(get_engine(tmp_path)) as session:
+        asset = Asset(sha256="x" * 64, ext="png", bytes=1)
+        session.add(asset)
+        session.flush()
+        add_file(session, asset.id, "a/one.png", "a", datetime.utcnow())
+    assert backfill_metadata(cfg, workers=1) == 1
+    with session_scope(get_engine(tmp_path)) as session:
+        asset = session.query(Asset).one()
+        assert (asset.width, asset.height) == (12, 34)
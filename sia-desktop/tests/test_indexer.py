@@ -1,38 +1,163 @@
 from __future__ import annotations
 
+import json
+import sqlite3
 from datetime import datetime
 from pathlib import Path
 
+import pytest
+from conftest import START, add_image
+
 from sia.core import indexer
 from sia.core.config import SIAConfig
-from sia.core.db import Asset, File, Item, get_engine, session_scope
-
-
-def create_sample(base_dir: Path) -> None:
-    engine = get_engine(base_dir)
-    with session_scope(engine) as session:
-        item = Item(author="tester", post_id="p1", source="src")
-        session.add(item)
-        asset = Asset(sha256="sha", ext="jpg", bytes=1, width=None, height=None)
-        session.add(asset)
-        session.flush()
-        file_entry = File(
-            asset_id=asset.id,
-            rel_path="00001_tester/00001_tester_001.jpg",
-            folder="tester",
-            mtime=datetime.utcnow(),
-        )
-        session.add(file_entry)
-        session.commit()
+from sia.core.db import File, get_engine, session_scope
 
 
 def test_build_index(tmp_path: Path) -> None:
     base_dir = tmp_path / "gallery"
     base_dir.mkdir()
     cfg = SIAConfig(base_dir=base_dir)
-    create_sample(base_dir)
+    add_image(
+        base_dir,
+        "00001_tester/00001_tester_001.jpg",
+        "tester",
+        datetime.utcnow(),
+        post_id="p1",
+        source="src",
+    )
     index_path = indexer.build_index(cfg)
     data = index_path.read_text(encoding="utf-8")
     assert "tester" in data
     result = indexer.paginate(page=1, page_size=10, config=cfg)
     assert result["total"] >= 1
+
+
+def create_many(base_dir: Path, count: int) -> None:
+    for number in range(count):
+        add_image(
+            base_dir,
+            f"00001_tester/00001_tester_{number:03d}.jpg",
+            "tester",
+            START.replace(minute=number // 2),
+        )
+
+
+def test_paginate_offset_and_cursor_agree(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    create_many(tmp_path, 25)
+    pages = [indexer.paginate(page=n, page_size=10, config=cfg) for n in (1, 2, 3)]
+    assert [page["total"] for page in pages] == [25, 25, 25]
+    assert [len(page["items"]) for page in pages] == [10, 10, 5]
+    by_offset = [item["path"] for page in pages for item in page["items"]]
+
+    by_cursor: list[str] = []
+    cursor = ""
+    while cursor is not None:
+        result = indexer.paginate(page_size=10, config=cfg, cursor=cursor)
+        by_cursor += [item["path"] for item in result["items"]]
+        cursor = result["next_cursor"]
+    assert by_cursor == by_offset
+    assert len(set(by_cursor)) == 25
+
+
+def test_paginate_rejects_bad_cursor(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    with pytest.raises(ValueError):
+        indexer.paginate(config=cfg, cursor="not-a-cursor")
+
+
+def test_index_has_one_row_per_file_with_its_post(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    for number in range(3):
+        add_image(
+            tmp_path,
+            f"00001_tester/00001_tester_{number:03d}.jpg",
+            "tester",
+            datetime(2024, 1, 1, number),
+            post_id=f"p{number}",
+        )
+    data = json.loads(indexer.build_index(cfg).read_text(encoding="utf-8"))
+    assert [(row["path"][-7:], row["post_id"]) for row in data] == [
+        ("002.jpg", "p2"),
+        ("001.jpg", "p1"),
+        ("000.jpg", "p0"),
+    ]
+    assert indexer.paginate(page_size=10, config=cfg)["total"] == 3
+
+
+def test_legacy_files_are_linked_to_posts(tmp_path: Path) -> None:
+    conn = sqlite3.connect(tmp_path / "sia.db")
+    conn.executescript("""
+        CREATE TABLE assets (id INTEGER PRIMARY KEY, sha256 VARCHAR(128) NOT NULL UNIQUE,
+            ext VARCHAR(16) NOT NULL, bytes INTEGER NOT NULL, width INTEGER, height INTEGER,
+            exif_taken_at DATETIME, created_at DATETIME NOT NULL);
+        CREATE TABLE items (id INTEGER PRIMARY KEY, author VARCHAR(128) NOT NULL,
+            post_id VARCHAR(128) NOT NULL, source VARCHAR(512), saved_at DATETIME NOT NULL);
+        CREATE TABLE files (id INTEGER PRIMARY KEY, asset_id INTEGER NOT NULL REFERENCES assets(id),
+            rel_path VARCHAR(512) NOT NULL UNIQUE, folder VARCHAR(256) NOT NULL, mtime DATETIME NOT NULL);
+        INSERT INTO assets VALUES (1, 'a', 'jpg', 1, NULL, NULL, NULL, '2024-01-01 00:00:00.000000');
+        INSERT INTO items VALUES (1, 'tester', 'p1', NULL, '2024-01-01 10:00:00.000000');
+        INSERT INTO items VALUES (2, 'tester', 'p2', NULL, '2024-01-02 10:00:00.000000');
+        INSERT INTO files VALUES (1, 1, 'x/early.jpg', 'tester', '2024-01-01 09:00:00.000000');
+        INSERT INTO files VALUES (2, 1, 'x/first.jpg', 'tester', '2024-01-01 10:00:05.000000');
+        INSERT INTO files VALUES (3, 1, 'x/second.jpg', 'tester', '2024-01-02 10:00:05.000000');
+        """)
+    conn.commit()
+    conn.close()
+    with session_scope(get_engine(tmp_path)) as session:
+        linked = {f.rel_path: f.item.post_id for f in session.query(File)}
+    assert linked == {"x/early.jpg": "p1", "x/first.jpg": "p1", "x/second.jpg": "p2"}
+
+
+def test_incremental_update_merges_without_rebuild(monkeypatch, tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    create_many(tmp_path, 10)
+    expected_path = indexer.build_index(cfg)
+    add_image(tmp_path, "00001_tester/newest.jpg", "tester", datetime(2030, 1, 1))
+    add_image(
+        tmp_path, "00001_tester/middle.jpg", "tester", datetime(2024, 1, 1, 0, 2, 30)
+    )
+    with session_scope(get_engine(tmp_path)) as session:
+        session.delete(session.query(File).filter(File.name.endswith("_000.jpg")).one())
+
+    def no_rebuild(*_args, **_kwargs):
+        raise AssertionError("unexpected full rebuild")
+
+    monkeypatch.setattr(indexer, "build_index", no_rebuild)
+    indexer.incremental_update(
+        [
+            str(tmp_path / "00001_tester" / "newest.jpg"),
+            "00001_tester/middle.jpg",
+            "00001_tester/00001_tester_000.jpg",
+        ],
+        config=cfg,
+    )
+    merged = json.loads(expected_path.read_text(encoding="utf-8"))
+    monkeypatch.undo()
+    rebuilt = json.loads(indexer.build_index(cfg).read_text(encoding="utf-8"))
+    assert merged == rebuilt
+    assert merged[0]["path"] == "00001_tester/newest.jpg"
+    assert not list(tmp_path.glob(".images.json.*"))
+
+
+def test_incremental_update_rebuilds_inconsistent_manifest(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    create_many(tmp_path, 5)
+    path = indexer.build_index(cfg)
+    path.write_text(
+        json.dumps(json.loads(path.read_text(encoding="utf-8"))[:2]), encoding="utf-8"
+    )
+    add_image(tmp_path, "00001_tester/newest.jpg", "tester", datetime(2030, 1, 1))
+    indexer.incremental_update(["00001_tester/newest.jpg"], config=cfg)
+    assert len(json.loads(path.read_text(encoding="utf-8"))) == 6
+
+
+def test_build_index_streams_compact_json(monkeypatch, tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    assert json.loads(indexer.build_index(cfg).read_text(encoding="utf-8")) == []
+    monkeypatch.setattr(indexer, "STREAM_BATCH", 3)
+    create_many(tmp_path, 10)
+    text = indexer.build_index(cfg).read_text(encoding="utf-8")
+    data = json.loads(text)
+    assert len(data) == 10 and len(text.splitlines()) == 12
+    assert '"path":"00001_tester/' in text
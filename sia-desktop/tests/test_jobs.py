@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+
+from sia.core.config import SIAConfig
+from sia.server.jobs import JobQueue
+
+
+def test_queued_jobs_survive_restart(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path / "gallery")
+    seen: list[dict] = []
+    finished = threading.Event()
+
+    def handler(payload, _config, report, _job_id):
+        report(1, 1)
+        seen.append(payload)
+        finished.set()
+        return {"echo": payload["n"]}
+
+    first = JobQueue(cfg, handler)
+    job_id = first.submit("save", {"n": 7}, total=1)
+    first.stop()
+
+    second = JobQueue(cfg, handler)
+    assert second.pending() == 1
+    second.start()
+    assert finished.wait(5)
+    second.stop()
+
+    third = JobQueue(cfg, handler)
+    job = third.get(job_id)
+    assert seen == [{"n": 7}]
+    assert job is not None
+    assert job["status"] == "done"
+    assert job["result"] == {"echo": 7}
+    assert job["done"] == job["total"] == 1
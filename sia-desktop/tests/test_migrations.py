@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+
+from conftest import START, add_image
+from sqlalchemy import create_engine, event, text
+
+from sia.core import indexer, phash
+from sia.core.config import SIAConfig
+from sia.core.db import (
+    File,
+    count_files_by_author,
+    get_engine,
+    get_read_engine,
+    last_inserted_item,
+    session_scope,
+)
+from sia.core.migrations import SCHEMA_VERSION, VERSION_TABLE, migrate
+from sia.core.thumbnails import ThumbnailService
+from sia.core.urlcache import UrlAssetCache
+
+FULL_SCAN = re.compile(r"^SCAN (?!files_fts)\w+$")
+
+
+def _versions(engine) -> list[int]:
+    with engine.connect() as conn:
+        return [
+            row[0]
+            for row in conn.execute(
+                text(f"SELECT version FROM {VERSION_TABLE} ORDER BY version")
+            )
+        ]
+
+
+def _indexes(engine, table: str) -> set[str]:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"
+            ),
+            {"t": table},
+        )
+        return {row[0] for row in rows}
+
+
+def test_new_database_is_stamped_and_migrate_is_idempotent(tmp_path: Path) -> None:
+    engine = get_engine(tmp_path)
+    assert _versions(engine) == list(range(1, SCHEMA_VERSION + 1))
+    assert migrate(engine) == []
+    assert {"ix_files_mtime", "ix_files_author", "ix_files_asset_id"} <= _indexes(
+        engine, "files"
+    )
+    assert {"ix_items_author_saved_at", "ix_items_saved_at"} <= _indexes(
+        engine, "items"
+    )
+
+
+def test_partially_migrated_database_only_runs_pending_steps(tmp_path: Path) -> None:
+    engine = get_engine(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {VERSION_TABLE} WHERE version > 3"))
+        conn.execute(text("DROP INDEX ix_files_author"))
+        conn.execute(text("DROP INDEX ix_items_saved_at"))
+    fresh = create_engine(f"sqlite:///{tmp_path / 'sia.db'}")
+    try:
+        assert migrate(fresh) == list(range(4, SCHEMA_VERSION + 1))
+        assert "ix_files_author" in _indexes(fresh, "files")
+        assert "ix_items_saved_at" in _indexes(fresh, "items")
+    finally:
+        fresh.dispose()
+
+
+def _seed(base_dir: Path) -> None:
+    for author in ("alice", "bob"):
+        for n in range(3):
+            rel = f"{author}/{author}_{n:03d}.jpg"
+            add_image(
+                base_dir,
+                rel,
+                author,
+                START + timedelta(minutes=n),
+                sha256=f"{author}{n}".ljust(64, "0"),
+                saved_at=START,
+            )
+
+
+def test_hot_queries_use_indexes(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    _seed(tmp_path)
+    engine = get_read_engine(tmp_path)
+    captured: list[tuple[str, object]] = []
+
+    def capture(_conn, _cursor, statement, parameters, _context, _many) -> None:
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        cursor = indexer.paginate(page_size=2, config=cfg, cursor="")["next_cursor"]
+        indexer.paginate(page_size=2, config=cfg, cursor=cursor)
+        indexer.paginate(page=2, page_size=2, config=cfg)
+        indexer.paginate(page_size=2, author="alice", config=cfg)
+        indexer.paginate(page_size=2, author="alice", config=cfg, cursor=cursor)
+        list(indexer._iter_index_rows(cfg))
+        list(indexer._iter_index_rows(cfg, by_author=True))
+        indexer._file_counts(cfg)
+        phash.files_for(cfg, ["alice0".ljust(64, "0")])
+        ThumbnailService(cfg).source_for("alice0".ljust(64, "0"))
+        UrlAssetCache(cfg).lookup("http://example.com/a.jpg")
+        with session_scope(engine) as session:
+            count_files_by_author(session, "alice")
+            last_inserted_item(session)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert len(captured) >= 13
+    with get_engine(tmp_path).connect() as conn:
+        for statement, parameters in captured:
+            plan = [
+                row[3]
+                for row in conn.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters
+                )
+            ]
+            scans = [step for step in plan if FULL_SCAN.match(step)]
+            assert not scans, f"全表扫描 {scans}: {statement}"
+            if "ORDER BY files.mtime DESC" in statement and "LIMIT" in statement:
+                assert not any(
+                    "TEMP B-TREE" in step for step in plan
+                ), f"排序未走索引 {plan}: {statement}"
+
+
+def test_legacy_layout_is_normalized(tmp_path: Path) -> None:
+    sha = "ab" * 32
+    conn = sqlite3.connect(tmp_path / "sia.db")
+    conn.executescript(f"""
+        CREATE TABLE assets (id INTEGER PRIMARY KEY, sha256 VARCHAR(128) NOT NULL UNIQUE,
+            ext VARCHAR(16) NOT NULL, bytes INTEGER NOT NULL, width INTEGER, height INTEGER,
+            exif_taken_at DATETIME, created_at DATETIME NOT NULL);
+        CREATE TABLE items (id INTEGER PRIMARY KEY, author VARCHAR(128) NOT NULL,
+            post_id VARCHAR(128) NOT NULL, source VARCHAR(512), saved_at DATETIME NOT NULL);
+        CREATE TABLE files (id INTEGER PRIMARY KEY, asset_id INTEGER NOT NULL REFERENCES assets(id),
+            rel_path VARCHAR(512) NOT NULL UNIQUE, folder VARCHAR(256) NOT NULL, mtime DATETIME NOT NULL);
+        INSERT INTO assets VALUES (1, '{sha}', 'jpg', 1, NULL, NULL, NULL, '2024-01-01 00:00:00.000000');
+        INSERT INTO assets VALUES (2, 'legacy', 'jpg', 1, NULL, NULL, NULL, '2024-01-01 00:00:00.000000');
+        INSERT INTO items VALUES (1, 'alice', 'sunset', NULL, '2024-01-01 10:00:00.000000');
+        INSERT INTO items VALUES (2, 'carol', 'nofiles', NULL, '2024-01-01 10:00:00.000000');
+        INSERT INTO files VALUES (1, 1, '00001_alice/00001_alice_001.jpg', 'alice', '2024-01-01 10:00:05.000000');
+        INSERT INTO files VALUES (2, 2, '00001_alice\\00001_alice_002.jpg', 'alice', '2024-01-01 10:00:06.000000');
+        INSERT INTO files VALUES (3, 2, 'loose.jpg', 'bob', '2024-01-01 10:00:07.000000');
+        """)
+    conn.commit()
+    conn.close()
+    engine = get_engine(tmp_path)
+    assert _versions(engine) == list(range(1, SCHEMA_VERSION + 1))
+    with engine.connect() as conn:
+        authors = conn.execute(
+            text("SELECT name, folder FROM authors ORDER BY name")
+        ).all()
+        digest = conn.execute(text("SELECT sha256 FROM assets WHERE id = 1")).scalar()
+    assert authors == [("alice", "00001_alice"), ("bob", ""), ("carol", None)]
+    assert digest == bytes.fromhex(sha)
+    with session_scope(engine) as session:
+        paths = {
+            f.rel_path: (f.author.name, f.asset.sha256) for f in session.query(File)
+        }
+        assert paths == {
+            "00001_alice/00001_alice_001.jpg": ("alice", sha),
+            "00001_alice/00001_alice_002.jpg": ("alice", "legacy"),
+            "loose.jpg": ("bob", "legacy"),
+        }
+        assert count_files_by_author(session, "alice") == 2
+    cfg = SIAConfig(base_dir=tmp_path)
+    found = indexer.paginate(query="loose", config=cfg)["items"]
+    assert [item["path"] for item in found] == ["loose.jpg"]
+    assert phash.files_for(cfg, [sha]) == {sha: ["00001_alice/00001_alice_001.jpg"]}
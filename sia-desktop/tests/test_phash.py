@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import hashlib
+import random
+import sqlite3
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sia.core import phash
+from sia.core.config import SIAConfig
+from sia.core.db import Asset, add_file, get_engine, session_scope
+from sia.core.phash import (
+    MultiIndexHash,
+    dhash,
+    format_hash,
+    get_duplicate_index,
+    hamming,
+)
+from sia.server import api
+
+
+def test_multi_index_matches_brute_force() -> None:
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    base = values[0]
+    values += [
+        base ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for _ in range(20)
+    ]
+    tree = MultiIndexHash()
+    for number, value in enumerate(values):
+        tree.add(value, f"k{number}")
+    for distance in (0, 3, 6, 8, 13, 16):
+        for probe in (base, values[5], rng.getrandbits(64)):
+            expected = sorted(
+                (hamming(probe, value), f"k{number}")
+                for number, value in enumerate(values)
+                if hamming(probe, value) <= distance
+            )
+            assert tree.search(probe, distance) == expected
+    assert len(tree) == len(values)
+
+
+def test_lookup_stays_sub_millisecond_at_100k() -> None:
+    rng = random.Random(11)
+    tree = MultiIndexHash()
+    values = [rng.getrandbits(64) for _ in range(100_000)]
+    for number, value in enumerate(values):
+        tree.add(value, f"k{number}")
+    probes = [
+        values[rng.randrange(len(values))] ^ (1 << rng.randrange(64))
+        for _ in range(200)
+    ]
+    samples = []
+    for probe in probes:
+        began = time.perf_counter()
+        tree.search(probe, 6)
+        samples.append(time.perf_counter() - began)
+    assert statistics.median(samples) < 0.001
+
+
+def test_groups_are_cached_per_generation(tmp_path: Path, monkeypatch) -> None:
+    index = get_duplicate_index(SIAConfig(base_dir=tmp_path))
+    rng = random.Random(3)
+    for number in range(5000):
+        index.add(f"{number:064x}", rng.getrandbits(64))
+    base = rng.getrandbits(64)
+    index.add("a" * 64, base)
+    index.add("b" * 64, base ^ 0b101)
+    began = time.perf_counter()
+    groups = index.groups(6)
+    assert time.perf_counter() - began < 2
+    assert ["a" * 64, "b" * 64] in groups
+    assert index.groups(6) is groups
+    index.add("c" * 64, base ^ 0b1)
+    regrouped = index.groups(6)
+    assert regrouped is not groups
+    assert ["a" * 64, "b" * 64, "c" * 64] in regrouped
+
+
+def test_get_engine_adds_new_nullable_columns(tmp_path: Path) -> None:
+    conn = sqlite3.connect(tmp_path / "sia.db")
+    conn.execute(
+        "CREATE TABLE assets (id INTEGER PRIMARY KEY, sha256 VARCHAR(128) NOT NULL UNIQUE, "
+        "ext VARCHAR(16) NOT NULL, bytes INTEGER NOT NULL, width INTEGER, height INTEGER, "
+        "exif_taken_at DATETIME, created_at DATETIME NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+    engine = get_engine(tmp_path)
+    with session_scope(engine) as session:
+        session.add(
+            Asset(sha256="a" * 64, ext="jpg", bytes=1, phash="00ff00ff00ff00ff")
+        )
+    with session_scope(engine) as session:
+        assert session.query(Asset).one().phash == "00ff00ff00ff00ff"
+
+
+def _add_asset(base_dir: Path, name: str, image) -> str:
+    path = base_dir / "00001_a" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path)
+    sha = hashlib.sha256(path.read_bytes()).hexdigest()
+    with session_scope(get_engine(base_dir)) as session:
+        asset = Asset(
+            sha256=sha,
+            ext=path.suffix[1:],
+            bytes=path.stat().st_size,
+            phash=format_hash(dhash(path)),
+        )
+        session.add(asset)
+        session.flush()
+        add_file(session, asset.id, f"00001_a/{name}", "a", datetime.utcnow())
+    return sha
+
+
+def test_resized_copy_is_near_duplicate(monkeypatch, tmp_path: Path) -> None:
+    pil_image = pytest.importorskip("PIL.Image")
+    rng = random.Random(3)
+    coarse = pil_image.new("L", (16, 12))
+    coarse.putdata([rng.randrange(256) for _ in range(16 * 12)])
+    picture = coarse.resize((400, 300), pil_image.BILINEAR).convert("RGB")
+    original = _add_asset(tmp_path, "orig.png", picture)
+    resized = _add_asset(tmp_path, "small.jpg", picture.resize((120, 90)))
+    other = _add_asset(
+        tmp_path, "other.png", picture.transpose(pil_image.Transpose.FLIP_LEFT_RIGHT)
+    )
+
+    cfg = SIAConfig(base_dir=tmp_path)
+    monkeypatch.setattr(api.CONFIG, "get", lambda: cfg)
+    index = get_duplicate_index(cfg)
+    assert len(index) == 3
+
+    client = TestClient(api.app)
+    data = client.get(f"/api/duplicates?sha256={original}&distance=6").json()
+    assert [match["sha256"] for match in data["matches"]] == [resized]
+    assert data["matches"][0]["files"] == ["00001_a/small.jpg"]
+
+    report = client.get("/api/duplicates").json()
+    assert report["total"] == 1
+    assert sorted(member["sha256"] for member in report["groups"][0]) == sorted(
+        [original, resized]
+    )
+    assert other not in {member["sha256"] for member in report["groups"][0]}
+
+    assert client.get(f"/api/duplicates?sha256={'0' * 64}").status_code == 404
+    assert client.get("/api/duplicates?distance=99").status_code == 400
+
+
+def test_base_dir_change_drops_other_duplicate_indexes(tmp_path: Path) -> None:
+    old = get_duplicate_index(SIAConfig(base_dir=tmp_path / "old"))
+    new = get_duplicate_index(SIAConfig(base_dir=tmp_path / "new"))
+    phash._reset_duplicate_indexes(SIAConfig(base_dir=tmp_path / "new"))
+    assert get_duplicate_index(SIAConfig(base_dir=tmp_path / "new")) is new
+    assert get_duplicate_index(SIAConfig(base_dir=tmp_path / "old")) is not old
+    assert phash.reset_duplicate_indexes() >= 2
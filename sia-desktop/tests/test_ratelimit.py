@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from sia.server.ratelimit import DownloadLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.slept: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_charges_debt() -> None:
+    clock = FakeClock()
+    bucket = TokenBucket(100, burst=100, clock=clock)
+    assert bucket.reserve(100) == 0
+    assert bucket.reserve(50) == 0.5
+    clock.now += 1.5
+    assert bucket.reserve(50) == 0
+
+
+def test_limiter_applies_global_and_host_budgets() -> None:
+    clock = FakeClock()
+    limiter = DownloadLimiter(
+        global_bps=1000, host_bps=500, host_rps=1, sleep=clock.sleep, clock=clock
+    )
+    limiter.acquire_request("a.example")
+    limiter.acquire_request("a.example")
+    assert clock.slept == [1.0]
+    limiter.consume("a.example", 1000)
+    assert clock.slept[-1] == 1.0
+    limiter.consume("b.example", 500)
+    snapshot = limiter.snapshot()
+    assert set(snapshot["hosts"]) == {"a.example", "b.example"}
+    assert snapshot["hosts"]["a.example"]["requests"]["rate"] == 1
+
+
+def test_unlimited_limiter_never_sleeps() -> None:
+    clock = FakeClock()
+    limiter = DownloadLimiter(sleep=clock.sleep, clock=clock)
+    assert not limiter.throttles_bytes
+    limiter.acquire_request("a.example")
+    limiter.consume("a.example", 10**9)
+    assert clock.slept == []
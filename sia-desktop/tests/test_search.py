@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+
+from conftest import START, add_image
+from sqlalchemy import text
+
+from sia.core import indexer
+from sia.core.config import SIAConfig
+from sia.core.db import (
+    File,
+    Item,
+    dispose_engines,
+    get_engine,
+    rebuild_search_index,
+    session_scope,
+)
+
+
+def _paths(cfg: SIAConfig, query: str) -> list[str]:
+    return [
+        item["path"]
+        for item in indexer.paginate(page_size=50, query=query, config=cfg)["items"]
+    ]
+
+
+def test_search_matches_tokens_prefixes_and_captions(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    add_image(
+        tmp_path,
+        "00001_alice/alice_001.jpg",
+        "alice",
+        START + timedelta(minutes=1),
+        post_id="9001",
+        source="https://example.com/9001",
+        caption="sunset over the harbour",
+    )
+    add_image(
+        tmp_path,
+        "00001_alice/alice_002.jpg",
+        "alice",
+        START + timedelta(minutes=2),
+        post_id="9002",
+        source="https://example.com/9002",
+        caption="morning coffee",
+    )
+    add_image(
+        tmp_path,
+        "00001_bob/bob_001.jpg",
+        "bob",
+        START + timedelta(minutes=3),
+        post_id="7001",
+        source="https://example.com/7001",
+        caption="harbour harbour boats",
+    )
+
+    assert _paths(cfg, "harb") == ["00001_bob/bob_001.jpg", "00001_alice/alice_001.jpg"]
+    assert _paths(cfg, "alice coffee") == ["00001_alice/alice_002.jpg"]
+    assert _paths(cfg, "900") == [
+        "00001_alice/alice_002.jpg",
+        "00001_alice/alice_001.jpg",
+    ]
+    assert _paths(cfg, "example.com/7001") == ["00001_bob/bob_001.jpg"]
+    assert _paths(cfg, '"') == _paths(cfg, "")
+    assert indexer.paginate(query="harbour", config=cfg)["total"] == 2
+    cursor_page = indexer.paginate(query="alice", config=cfg, cursor="")
+    assert [item["path"] for item in cursor_page["items"]] == [
+        "00001_alice/alice_002.jpg",
+        "00001_alice/alice_001.jpg",
+    ]
+
+
+def test_triggers_follow_caption_edits_and_deletes(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    add_image(
+        tmp_path,
+        "00001_alice/alice_001.jpg",
+        "alice",
+        post_id="1",
+        source="https://example.com/1",
+        caption="before",
+    )
+    with session_scope(get_engine(tmp_path)) as session:
+        session.query(Item).one().caption = "after"
+    assert _paths(cfg, "before") == []
+    assert _paths(cfg, "after") == ["00001_alice/alice_001.jpg"]
+    with session_scope(get_engine(tmp_path)) as session:
+        session.delete(session.query(File).one())
+    assert _paths(cfg, "after") == []
+
+
+def test_existing_database_gets_search_index(tmp_path: Path) -> None:
+    add_image(
+        tmp_path,
+        "00001_alice/alice_001.jpg",
+        "alice",
+        post_id="1",
+        source="https://example.com/1",
+    )
+    conn = sqlite3.connect(tmp_path / "sia.db")
+    conn.executescript("""
+        DROP TABLE files_fts;
+        DROP TRIGGER IF EXISTS files_fts_ai;
+        DROP TRIGGER IF EXISTS files_fts_ad;
+        DROP TRIGGER IF EXISTS files_fts_au;
+        DROP TRIGGER IF EXISTS items_fts_au;
+        DROP TABLE schema_version;
+        """)
+    conn.close()
+    # 模拟重启：引擎缓存按进程保留，重新打开才会补建索引
+    dispose_engines()
+    engine = get_engine(tmp_path)
+    assert _paths(SIAConfig(base_dir=tmp_path), "alice") == [
+        "00001_alice/alice_001.jpg"
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM files_fts"))
+    assert rebuild_search_index(engine) == 1
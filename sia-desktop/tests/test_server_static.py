@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import gzip
 from pathlib import Path
 
+import pytest
 from fastapi.testclient import TestClient
 
+from sia.core import indexer
 from sia.core.config import SIAConfig
 from sia.server.api import app
 
@@ -49,3 +52,68 @@ def test_outside_gallery_blocked(tmp_path, monkeypatch):
     client = TestClient(app)
     resp = client.get("/../secret.txt")
     assert resp.status_code == 404
+
+
+def test_images_json_precompressed_with_etag(tmp_path, monkeypatch):
+    cfg = _set_config(tmp_path, monkeypatch)
+    indexer.build_index(cfg)
+    plain = (cfg.base_dir / "images.json").read_bytes()
+    assert gzip.decompress((cfg.base_dir / "images.json.gz").read_bytes()) == plain
+
+    client = TestClient(app)
+    resp = client.get("/images.json", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["vary"] == "Accept-Encoding"
+    assert resp.content == plain
+    etag = resp.headers["etag"]
+
+    cached = client.get(
+        "/images.json", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    identity = client.get(
+        "/images.json", headers={"Accept-Encoding": "gzip;q=0, br;q=0"}
+    )
+    assert "content-encoding" not in identity.headers
+    assert identity.headers["etag"] == etag.replace("-gzip", "")
+    assert (
+        client.get("/images.json", headers={"If-None-Match": '"stale"'}).status_code
+        == 200
+    )
+
+
+def test_images_json_brotli(tmp_path, monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    cfg = _set_config(tmp_path, monkeypatch)
+    indexer.build_index(cfg)
+    raw = (cfg.base_dir / "images.json.br").read_bytes()
+    assert brotli.decompress(raw) == (cfg.base_dir / "images.json").read_bytes()
+    resp = TestClient(app).get("/images.json", headers={"Accept-Encoding": "gzip, br"})
+    assert resp.headers["content-encoding"] == "br"
+
+
+def test_manifest_etag_is_replaced_after_every_body(tmp_path, monkeypatch):
+    cfg = _set_config(tmp_path, monkeypatch)
+    replaced: list[str] = []
+    original = indexer.os.replace
+
+    def record(src, dst) -> None:
+        replaced.append(Path(dst).name)
+        original(src, dst)
+
+    monkeypatch.setattr(indexer.os, "replace", record)
+    indexer.build_index(cfg)
+    bodies = [
+        name
+        for name in replaced
+        if name.startswith("images.json") and not name.endswith(".etag")
+    ]
+    assert {"images.json", "images.json.gz"} <= set(bodies)
+    assert all(
+        replaced.index(body) < replaced.index("images.json.etag") for body in bodies
+    )
+    assert indexer.manifest_etag(cfg.base_dir / "images.json")
+    assert not list(cfg.base_dir.glob(".images.json*"))
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from conftest import populate
+from fastapi.testclient import TestClient
+
+from sia.core import indexer, shards
+from sia.core.config import SIAConfig
+from sia.server import api
+
+
+def _load(base_dir: Path, rel: str) -> object:
+    return json.loads(
+        (base_dir / shards.MANIFEST_DIR / rel).read_text(encoding="utf-8")
+    )
+
+
+def test_build_index_writes_root_and_shards(monkeypatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(shards, "SHARD_SIZE", 4)
+    cfg = SIAConfig(base_dir=tmp_path)
+    populate(tmp_path, 10)
+    images = json.loads(indexer.build_index(cfg).read_text(encoding="utf-8"))
+
+    root = _load(tmp_path, shards.ROOT_NAME)
+    assert root["total"] == 10
+    assert [shard["count"] for shard in root["shards"]] == [2, 4, 4]
+    streamed = [
+        entry for shard in root["shards"] for entry in _load(tmp_path, shard["file"])
+    ]
+    assert streamed == images
+
+    by_author = {row["author"]: row for row in root["authors"]}
+    assert sorted(by_author) == ["author0", "author1", "author2"]
+    assert by_author["author0"]["count"] == 4
+    author_entries = [
+        entry
+        for rel in by_author["author0"]["shards"]
+        for entry in _load(tmp_path, rel)
+    ]
+    assert author_entries == [entry for entry in images if entry["author"] == "author0"]
+    assert by_author["author0"]["cover"] == author_entries[0]
+
+
+def test_appending_rewrites_only_the_newest_shard(monkeypatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(shards, "SHARD_SIZE", 4)
+    cfg = SIAConfig(base_dir=tmp_path)
+    populate(tmp_path, 9)
+    indexer.build_index(cfg)
+    before = [shard["file"] for shard in _load(tmp_path, shards.ROOT_NAME)["shards"]]
+
+    populate(tmp_path, 1, start=9)
+    indexer.incremental_update(["00000_author0/0009.jpg"], config=cfg)
+    after = [shard["file"] for shard in _load(tmp_path, shards.ROOT_NAME)["shards"]]
+    assert len(before) == len(after) == 3
+    assert after[1:] == before[1:]
+    assert after[0] != before[0]
+
+    client = TestClient(api.app)
+    monkeypatch.setattr(api.CONFIG, "get", lambda: cfg)
+    response = client.get(f"/{shards.MANIFEST_DIR}/{after[0]}")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    assert len(response.json()) == 2
+    assert client.get(f"/{shards.MANIFEST_DIR}/shards/missing.json").status_code == 404
+
+
+def test_incremental_update_streams_and_keeps_untouched_author_shards(
+    monkeypatch, tmp_path: Path
+) -> None:
+    monkeypatch.setattr(shards, "SHARD_SIZE", 4)
+    cfg = SIAConfig(base_dir=tmp_path)
+    populate(tmp_path, 12)
+    indexer.build_index(cfg)
+    before = {
+        row["author"]: row for row in _load(tmp_path, shards.ROOT_NAME)["authors"]
+    }
+
+    loads = json.loads
+
+    def line_loads(text, *args, **kwargs):
+        assert not text.lstrip().startswith("["), "整份 images.json 被一次性解析"
+        return loads(text, *args, **kwargs)
+
+    populate(tmp_path, 1, start=12)
+    monkeypatch.setattr(indexer.json, "loads", line_loads)
+    indexer.incremental_update(["00000_author0/0012.jpg"], config=cfg)
+    monkeypatch.setattr(indexer.json, "loads", loads)
+
+    root = _load(tmp_path, shards.ROOT_NAME)
+    after = {row["author"]: row for row in root["authors"]}
+    assert (
+        after["author1"] == before["author1"] and after["author2"] == before["author2"]
+    )
+    assert after["author0"]["count"] == 5
+    assert after["author0"]["cover"]["path"] == "00000_author0/0012.jpg"
+    streamed = [
+        entry for shard in root["shards"] for entry in _load(tmp_path, shard["file"])
+    ]
+    assert streamed == json.loads(
+        (tmp_path / "images.json").read_text(encoding="utf-8")
+    )
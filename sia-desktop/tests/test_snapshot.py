@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from conftest import populate
+
+from sia.core import indexer, renamer, snapshot
+from sia.core.config import SIAConfig
+
+
+def _walk(fetch) -> list[str]:
+    paths, cursor = [], ""
+    while cursor is not None:
+        page = fetch(cursor)
+        paths += [item["path"] for item in page["items"]]
+        cursor = page["next_cursor"]
+    return paths
+
+
+def test_snapshot_matches_sql_pagination(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    populate(tmp_path, 23)
+    snap = snapshot.GallerySnapshot(cfg)
+    for author in (None, "author1", "missing"):
+        for page in (1, 2, 3, 4):
+            expected = indexer.paginate(
+                page=page, page_size=7, author=author, config=cfg
+            )
+            got = snap.paginate(page=page, page_size=7, author=author)
+            assert got.pop("generation") == 1
+            assert got == expected
+        assert _walk(
+            lambda c, author=author: snap.paginate(page_size=5, author=author, cursor=c)
+        ) == _walk(
+            lambda c, author=author: indexer.paginate(
+                page_size=5, author=author, config=cfg, cursor=c
+            )
+        )
+    assert snap.author_counts() == {"author0": 8, "author1": 8, "author2": 7}
+
+
+def test_snapshot_serves_without_sqlite_and_appends_in_place(
+    monkeypatch, tmp_path: Path
+) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    populate(tmp_path, 5)
+    snap = snapshot.GallerySnapshot(cfg)
+    assert len(snap) == 5
+
+    def no_db(*_args, **_kwargs):
+        raise AssertionError("snapshot read touched SQLite")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(snapshot, "get_read_engine", no_db)
+        assert snap.paginate(page_size=2)["total"] == 5
+
+    added = populate(tmp_path, 2, start=5, when=datetime(2025, 1, 1))
+    snap.add_saved(added)
+    assert snap.generation == 2
+    assert [item["path"] for item in snap.paginate(page_size=2)["items"]] == added[::-1]
+    assert (
+        snap.paginate(page_size=10)["items"]
+        == indexer.paginate(page_size=10, config=cfg)["items"]
+    )
+
+
+def test_renamer_updates_database_and_snapshot(monkeypatch, tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    monkeypatch.setattr(snapshot, "_SNAPSHOTS", {})
+    (old,) = populate(tmp_path, 1)
+    source = tmp_path / old
+    source.parent.mkdir(parents=True)
+    source.write_bytes(b"x")
+    snap = snapshot.get_gallery_snapshot(cfg)
+    assert snap.paginate()["items"][0]["path"] == old
+    manifest = indexer.build_index(cfg)
+
+    plan = renamer.RenamePlan(
+        source=source, destination=source.with_name("00000_001.jpg")
+    )
+    renamer.apply([plan], preview=False, config=cfg)
+    renamed = "00000_author0/00000_001.jpg"
+    assert snap.paginate()["items"][0]["path"] == renamed
+    assert snap.generation == 2
+    assert indexer.paginate(config=cfg)["items"][0]["path"] == renamed
+    assert [
+        entry["path"] for entry in json.loads(manifest.read_text(encoding="utf-8"))
+    ] == [renamed]
+
+
+def test_snapshot_rename_swaps_paths_in_one_batch(tmp_path: Path) -> None:
+    first, second = populate(tmp_path, 2)
+    snap = snapshot.GallerySnapshot(SIAConfig(base_dir=tmp_path))
+    assert len(snap) == 2
+    assert snap.rename([(first, second), (second, first)]) == 2
+    paths = [item["path"] for item in snap.paginate()["items"]]
+    assert paths == [first, second]
+    assert snap.rename([("missing.jpg", "other.jpg")]) == 0
+
+
+def test_snapshot_rejects_bad_cursor(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        snapshot.GallerySnapshot(SIAConfig(base_dir=tmp_path)).paginate(cursor="bogus")
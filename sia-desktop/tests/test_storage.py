@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from sia.core.db import Item, author_for, get_engine, get_read_engine, session_scope
+from sia.core.storage import SQLiteWriter
+
+
+def _add(author: str):
+    return lambda session: session.add(
+        Item(author=author_for(session, author), post_id="p")
+    )
+
+
+def _count(base_dir: Path) -> int:
+    with session_scope(get_read_engine(base_dir)) as session:
+        return session.query(Item).count()
+
+
+def test_engines_use_wal_and_pragmas(tmp_path: Path) -> None:
+    with get_engine(tmp_path).connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA cache_size").scalar() < 0
+
+
+def test_read_engine_rejects_writes(tmp_path: Path) -> None:
+    with get_read_engine(tmp_path).connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA query_only").scalar() == 1
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO authors (name) VALUES ('a')"))
+
+
+def test_writes_are_grouped_into_few_commits(tmp_path: Path) -> None:
+    writer = SQLiteWriter(tmp_path, window=0.05)
+    try:
+        futures = [writer.submit(_add(f"a{n}")) for n in range(100)]
+        for future in futures:
+            future.result(timeout=10)
+        assert writer.jobs == 100
+        assert writer.commits < 10
+        assert _count(tmp_path) == 100
+    finally:
+        writer.stop()
+
+
+def test_failed_write_only_rolls_back_itself(tmp_path: Path) -> None:
+    writer = SQLiteWriter(tmp_path, window=0.05)
+
+    def broken(session) -> None:
+        session.add(Item(author=author_for(session, "broken"), post_id="p"))
+        session.flush()
+        raise ValueError("boom")
+
+    try:
+        before = writer.submit(_add("before"))
+        failed = writer.submit(broken)
+        after = writer.submit(_add("after"))
+        before.result(timeout=10)
+        after.result(timeout=10)
+        with pytest.raises(ValueError):
+            failed.result(timeout=10)
+        with session_scope(get_read_engine(tmp_path)) as session:
+            assert sorted(item.author.name for item in session.query(Item)) == [
+                "after",
+                "before",
+            ]
+    finally:
+        writer.stop()
+
+
+def test_concurrent_writers_and_readers_do_not_lock(tmp_path: Path) -> None:
+    writer = SQLiteWriter(tmp_path)
+    stop = threading.Event()
+    reads: list[int] = []
+
+    def read_loop() -> None:
+        while not stop.is_set():
+            reads.append(_count(tmp_path))
+
+    def burst(worker: int) -> None:
+        for n in range(25):
+            writer.run(_add(f"w{worker}-{n}"), timeout=10)
+
+    reader = threading.Thread(target=read_loop)
+    reader.start()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(burst, range(8)))
+    finally:
+        stop.set()
+        reader.join()
+        writer.stop()
+    assert _count(tmp_path) == 200
+    assert reads and reads == sorted(reads)
+
+
+def test_stopped_writer_rejects_and_fails_leftover_jobs(tmp_path: Path) -> None:
+    writer = SQLiteWriter(tmp_path)
+    release = threading.Event()
+    blocked = writer.submit(lambda _session: release.wait(5))
+    # 绕过 submit 直接放入结束标记，模拟结束标记之后仍残留的任务
+    writer._queue.put(None)
+    leftover = writer.submit(_add("late"))
+    release.set()
+    assert blocked.result(5) is True
+    with pytest.raises(RuntimeError):
+        leftover.result(5)
+    writer.stop()
+    with pytest.raises(RuntimeError):
+        writer.submit(_add("after"))
+    assert _count(tmp_path) == 0
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import hashlib
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sia.core import thumbnails
+from sia.core.config import SIAConfig
+from sia.core.db import Asset, add_file, get_engine, session_scope
+from sia.core.thumbnails import ThumbnailService, shutdown_thumbnail_services
+from sia.server import api
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _add_image(base_dir: Path, name: str, color: tuple[int, int, int]) -> str:
+    path = base_dir / "00001_a" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (800, 600), color).save(path, "PNG")
+    sha = hashlib.sha256(path.read_bytes()).hexdigest()
+    with session_scope(get_engine(base_dir)) as session:
+        asset = Asset(sha256=sha, ext="png", bytes=path.stat().st_size)
+        session.add(asset)
+        session.flush()
+        add_file(session, asset.id, f"00001_a/{name}", "a", datetime.utcnow())
+    return sha
+
+
+def test_thumb_endpoint_generates_and_caches(monkeypatch, tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path)
+    monkeypatch.setattr(api.CONFIG, "get", lambda: cfg)
+    sha = _add_image(tmp_path, "one.png", (200, 10, 10))
+    client = TestClient(api.app)
+    try:
+        resp = client.get(f"/thumb/{sha}/160")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "image/webp"
+        assert "immutable" in resp.headers["cache-control"]
+        cached = tmp_path / ".cache" / "thumbs" / sha[:2] / f"{sha}_160.webp"
+        assert cached.exists()
+        with Image.open(cached) as thumb:
+            assert max(thumb.size) == 160
+        assert client.get(f"/thumb/{sha}/123").status_code == 404
+        assert client.get(f"/thumb/{'0' * 64}/160").status_code == 404
+    finally:
+        shutdown_thumbnail_services()
+
+
+def test_thumbnail_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cfg = SIAConfig(base_dir=tmp_path, thumb_cache_mb=0)
+    first = _add_image(tmp_path, "one.png", (10, 200, 10))
+    second = _add_image(tmp_path, "two.png", (10, 10, 200))
+    service = ThumbnailService(cfg, workers=1)
+    try:
+        assert service.get(first, 160) is not None
+        assert service.get(second, 160) is not None
+        service.shutdown()
+        assert not service.path_for(first, 160).exists()
+        assert service.path_for(second, 160).exists()
+        assert service.usage()["files"] == 1
+    finally:
+        service.shutdown()
+
+
+def test_cancelled_thumbnail_is_dropped_without_error(
+    monkeypatch, tmp_path: Path
+) -> None:
+    logged: list[str] = []
+    monkeypatch.setattr(
+        thumbnails.logger, "info", lambda message, *_args: logged.append(message)
+    )
+    monkeypatch.setattr(
+        thumbnails.logger, "warning", lambda message, *_args: logged.append(message)
+    )
+    service = ThumbnailService(SIAConfig(base_dir=tmp_path), workers=1)
+    path = service.path_for("0" * 64, 160)
+    future: Future[int] = Future()
+    service._inflight[path] = future
+    future.add_done_callback(lambda done: service._finished(path, done))
+    assert future.cancel()
+    assert path not in service._inflight
+    assert service.usage()["files"] == 0
+    assert logged == ["缩略图任务已取消 %s"]
+
+
+def test_render_keeps_alpha_and_cleans_up(monkeypatch, tmp_path: Path) -> None:
+    source = tmp_path / "la.png"
+    Image.new("LA", (64, 64), (255, 0)).save(source, "PNG")
+    target = tmp_path / "thumbs" / "la.webp"
+    thumbnails.render_thumbnail(str(source), str(target), 32)
+    with Image.open(target) as thumb:
+        assert thumb.mode == "RGBA"
+        assert thumb.getpixel((0, 0))[3] == 0
+
+    def failing_save(self, fp, *_args, **_kwargs) -> None:
+        Path(fp).write_bytes(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Image.Image, "save", failing_save)
+    with pytest.raises(OSError):
+        thumbnails.render_thumbnail(str(source), str(target.with_name("b.webp")), 32)
+    assert sorted(path.name for path in target.parent.iterdir()) == ["la.webp"]
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from sia.core.config import SIAConfig
+from sia.core.watcher import Watcher
+
+
+def test_only_gallery_moves_are_recorded(tmp_path: Path) -> None:
+    watcher = Watcher(lambda _paths: None, config=SIAConfig(base_dir=tmp_path))
+    folder = tmp_path / "00000_author"
+    assert watcher._is_gallery_move(folder / "a.jpg", folder / "b.jpg")
+    assert not watcher._is_gallery_move(folder / "a.jpg.part", folder / "a.jpg")
+    assert not watcher._is_gallery_move(folder / "a.jpg.link", folder / "a.jpg")
+    assert not watcher._is_gallery_move(
+        tmp_path / ".images.json.1.tmp", tmp_path / "images.json"
+    )
+    assert not watcher._is_gallery_move(
+        tmp_path / ".manifest" / "a.json", tmp_path / ".manifest" / "b.json"
+    )
+    assert not watcher._is_gallery_move(folder / "a.jpg", tmp_path.parent / "a.jpg")